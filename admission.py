@@ -0,0 +1,120 @@
+from collections import deque
+from time import monotonic
+
+"""
+AdmissionPolicy and AdmissionMetrics classes that decide when a lobby stops accepting players and keep track of how
+fast lobbies fill. A lobby closes as soon as it is full, after a quiet period without joins, or at a hard deadline
+counted from its first player, so a steady stream of joiners can no longer keep a game from ever starting.
+"""
+
+
+class AdmissionPolicy:
+    def __init__(self, min_players=1, max_players=None, idle_timeout=10, lobby_deadline=60):
+        """
+        Initializes the AdmissionPolicy class.
+        param:
+            min_players (int, optional): Players needed before a lobby may close. Defaults to 1.
+            max_players (int, optional): Players at which a lobby closes right away; None for no limit.
+                Defaults to None.
+            idle_timeout (float, optional): Seconds without a new join after which a lobby closes. Defaults to 10.
+            lobby_deadline (float, optional): Seconds after its first join at which a lobby closes even if players
+                keep joining. Defaults to 60.
+        """
+        self.min_players = min_players
+        self.max_players = max_players
+        self.idle_timeout = idle_timeout
+        self.lobby_deadline = lobby_deadline
+
+    def is_full(self, player_count):
+        """
+        Args:
+            player_count (int): Number of players in the lobby.
+        Returns:
+            bool: True if the lobby reached max_players.
+        """
+        return self.max_players is not None and player_count >= self.max_players
+
+    def seconds_until_close(self, player_count, first_join, last_join, now=None):
+        """
+        Computes how long the lobby stays open if nobody else joins.
+        Args:
+            player_count (int): Number of players in the lobby.
+            first_join (float): monotonic() time of the first join, or None if the lobby is empty.
+            last_join (float): monotonic() time of the latest join, or None if the lobby is empty.
+            now (float, optional): The current monotonic() time. Defaults to now.
+        Returns:
+            float: Seconds until the lobby closes, 0 if it should close now, or None while it lacks players.
+        """
+        if self.is_full(player_count):
+            return 0
+        if player_count < max(self.min_players, 1):
+            return None
+        if now is None:
+            now = monotonic()
+        return max(0, min(last_join + self.idle_timeout, first_join + self.lobby_deadline) - now)
+
+    def lobby_closed(self, player_count, first_join, last_join, now=None):
+        """
+        Args:
+            player_count (int): Number of players in the lobby.
+            first_join (float): monotonic() time of the first join, or None if the lobby is empty.
+            last_join (float): monotonic() time of the latest join, or None if the lobby is empty.
+            now (float, optional): The current monotonic() time. Defaults to now.
+        Returns:
+            bool: True if the lobby should stop accepting players.
+        """
+        return self.seconds_until_close(player_count, first_join, last_join, now) == 0
+
+
+class AdmissionMetrics:
+    HISTORY = 100  # Number of recent lobbies the averages are computed over
+
+    def __init__(self, server_metrics=None):
+        """
+        Initializes the AdmissionMetrics class.
+        param:
+            server_metrics (metrics.ServerMetrics, optional): Where joins, fill times and lobby sizes are also
+                recorded, so they are scraped with the other metrics. Defaults to None, kept for the log only.
+        """
+        self.server_metrics = server_metrics
+        self.joins = 0  # Players admitted since the server started
+        self.lobbies = 0  # Lobbies closed since the server started
+        self.recent = deque(maxlen=AdmissionMetrics.HISTORY)  # (fill_time, player_count) of recent lobbies
+
+    def record_join(self):
+        self.joins += 1
+        if self.server_metrics is not None:
+            self.server_metrics.joins.inc()
+
+    def record_lobby(self, first_join, closed_at, player_count):
+        """
+        Records a lobby that closed its admission.
+        Args:
+            first_join (float): monotonic() time of the lobby's first join.
+            closed_at (float): monotonic() time at which the lobby closed.
+            player_count (int): Number of players the lobby closed with.
+        Returns:
+            float: The fill time of the lobby in seconds.
+        """
+        fill_time = closed_at - first_join
+        self.lobbies += 1
+        self.recent.append((fill_time, player_count))
+        if self.server_metrics is not None:
+            self.server_metrics.lobby_fill_time.observe(fill_time)
+            self.server_metrics.lobby_players.observe(player_count)
+        return fill_time
+
+    def summary(self):
+        """
+        Returns:
+            dict: Total joins and lobbies, the average fill time and the admission rate (joins per second while
+                filling) over the recent lobbies.
+        """
+        fill_time = sum(fill for fill, _ in self.recent)
+        players = sum(count for _, count in self.recent)
+        return {
+            'joins': self.joins,
+            'lobbies': self.lobbies,
+            'avg_fill_time': fill_time / len(self.recent) if self.recent else 0.0,
+            'admission_rate': players / fill_time if fill_time else 0.0,
+        }
@@ -0,0 +1,136 @@
+import socket
+import threading
+from time import monotonic, perf_counter_ns
+
+"""
+An AnswerArbiter class that decides the winner of a single trivia round. Answers are judged by the player's own
+latency, the time between the question reaching that player's socket and the answer being read, so the order in which
+the question was fanned out does not decide who wins. The game thread blocks on the arbiter instead of polling and
+wakes up as soon as a winner is settled. The arbiter also exposes a file descriptor that becomes readable when the
+round is closed, which lets the server's answer thread wait on the players' sockets and the end of the round with
+one selector.
+"""
+
+
+class AnswerArbiter:
+    def __init__(self, correct_answer, timeout, fairness_window_ns=0, clock=None):
+        """
+        Initializes the AnswerArbiter class.
+        param:
+            correct_answer (int): The correct answer to the trivia question.
+            timeout (float): Seconds the players have to answer.
+            fairness_window_ns (int, optional): How long after the first correct answer a faster answer from a player
+                who got the question later may still win, usually the fan-out skew of the question. Defaults to 0.
+            clock (function, optional): Returns the current time in nanoseconds on the perf_counter_ns() scale.
+                Defaults to perf_counter_ns; the journal replay passes a virtual clock.
+        """
+        self.correct_answer = correct_answer
+        self.deadline = monotonic() + timeout  # When the round closes if nobody wins
+        self.fairness_window_ns = fairness_window_ns
+        self.clock = clock or perf_counter_ns
+        self.winner = None  # Name of the player with the lowest correct answer latency
+        self.winner_latency = None  # Answer latency of the winner in nanoseconds
+        self.first_correct_ns = None  # perf_counter_ns() at which the first correct answer was read
+        self.closed = False
+        self._condition = threading.Condition()
+        self._wake_reader = None  # Socket pair created on the first fileno() call
+        self._wake_writer = None
+
+    def fileno(self):
+        """
+        Returns:
+            int: A file descriptor that becomes readable once the round is closed.
+        """
+        with self._condition:
+            if self._wake_reader is None:
+                # Writing to one end of the pair makes the other readable for every thread selecting on it
+                self._wake_reader, self._wake_writer = socket.socketpair()
+                if self.closed:
+                    self._wake_writer.send(b'\0')
+            return self._wake_reader.fileno()
+
+    def remaining(self):
+        """
+        Returns:
+            float: Seconds left until the round deadline, never negative.
+        """
+        return max(0.0, self.deadline - monotonic())
+
+    def settled(self):
+        """
+        Returns:
+            bool: True once there is a winner and the fairness window after the first correct answer is over.
+        """
+        return self.first_correct_ns is not None and \
+            self.clock() - self.first_correct_ns >= self.fairness_window_ns
+
+    def submit(self, player_name, answer, arrival_ns=None, sent_ns=None):
+        """
+        Records a player's answer. Among correct answers the one with the lowest latency wins; equal latencies are
+        resolved by the order in which the answers were read.
+        Args:
+            player_name (str): The name of the player who answered.
+            answer (int): The processed answer of the player.
+            arrival_ns (int, optional): perf_counter_ns() at which the answer was read. Defaults to now.
+            sent_ns (int, optional): perf_counter_ns() at which the question was sent to the player. Defaults to 0,
+                which judges the answer by arrival time only.
+        Returns:
+            bool: True if the player is currently the winner of the round.
+        """
+        if arrival_ns is None:
+            arrival_ns = self.clock()
+        latency = arrival_ns - (sent_ns or 0)
+        with self._condition:
+            if self.closed or answer != self.correct_answer:
+                return False
+            if self.first_correct_ns is None:
+                self.first_correct_ns = arrival_ns
+            elif self.settled():
+                return False  # Too late to beat the winner
+            if self.winner is None or latency < self.winner_latency:
+                self.winner = player_name
+                self.winner_latency = latency
+                self._condition.notify_all()
+            return self.winner == player_name
+
+    def wait(self, timeout):
+        """
+        Blocks until the winner is settled, the round is closed or the timeout passes.
+        Args:
+            timeout (float): Maximum number of seconds to wait.
+        Returns:
+            str: The name of the winner, or None if there is no settled winner yet.
+        """
+        end = monotonic() + timeout
+        with self._condition:
+            while not self.closed and not self.settled():
+                wait_time = end - monotonic()
+                if self.first_correct_ns is not None:
+                    settle_time = (self.first_correct_ns + self.fairness_window_ns - self.clock()) / 1e9
+                    wait_time = min(wait_time, settle_time)
+                if wait_time <= 0:
+                    break
+                self._condition.wait(wait_time)
+            return self.winner if self.settled() else None
+
+    def close(self):
+        """
+        Stops accepting answers and wakes up every thread waiting on the arbiter.
+        Returns:
+            str: The name of the winner, or None if nobody answered correctly.
+        """
+        with self._condition:
+            if not self.closed:
+                self.closed = True
+                if self._wake_writer is not None:
+                    self._wake_writer.send(b'\0')
+                self._condition.notify_all()
+            return self.winner
+
+    def release(self):
+        """
+        Frees the wake-up sockets. Call only after the answer thread of the round has finished.
+        """
+        if self._wake_reader is not None:
+            self._wake_reader.close()
+            self._wake_writer.close()
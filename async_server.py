@@ -0,0 +1,226 @@
+import asyncio
+import colorama
+from style import Style
+from time import perf_counter_ns
+import lobby
+import protocol
+import console
+import discovery
+import socket
+from server import Server
+from player import Player
+
+"""
+An AsyncServer class that hosts trivia games on a single asyncio event loop. It keeps the public behavior of the
+threaded Server (UDP offers, welcome message, a 10 second answer window and an 'Expired'/winner status message), but
+sends questions, collects answers and broadcasts results for every connected socket from one thread instead of
+starting a thread per client per round. Players are placed by a LobbyManager in concurrently running game rooms, so
+one server process hosts many games on the same listening port.
+"""
+
+
+class AsyncServer(Server):
+    def __init__(self, magic_cookie, message_type, server_port, client_port, wifi_interface=None, server_name=None,
+                 reuse_port=False, send_offers=True, load_slots=None, worker_index=0, admission_policy=None,
+                 listen_backlog=None, handshake_timeout=None, metrics_port=None, persistent_sessions=False,
+                 journal_path=None, leaderboard_path=None):
+        """
+        Initializes the AsyncServer class.
+        param:
+            magic_cookie (byte): Magic cookie for identifying messages.
+            message_type (byte): Type of message.
+            server_port (int): Port for server.
+            client_port (int): Port for client.
+            wifi_interface (str, optional): Name of the Wi-Fi interface. Defaults to None.
+            server_name (str, optional): Name of the server. Defaults to None.
+            reuse_port (bool, optional): Bind the TCP port with SO_REUSEPORT. Defaults to False.
+            send_offers (bool, optional): Whether this server broadcasts the UDP offers. Defaults to True.
+            load_slots (multiprocessing.Array, optional): Shared per-worker player counts. Defaults to None.
+            worker_index (int, optional): The slot of this server in load_slots. Defaults to 0.
+            admission_policy (admission.AdmissionPolicy, optional): When rooms stop accepting players.
+                Defaults to at least 1 player and 10 seconds without a new join.
+            listen_backlog (int, optional): Length of the listen queue. Defaults to Server.LISTEN_BACKLOG.
+            handshake_timeout (float, optional): Seconds a new client has to send its player name.
+                Defaults to Server.HANDSHAKE_TIMEOUT.
+            metrics_port (int, optional): Local port of the metrics scrape endpoint; None to not serve it.
+                Defaults to None.
+            persistent_sessions (bool, optional): Move the players still connected at the end of a game into the
+                next room instead of disconnecting them. Defaults to False.
+            journal_path (str, optional): Where to append the binary journal of every game; None to not keep one.
+                Defaults to None.
+            leaderboard_path (str, optional): SQLite database of the player leaderboard, which may be shared by
+                several workers; None to not keep one. Defaults to None.
+        """
+        super().__init__(magic_cookie, message_type, server_port, client_port, wifi_interface, server_name,
+                         reuse_port, admission_policy, listen_backlog, handshake_timeout, metrics_port,
+                         persistent_sessions, journal_path, leaderboard_path)
+        self.tcp_socket.setblocking(False)  # The event loop owns the listening socket
+        # Places players in concurrently running rooms
+        self.lobby_manager = lobby.LobbyManager(self.server_name, self.admission_policy, self.metrics,
+                                                persistent_sessions, self.journal, self.leaderboard)
+        self.send_offers = send_offers
+        self.load_slots = load_slots
+        self.worker_index = worker_index
+        self.loop = None  # Event loop of the server once it runs
+        self.stop_requested = None  # asyncio.Event set by request_shutdown
+
+    async def report_load(self):
+        """
+        Publishes the number of connected players to this worker's shared load slot once a second.
+        """
+        while True:
+            self.load_slots[self.worker_index] = self.lobby_manager.player_count
+            await asyncio.sleep(1)
+
+    async def send_udp_offers_async(self):
+        """
+        Send UDP offers in broadcast once a second. There is always a room open for new players, so offers are sent
+        for as long as the server runs, and a last one reports the lobby closed when it stops. Every offer carries
+        the number of connected players, of every worker when the server is sharded by the launcher.
+        """
+        console.log('', f'Listening on IP address {self.ip_address}')
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)  # Set socket option to allow broadcast
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Set socket option to allow reuse of address
+            sock.setblocking(False)
+            lobby_open = True
+            while lobby_open:
+                lobby_open = self.lobby_manager.lobby_open and not self.stopping.is_set()
+                players = sum(self.load_slots) if self.load_slots is not None else self.lobby_manager.player_count
+                msg = discovery.encode_offer(self.magic_cookie, self.message_type, self.server_port, players,
+                                             lobby_open)
+                try:
+                    sock.sendto(msg, ('<broadcast>', self.client_port))
+                except BlockingIOError:
+                    pass  # The offer is repeated on the next tick anyway
+                if lobby_open:
+                    try:
+                        # Wait one second, or until a shutdown is requested, which sends the last offer at once
+                        await asyncio.wait_for(self.stop_requested.wait(), 1)
+                    except asyncio.TimeoutError:
+                        pass
+
+    async def tcp_client_connect_async(self):
+        """
+        Accept incoming TCP connections forever. Every accepted socket gets its own handshake task, so a client that
+        is slow to send its name never blocks the accept loop.
+        """
+        loop = asyncio.get_running_loop()
+        self.tcp_socket.listen(self.listen_backlog)
+        handshakes = set()
+        while True:
+            try:
+                client_socket, (client_ip, client_port) = await loop.sock_accept(self.tcp_socket)
+            except Exception as e:
+                console.log(Style.FAIL, f'Unable to connect to client - Exception received: {e}', console.ERROR)
+                continue
+            self.metrics.accepts.inc()
+            task = asyncio.create_task(self.handshake(client_socket, client_ip, client_port))
+            handshakes.add(task)
+            task.add_done_callback(handshakes.discard)
+
+    async def handshake(self, client_socket, client_ip, client_port):
+        """
+        Wraps an accepted socket in asyncio streams, receives the player name and hands the player to the lobby
+        manager.
+        Args:
+            client_socket (socket.socket): The accepted client socket.
+            client_ip (str): IP address of the client.
+            client_port (int): Port of the client.
+        """
+        start_ns = perf_counter_ns()
+        reader, writer = await asyncio.open_connection(sock=client_socket)
+        try:
+            codec, player_name = await asyncio.wait_for(self.receive_player_name_async(reader),
+                                                        self.handshake_timeout)
+        except (asyncio.TimeoutError, OSError, protocol.ProtocolError):
+            self.metrics.handshake_failures.inc()
+            console.log(Style.FAIL, f'Client: {client_ip} did not send player name in time.', console.WARNING,
+                        client_ip=client_ip)
+            writer.close()
+            return
+        self.metrics.handshakes.inc()
+        self.metrics.handshake_latency.observe_ns(perf_counter_ns() - start_ns)
+        player_name = player_name.rstrip('\n')
+        self.lobby_manager.admit(Player(player_name, writer, (client_ip, client_port), codec, client_socket.fileno(),
+                                        reader))
+
+    async def receive_player_name_async(self, reader):
+        """
+        Negotiates the protocol of a new client and receives its player name.
+        Args:
+            reader (asyncio.StreamReader): The reader side of the client connection.
+        Returns:
+            tuple: The codec of the client's protocol and the player name.
+        Raises:
+            ConnectionResetError: If the client disconnects before sending its name.
+            protocol.ProtocolError: If a binary client sends an invalid frame.
+        """
+        data = await reader.read(1024)
+        if not data:
+            raise ConnectionResetError('Connection closed before the player name was received')
+        codec, data = protocol.negotiate(data)
+        messages = codec.feed(data)
+        while not messages:
+            # A binary JOIN frame may arrive in several pieces
+            data = await reader.read(1024)
+            if not data:
+                raise ConnectionResetError('Connection closed before the player name was received')
+            messages = codec.feed(data)
+        return codec, messages[0]
+
+    async def run_server_async(self):
+        """
+        Runs the UDP offers and the accept loop until a shutdown is requested. Games are played by the lobby
+        manager's rooms, each on its own task.
+        """
+        console.log(Style.HEADER + Style.BOLD, self.server_name)
+        console.log(Style.CYAN, f'Server started successfully!')
+        self.loop = asyncio.get_running_loop()
+        self.stop_requested = asyncio.Event()
+        if self.stopping.is_set():
+            self.stop_requested.set()  # Requested before the loop started
+        tasks = [asyncio.create_task(self.tcp_client_connect_async())]
+        if self.load_slots is not None:
+            tasks.append(asyncio.create_task(self.report_load()))
+        # The offers task is not cancelled; it ends by itself after its last offer
+        offers = [asyncio.create_task(self.send_udp_offers_async())] if self.send_offers else []
+        await self.stop_requested.wait()
+        self.announce_shutdown()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, *offers, return_exceptions=True)
+        self.tcp_socket.close()
+        await self.lobby_manager.shutdown()
+        if self.journal is not None:
+            self.journal.close()
+        if self.leaderboard is not None:
+            self.leaderboard.close()
+        console.log(Style.CYAN, 'Server stopped')
+
+    def request_shutdown(self):
+        """
+        Asks the server to shut down gracefully: no player is admitted anymore, every room plays its current round
+        to its end, and the players are told and disconnected once their queued messages were sent. Safe to call
+        from a signal handler or another thread; the event loop logs the shutdown once it wakes up.
+        """
+        super().request_shutdown()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stop_requested.set)
+
+    def run_server(self):
+        """
+        Starts the event loop and runs the server until it is shut down.
+        """
+        asyncio.run(self.run_server_async())
+
+
+if __name__ == '__main__':
+    colorama.init()  # Initialize colorama for colored output (if used)
+    # Initialize the server with specified parameters
+    server = AsyncServer(magic_cookie=0xabcddcba, message_type=0x02, server_port=4567, client_port=13117,
+                         persistent_sessions=True, leaderboard_path='leaderboard.db')
+    server.install_signal_handlers()  # Ctrl-C drains the players and shuts down after the current round
+    # Run the server
+    server.run_server()
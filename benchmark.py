@@ -0,0 +1,348 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+import platform
+import multiprocessing
+import colorama
+from style import Style
+from time import sleep, perf_counter_ns
+import protocol
+import admission
+import trivia_generator
+from server import Server
+from client import Client
+from bot_client import MAGIC_COOKIE, MESSAGE_TYPE, percentile
+
+"""
+A reproducible benchmark of the threaded Server over loopback. For every player count it starts a fresh server
+process whose lobby closes as soon as exactly that many players joined, connects the players from one asyncio event
+loop, lets a single designated player answer the first question correctly and measures:
+    - the time from the last join (the lobby close) to the first question being sent,
+    - the fan-out skew of the question across the players, as seen by the server and by the players,
+    - the latency from sending the correct answer to receiving the winner broadcast,
+    - the round time, from the first player receiving the question to the last player receiving the result,
+    - the RSS growth of the server process per connected player.
+The largest player count whose round overhead stays within a budget is reported as the maximum concurrent players.
+Results are written as JSON, so runs can be compared to catch regressions in the play_game/get_answer hot path.
+"""
+
+CLIENT_PORT = 13120  # Offers of benchmark servers go to a port no interactive client listens on
+BASE_PORT = 4700  # Every player count gets its own server port, so no level sees connections of the previous one
+CONNECT_CONCURRENCY = 256  # Connections opened at once, to stay within the listen backlog
+LEVEL_TIMEOUT = 300  # Seconds a single player count may take
+
+
+class BenchmarkServer(Server):
+    """
+    A Server that reports the timestamps of its lobby and its first question to the benchmark process.
+    """
+
+    def __init__(self, events, **kwargs):
+        """
+        Initializes the BenchmarkServer class.
+        param:
+            events (multiprocessing.Queue): Receives (event, ...) tuples for the benchmark process.
+            kwargs: Passed on to Server.
+        """
+        super().__init__(**kwargs)
+        self.events = events
+        self.last_join_ns = None  # perf_counter_ns() of the latest join, the lobby close of a full lobby
+        self.question_reported = False
+
+    def handshake(self, client_socket, client_ip, client_port):
+        super().handshake(client_socket, client_ip, client_port)
+        self.last_join_ns = perf_counter_ns()
+
+    def log_admission(self):
+        self.events.put(('lobby_closed', self.last_join_ns))
+        super().log_admission()
+
+    def broadcast_question(self, players, trivia_question):
+        start_ns = perf_counter_ns()
+        sent_ns = super().broadcast_question(players, trivia_question)
+        if not self.question_reported and sent_ns:
+            self.question_reported = True
+            self.events.put(('question', start_ns, min(sent_ns.values()), max(sent_ns.values()), len(sent_ns)))
+        return sent_ns
+
+
+def run_benchmark_server(events, port, players, wifi_interface, verbose):
+    """
+    Entry point of the server process of a level.
+    Args:
+        events (multiprocessing.Queue): Receives the server's measurements.
+        port (int): TCP port of the server.
+        players (int): Number of players after which the lobby closes.
+        wifi_interface (str): Name of the interface the server advertises.
+        verbose (bool): Whether to keep the server's output.
+    """
+    if not verbose:
+        sys.stdout = open(os.devnull, 'w')
+    policy = admission.AdmissionPolicy(min_players=players, max_players=players, lobby_deadline=LEVEL_TIMEOUT)
+    server = BenchmarkServer(events, magic_cookie=MAGIC_COOKIE, message_type=MESSAGE_TYPE, server_port=port,
+                             client_port=CLIENT_PORT, wifi_interface=wifi_interface, admission_policy=policy)
+    events.put(('ready', os.getpid()))
+    server.run_server()
+
+
+def read_rss(pid):
+    """
+    Args:
+        pid (int): A process id.
+    Returns:
+        int: The resident set size of the process in bytes, or None where /proc is not available.
+    """
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class BenchmarkPlayer(Client):
+    CONNECT_RETRY = 0.05  # Seconds between connection attempts while the server starts listening
+
+    def __init__(self, index, answers):
+        """
+        Initializes the BenchmarkPlayer class.
+        param:
+            index (int): Index of the player; player 0 answers correctly, the others stay silent.
+            answers (dict): Every question of the bank (question_types.Question) by its prompt.
+        """
+        super().__init__(MAGIC_COOKIE, MESSAGE_TYPE, CLIENT_PORT, f'bench-{index}')
+        self.answers = answers
+        self.is_winner = index == 0
+        self.joined = False  # Whether the player was welcomed or, failing that, got the question
+        self.question_ns = None  # perf_counter_ns() at which the question arrived
+        self.answer_ns = None  # perf_counter_ns() at which the correct answer was sent
+        self.result_ns = None  # perf_counter_ns() at which the result arrived
+
+    async def connect(self, port, deadline_ns):
+        """
+        Connects to the server, retrying while it is not listening yet, and sends the player name.
+        Args:
+            port (int): TCP port of the server.
+            deadline_ns (int): perf_counter_ns() after which the player gives up.
+        Returns:
+            tuple: The reader and writer of the connection.
+        """
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(self.join_message())
+                return reader, writer
+            except ConnectionRefusedError:
+                if perf_counter_ns() > deadline_ns:
+                    raise
+                await asyncio.sleep(BenchmarkPlayer.CONNECT_RETRY)
+
+    async def play(self, reader, writer, joined, answer_delay):
+        """
+        Plays the single benchmark round.
+        Args:
+            reader (asyncio.StreamReader): The reader side of the connection.
+            writer (asyncio.StreamWriter): The writer side of the connection.
+            joined (function): Called once the player is in the game, on the welcome message or the question.
+            answer_delay (float): Seconds the winner waits before answering.
+        """
+        try:
+            while self.result_ns is None:
+                data = await reader.read(4096)
+                if not data:
+                    return
+                for frame_type, payload in self.frame_parser.feed(data):
+                    if not self.joined and frame_type in (protocol.WELCOME, protocol.QUESTION):
+                        self.joined = True
+                        joined()
+                    if frame_type == protocol.QUESTION and self.question_ns is None:
+                        self.question_ns = perf_counter_ns()
+                        self.round_id = protocol.ROUND_ID.unpack_from(payload)[0]
+                        if self.is_winner:
+                            question = payload[protocol.ROUND_ID.size:].decode('utf8')
+                            await asyncio.sleep(answer_delay)
+                            answer = self.answers[question].sample_answer(True, None)
+                            writer.write(self.answer_message(answer))
+                            self.answer_ns = perf_counter_ns()
+                    elif frame_type == protocol.RESULT:
+                        self.result_ns = perf_counter_ns()
+        finally:
+            writer.close()
+
+
+async def drive_players(players, port, answers, answer_delay, on_all_joined):
+    """
+    Connects the players and plays the round.
+    Args:
+        players (int): Number of players.
+        port (int): TCP port of the server.
+        answers (dict): Every question of the bank (question_types.Question) by its prompt.
+        answer_delay (float): Seconds the winner waits before answering.
+        on_all_joined (function): Called once every player is in the game.
+    Returns:
+        tuple: The players and the seconds it took to connect them all.
+    """
+    deadline_ns = perf_counter_ns() + LEVEL_TIMEOUT * 10 ** 9
+    bench_players = [BenchmarkPlayer(i, answers) for i in range(players)]
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+    welcomed = 0
+
+    def joined():
+        nonlocal welcomed
+        welcomed += 1
+        if welcomed == players:
+            on_all_joined()
+
+    async def connect(player):
+        async with semaphore:
+            return await player.connect(port, deadline_ns)
+
+    start_ns = perf_counter_ns()
+    connections = await asyncio.gather(*(connect(player) for player in bench_players))
+    connect_time = (perf_counter_ns() - start_ns) / 1e9
+    await asyncio.gather(*(player.play(reader, writer, joined, answer_delay)
+                           for player, (reader, writer) in zip(bench_players, connections)))
+    return bench_players, connect_time
+
+
+def run_level(players, port, wifi_interface='lo', answer_delay=0.05, verbose=False):
+    """
+    Benchmarks a single player count against a fresh server process.
+    Args:
+        players (int): Number of players.
+        port (int): TCP port of the server.
+        wifi_interface (str, optional): Name of the interface the server advertises. Defaults to 'lo'.
+        answer_delay (float, optional): Seconds the winner waits before answering. Defaults to 0.05.
+        verbose (bool, optional): Whether to keep the server's output. Defaults to False.
+    Returns:
+        dict: The measurements of the level, with an 'error' entry if the level failed.
+    """
+    ctx = multiprocessing.get_context('fork')
+    events = ctx.Queue()
+    process = ctx.Process(target=run_benchmark_server, args=(events, port, players, wifi_interface, verbose),
+                          daemon=True)
+    process.start()
+    result = {'players': players}
+    try:
+        _, pid = events.get(timeout=30)
+        rss_before = read_rss(pid)
+        rss_joined = []
+        answers = trivia_generator.TriviaGenerator().questions_by_prompt()
+        bench_players, connect_time = asyncio.run(asyncio.wait_for(
+            drive_players(players, port, answers, answer_delay, lambda: rss_joined.append(read_rss(pid))),
+            LEVEL_TIMEOUT))
+        server_events = {}
+        while len(server_events) < 2:
+            event = events.get(timeout=10)
+            server_events[event[0]] = event[1:]
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+        return result
+    finally:
+        process.terminate()
+        process.join()
+
+    last_join_ns, = server_events['lobby_closed']
+    broadcast_start_ns, first_sent_ns, last_sent_ns, fanned_out = server_events['question']
+    question_ns = sorted(player.question_ns for player in bench_players if player.question_ns is not None)
+    result_ns = [player.result_ns for player in bench_players if player.result_ns is not None]
+    winner = bench_players[0]
+    result.update({
+        'connect_time_s': connect_time,
+        'joins_per_sec': players / connect_time if connect_time else 0.0,
+        'lobby_close_to_question_ms': (broadcast_start_ns - last_join_ns) / 1e6,
+        'server_fanout_skew_ms': (last_sent_ns - first_sent_ns) / 1e6,
+        'client_fanout_skew_ms': (question_ns[-1] - question_ns[0]) / 1e6 if question_ns else None,
+        'client_question_p50_ms': (percentile(question_ns, 0.5) - question_ns[0]) / 1e6 if question_ns else None,
+        'client_question_p99_ms': (percentile(question_ns, 0.99) - question_ns[0]) / 1e6 if question_ns else None,
+        'answer_to_winner_ms': (winner.result_ns - winner.answer_ns) / 1e6
+        if winner.answer_ns and winner.result_ns else None,
+        'round_time_ms': (max(result_ns) - question_ns[0]) / 1e6 if question_ns and result_ns else None,
+        'round_overhead_ms': (max(result_ns) - question_ns[0]) / 1e6 - answer_delay * 1000
+        if question_ns and result_ns else None,
+        'players_fanned_out': fanned_out,
+        'players_with_result': len(result_ns),
+        'rss_before_bytes': rss_before,
+        'rss_joined_bytes': rss_joined[0] if rss_joined else None,
+        'rss_per_player_bytes': (rss_joined[0] - rss_before) / players
+        if rss_joined and rss_joined[0] is not None and rss_before is not None else None,
+    })
+    return result
+
+
+def raise_fd_limit():
+    """
+    Raises the soft limit of open files to the hard limit, as every player is a socket on both sides of loopback.
+    """
+    try:
+        import resource
+    except ImportError:
+        return  # Not available on Windows
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def run_benchmarks(levels, wifi_interface='lo', answer_delay=0.05, overhead_budget_ms=100, verbose=False):
+    """
+    Runs every level and summarizes the results.
+    Args:
+        levels (list): Player counts to benchmark, in increasing order.
+        wifi_interface (str, optional): Name of the interface the servers advertise. Defaults to 'lo'.
+        answer_delay (float, optional): Seconds the winner waits before answering. Defaults to 0.05.
+        overhead_budget_ms (float, optional): Round overhead beyond which the round time counts as degraded.
+            Defaults to 100.
+        verbose (bool, optional): Whether to keep the servers' output. Defaults to False.
+    Returns:
+        dict: The environment, the results of every level and the maximum players within the overhead budget.
+    """
+    raise_fd_limit()
+    results = []
+    max_players = None
+    for i, players in enumerate(levels):
+        print(Style.CYAN + f'Benchmarking {players} players...' + Style.END_STYLE)
+        result = run_level(players, BASE_PORT + i, wifi_interface, answer_delay, verbose)
+        results.append(result)
+        if 'error' in result:
+            print(Style.FAIL + f'{players} players failed: {result["error"]}' + Style.END_STYLE)
+            continue
+        print(Style.GRAY + f'  round {result["round_time_ms"]:.1f}ms, '
+                           f'fan-out skew {result["server_fanout_skew_ms"]:.2f}ms, '
+                           f'answer to winner {result["answer_to_winner_ms"]:.2f}ms, '
+                           f'lobby close to question {result["lobby_close_to_question_ms"]:.1f}ms' + Style.END_STYLE)
+        if result['round_overhead_ms'] is not None and result['round_overhead_ms'] <= overhead_budget_ms:
+            max_players = players
+        sleep(1)  # Let the sockets of the previous level close
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'answer_delay_s': answer_delay,
+        'overhead_budget_ms': overhead_budget_ms,
+        'max_players_within_budget': max_players,
+        'levels': results,
+    }
+
+
+if __name__ == '__main__':
+    colorama.init()
+    parser = argparse.ArgumentParser(description='Benchmark the trivia server over loopback.')
+    parser.add_argument('-p', '--players', type=int, nargs='+', default=[10, 100, 1000, 10000],
+                        help='player counts to benchmark')
+    parser.add_argument('-i', '--interface', default='lo', help='network interface the server advertises')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='file to write the results to')
+    parser.add_argument('--answer-delay', type=float, default=0.05, help='seconds the winner waits to answer')
+    parser.add_argument('--budget', type=float, default=100, help='round overhead budget in milliseconds')
+    parser.add_argument('-v', '--verbose', action='store_true', help="show the servers' output")
+    args = parser.parse_args()
+
+    if not hasattr(os, 'fork'):
+        parser.error('The benchmark forks its servers and needs a POSIX platform')
+    report = run_benchmarks(sorted(args.players), args.interface, args.answer_delay, args.budget, args.verbose)
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print(Style.CYAN + f'Results written to {args.output}' + Style.END_STYLE)
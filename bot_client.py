@@ -0,0 +1,330 @@
+import sys
+import json
+import random
+import asyncio
+import argparse
+import colorama
+from style import Style
+from time import monotonic, perf_counter_ns
+import protocol
+import trivia_generator
+from client import Client
+
+"""
+A load generator for the trivia servers. It runs thousands of headless players in one process on a single asyncio
+event loop. Each BotClient reuses the Client offer parsing and join/answer encoding, speaks the binary protocol,
+answers every question after a latency drawn from a configurable distribution and answers correctly with a
+configurable probability, looking the correct answer up in the question bank. At the end of the run it reports
+joins/sec, rounds/sec and percentiles of the latency between sending an answer and receiving the round's result.
+"""
+
+MAGIC_COOKIE = 0xabcddcba
+MESSAGE_TYPE = 0x02
+CLIENT_PORT = 13117
+
+
+def parse_distribution(spec):
+    """
+    Builds a sampler from a distribution spec such as 'constant:0.5', 'uniform:0.2,1.5', 'normal:0.8,0.3',
+    'lognormal:-0.5,0.6' or 'exponential:0.7' (mean). Samples are never negative.
+    Args:
+        spec (str): The distribution name and its comma separated parameters.
+    Returns:
+        function: A function taking a random.Random and returning a sample.
+    Raises:
+        ValueError: If the spec names an unknown distribution or has the wrong number of parameters.
+    """
+    name, _, params = spec.partition(':')
+    try:
+        args = [float(param) for param in params.split(',')] if params else []
+    except ValueError:
+        raise ValueError(f'Invalid distribution parameters: {spec}')
+    samplers = {
+        'constant': (1, lambda rng, value: value),
+        'uniform': (2, lambda rng, low, high: rng.uniform(low, high)),
+        'normal': (2, lambda rng, mu, sigma: rng.gauss(mu, sigma)),
+        'lognormal': (2, lambda rng, mu, sigma: rng.lognormvariate(mu, sigma)),
+        'exponential': (1, lambda rng, mean: rng.expovariate(1 / mean)),
+    }
+    if name not in samplers:
+        raise ValueError(f'Unknown distribution: {name}')
+    arity, sampler = samplers[name]
+    if len(args) != arity:
+        raise ValueError(f'{name} takes {arity} parameters, got {len(args)}')
+    return lambda rng: max(0.0, sampler(rng, *args))
+
+
+def percentile(sorted_values, fraction):
+    """
+    Args:
+        sorted_values (list): Values in ascending order.
+        fraction (float): The percentile as a fraction, e.g. 0.99.
+    Returns:
+        float: The nearest-rank percentile, or 0.0 if there are no values.
+    """
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class LoadStats:
+    """
+    Counters shared by every bot of the run. The bots all run on one event loop, so no lock is needed.
+    """
+
+    def __init__(self):
+        self.started = monotonic()
+        self.connects = 0  # TCP connections opened
+        self.failed_connects = 0  # Connections refused or timed out
+        self.joins = 0  # Welcome messages received
+        self.answers = 0  # Answers sent
+        self.correct = 0  # Correct answers sent
+        self.results = 0  # RESULT frames received, one per player per round
+        self.wins = 0  # Games won by a bot
+        self.rounds = set()  # (game, round id) of every round seen, the same for every player of a round
+        self.result_latencies = []  # Seconds between sending an answer and receiving the result of its round
+
+    def report(self):
+        """
+        Returns:
+            dict: The totals, the rates per second since the start of the run and the result latency percentiles.
+        """
+        elapsed = monotonic() - self.started
+        latencies = sorted(self.result_latencies)
+        return {
+            'elapsed': elapsed,
+            'connects': self.connects,
+            'failed_connects': self.failed_connects,
+            'joins': self.joins,
+            'answers': self.answers,
+            'correct': self.correct,
+            'results': self.results,
+            'rounds': len(self.rounds),
+            'wins': self.wins,
+            'joins_per_sec': self.joins / elapsed if elapsed else 0.0,
+            'rounds_per_sec': len(self.rounds) / elapsed if elapsed else 0.0,
+            'result_latency_ms': {f'p{int(fraction * 100)}': percentile(latencies, fraction) * 1000
+                                  for fraction in (0.5, 0.9, 0.99, 1.0)},
+        }
+
+
+class BotClient(Client):
+    CONNECT_TIMEOUT = 5  # Seconds to open the TCP connection
+    READ_TIMEOUT = 30  # Seconds without any frame from the server before the bot reconnects
+
+    def __init__(self, name, answers, stats, latency, accuracy, rejoin_delay=1, rng=None):
+        """
+        Initializes the BotClient class.
+        param:
+            name (str): The player name of the bot.
+            answers (dict): Every question of the bank (question_types.Question) by its prompt.
+            stats (LoadStats): Counters shared by every bot of the run.
+            latency (function): Sampler of the answer latency in seconds.
+            accuracy (float): Probability that the bot answers correctly.
+            rejoin_delay (float, optional): Seconds between a closed connection and the next join. Defaults to 1.
+            rng (random.Random, optional): Source of randomness of the bot. Defaults to a new random.Random.
+        """
+        super().__init__(MAGIC_COOKIE, MESSAGE_TYPE, CLIENT_PORT, name)
+        self.answers = answers
+        self.stats = stats
+        self.latency = latency
+        self.accuracy = accuracy
+        self.rejoin_delay = rejoin_delay
+        self.rng = rng or random.Random()
+        self.answer_sent_ns = None  # perf_counter_ns() at which the answer to the current question was sent
+        self.answer_task = None  # Task sending the answer to the current question
+        self.game = None  # (hash of the welcome message, times the bot received it), which identifies the game
+        self.welcomes = {}  # Welcome messages received by the bot, counted by hash
+        self.deadline = None  # monotonic() time at which the bot stops
+
+    async def play(self, server_ip, server_port, deadline):
+        """
+        Plays games on the server until the deadline. Like the interactive client, the bot stays connected between
+        games and only joins again once the server closed the connection.
+        Args:
+            server_ip (str): IP address of the server.
+            server_port (int): TCP port of the server.
+            deadline (float): monotonic() time at which the bot stops.
+        """
+        self.server_ip, self.server_port = server_ip, server_port
+        self.deadline = deadline
+        while monotonic() < deadline:
+            try:
+                await self.play_game()
+            except (OSError, asyncio.TimeoutError, protocol.ProtocolError):
+                self.stats.failed_connects += 1
+            await asyncio.sleep(self.rejoin_delay)
+
+    async def play_game(self):
+        """
+        Connects, joins and answers every question of the games played on the connection. Returns once the server
+        closed the connection, or after the game over at the deadline.
+        """
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.server_ip, self.server_port),
+                                                BotClient.CONNECT_TIMEOUT)
+        self.stats.connects += 1
+        try:
+            writer.write(self.join_message())
+            while True:
+                data = await asyncio.wait_for(reader.read(4096), BotClient.READ_TIMEOUT)
+                if not data:
+                    return
+                for frame_type, payload in self.frame_parser.feed(data):
+                    if not self.handle_frame(writer, frame_type, payload):
+                        return
+        finally:
+            if self.answer_task is not None:
+                self.answer_task.cancel()
+            writer.close()
+
+    def handle_frame(self, writer, frame_type, payload):
+        """
+        Reacts to a frame from the server.
+        Args:
+            writer (asyncio.StreamWriter): The writer side of the connection.
+            frame_type (int): The type of the frame.
+            payload (bytes): The payload of the frame.
+        Returns:
+            bool: False once the last game of the run is over.
+        """
+        if frame_type == protocol.WELCOME:
+            self.stats.joins += 1
+            # In session mode the same players get the same welcome game after game, and rooms restart their
+            # round ids, so the welcome alone does not tell games apart. Every player of a game was in each earlier
+            # game with that welcome, so they all count the same number of repeats.
+            welcome = hash(payload)
+            self.welcomes[welcome] = self.welcomes.get(welcome, 0) + 1
+            self.game = (welcome, self.welcomes[welcome])
+        elif frame_type == protocol.QUESTION:
+            self.round_id = protocol.ROUND_ID.unpack_from(payload)[0]
+            question = payload[protocol.ROUND_ID.size:].decode('utf8')
+            self.stats.rounds.add((self.game, self.round_id))
+            self.answer_sent_ns = None
+            self.answer_task = asyncio.create_task(self.answer(writer, question))
+        elif frame_type == protocol.RESULT:
+            self.stats.results += 1
+            if self.answer_sent_ns is not None:
+                self.stats.result_latencies.append((perf_counter_ns() - self.answer_sent_ns) / 1e9)
+            if self.answer_task is not None:
+                self.answer_task.cancel()  # The round ended before the bot's latency ran out
+                self.answer_task = None
+            if payload[0] == protocol.RESULT_WINNER:
+                if payload[1:].decode('utf8').startswith(f'\n{self.new_player_name} is correct!'):
+                    self.stats.wins += 1
+                # Wait on the same connection for the next game, unless the run is over
+                return monotonic() < self.deadline
+        return True
+
+    async def answer(self, writer, question):
+        """
+        Waits for the bot's latency and answers the question, correctly with probability accuracy.
+        Args:
+            writer (asyncio.StreamWriter): The writer side of the connection.
+            question (str): The question message received from the server.
+        """
+        await asyncio.sleep(self.latency(self.rng))
+        bank_question = self.answers.get(question)
+        is_correct = self.rng.random() < self.accuracy
+        if bank_question is not None:
+            ans = bank_question.sample_answer(is_correct, self.rng)
+        else:
+            ans = self.rng.choice('tf')  # Not in this bank, guess
+        writer.write(self.answer_message(ans))
+        self.answer_sent_ns = perf_counter_ns()
+        self.stats.answers += 1
+        self.stats.correct += is_correct
+
+
+def discover_server():
+    """
+    Waits for a UDP offer like the interactive client does.
+    Returns:
+        tuple: The IP address and TCP port of the server.
+    """
+    client = Client(MAGIC_COOKIE, MESSAGE_TYPE, CLIENT_PORT, 'bot')
+    client.look_for_server()
+    return client.server_ip, client.server_port
+
+
+async def run_bots(bots, server_ip, server_port, duration, join_rate=None, seed=None, latency='lognormal:-0.7,0.5',
+                   accuracy='uniform:0.5,0.9', rejoin_delay=1):
+    """
+    Runs the bots against a server and collects their statistics.
+    Args:
+        bots (int): Number of simulated players.
+        server_ip (str): IP address of the server.
+        server_port (int): TCP port of the server.
+        duration (float): Seconds to run the bots for.
+        join_rate (float, optional): Bots started per second, to ramp up the load. Defaults to all at once.
+        seed (int, optional): Seed of the bots' randomness, to replay a run. Defaults to a random seed.
+        latency (str, optional): Distribution of the answer latency in seconds. Defaults to 'lognormal:-0.7,0.5'.
+        accuracy (str, optional): Distribution of the bots' accuracy, clamped to [0, 1]. Defaults to 'uniform:0.5,0.9'.
+        rejoin_delay (float, optional): Seconds between a closed connection and the next join. Defaults to 1.
+    Returns:
+        LoadStats: The statistics of the run.
+    """
+    answers = trivia_generator.TriviaGenerator().questions_by_prompt()
+    latency_sampler = parse_distribution(latency)
+    accuracy_sampler = parse_distribution(accuracy)
+    rng = random.Random(seed)
+    stats = LoadStats()
+    deadline = stats.started + duration
+    tasks = []
+    for i in range(bots):
+        bot_rng = random.Random(rng.getrandbits(64))
+        bot = BotClient(f'bot-{i}', answers, stats, latency_sampler, min(1.0, accuracy_sampler(bot_rng)),
+                        rejoin_delay, bot_rng)
+        tasks.append(asyncio.create_task(bot.play(server_ip, server_port, deadline)))
+        if join_rate:
+            await asyncio.sleep(1 / join_rate)
+    # Bots stop at the deadline, but one may be stuck in a game; stop waiting for it after the read timeout
+    await asyncio.wait(tasks, timeout=max(0.0, deadline - monotonic()) + BotClient.READ_TIMEOUT)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return stats
+
+
+def print_report(report):
+    """
+    Prints the report of a run.
+    Args:
+        report (dict): The report returned by LoadStats.report.
+    """
+    print(Style.HEADER + Style.BOLD + f'Load test report ({report["elapsed"]:.1f}s)' + Style.END_STYLE)
+    print(Style.CYAN + f'Joins: {report["joins"]} ({report["joins_per_sec"]:.1f}/s), '
+                       f'connects: {report["connects"]}, failed: {report["failed_connects"]}' + Style.END_STYLE)
+    print(Style.CYAN + f'Rounds: {report["rounds"]} ({report["rounds_per_sec"]:.1f}/s), '
+                       f'results: {report["results"]}, wins: {report["wins"]}' + Style.END_STYLE)
+    print(Style.CYAN + f'Answers: {report["answers"]}, correct: {report["correct"]}' + Style.END_STYLE)
+    latency = ', '.join(f'{name} {value:.1f}ms' for name, value in report['result_latency_ms'].items())
+    print(Style.CYAN + f'Answer-to-result latency: {latency}' + Style.END_STYLE)
+
+
+if __name__ == '__main__':
+    colorama.init()
+    parser = argparse.ArgumentParser(description='Simulate headless players against a trivia server.')
+    parser.add_argument('-n', '--bots', type=int, default=100, help='number of simulated players')
+    parser.add_argument('-d', '--duration', type=float, default=60, help='seconds to run for')
+    parser.add_argument('--host', default=None, help='server IP address; waits for a UDP offer if omitted')
+    parser.add_argument('--port', type=int, default=4567, help='server TCP port, used with --host')
+    parser.add_argument('--join-rate', type=float, default=None, help='bots started per second')
+    parser.add_argument('--latency', default='lognormal:-0.7,0.5', help='answer latency distribution (seconds)')
+    parser.add_argument('--accuracy', default='uniform:0.5,0.9', help='per-bot accuracy distribution')
+    parser.add_argument('--rejoin-delay', type=float, default=1, help='seconds before rejoining a closed connection')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the bots, to replay a run')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    try:
+        parse_distribution(args.latency), parse_distribution(args.accuracy)
+    except ValueError as e:
+        parser.error(str(e))
+    server_ip, server_port = (args.host, args.port) if args.host else discover_server()
+    stats = asyncio.run(run_bots(args.bots, server_ip, server_port, args.duration, args.join_rate, args.seed,
+                                 args.latency, args.accuracy, args.rejoin_delay))
+    if args.json:
+        json.dump(stats.report(), sys.stdout, indent=2)
+        print()
+    else:
+        print_report(stats.report())
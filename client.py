@@ -2,10 +2,21 @@ import random
 import socket
 import colorama
 from style import Style
-from time import sleep
-from struct import unpack
-import msvcrt
-import multiprocessing
+from time import perf_counter
+import protocol
+import discovery
+import question_types
+import console
+import os
+import sys
+import select
+import selectors
+try:
+    import msvcrt  # Keyboard input of interactive players on Windows
+except ImportError:
+    msvcrt = None
+    import tty  # Keyboard input of interactive players on POSIX
+    import termios
 
 """
 A Client class for connecting to a game server. It listens for UDP broadcast messages from the server,
@@ -15,7 +26,7 @@ connecting, sending player responses, and receiving messages.
 
 
 class Client:
-    def __init__(self, magic_cookie, message_type, client_port, new_player_name):
+    def __init__(self, magic_cookie, message_type, client_port, new_player_name, binary_protocol=True):
         """
         Initializes the client with specific game and network parameters.
 
@@ -24,11 +35,20 @@ class Client:
         - message_type (int): The message type to validate in server broadcasts.
         - client_port (int): The port on which the client listens for server broadcasts.
         - new_player_name (str): The player's name to use when connecting to the game server.
+        - binary_protocol (bool): Whether to negotiate the framed binary protocol instead of the text protocol.
         """
 
         self.server_ip = None
         self.server_port = None
         self.tcp_socket = None
+        self.connected = False  # True from a successful connect until the server closes the connection
+        self.binary_protocol = binary_protocol
+        self.frame_parser = None  # Parses the server's frames when the binary protocol is used
+        self.pending_frames = []  # Frames received from the server but not handled yet
+        self.round_id = 0  # Round of the last question, sent back with the answer
+        self.line_answer = False  # True when the last question wants a typed line instead of a single key
+        self.typed = ''  # The line typed so far for such a question
+        self.offers = None  # Cache of the servers' offers, listening from the first look_for_server call on
 
         self.new_player_name = new_player_name
         self.client_port = client_port
@@ -37,56 +57,82 @@ class Client:
 
     def look_for_server(self):
         """
-        Listens for server broadcast messages over UDP, validates them, and extracts the server IP and port for TCP
-        connection.
-        """
-
-        # Print message indicating listening for offer requests
-        print("Listening for offer requests...")
-
-        # Create a UDP socket
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Set socket option to allow reuse of address
-
-        # Bind the socket to the client port
-        sock.bind(('', self.client_port))
-
-        while True:
-            # Receive data and address from UDP packet
-            data, address = sock.recvfrom(1024)
-
-            try:
-                # Unpack received data to extract fields
-                cookie, msg_type, port = unpack('IbH', data)
-                cookie, msg_type = int(hex(cookie), 16), int(hex(msg_type), 16)
-            except Exception as e:
-                # Print warning message if UDP packet is not in the right format
-                print("Failed to connect to server: UDP packet wasn't in the the right format.")
-                continue
-
-            # Check if MAGIC COOKIE field is correct
-            if cookie != self.magic_cookie:
-                print("Failed to connect to server: UDP packet didn't contain 0xabcddcba in MAGIC COOKIE field.")
-                continue
-
-            # Check if MESSAGE TYPE field is correct
-            if msg_type != self.message_type:
-                print("Failed to connect to server: UDP packet didn't contain 0x02 in MESSAGE TYPE field.")
-                continue
-
-            # Extract server IP address and port
-            self.server_ip = address[0]
-            try:
-                self.server_port = int(port)
-            except ValueError as e:
-                print(
-                    f"Failure: UDP packet didn't contain a number in the port field. Value was: {port}")
-                self.server_ip = None
-                continue
-
-            # Close the socket and break out of the loop
-            sock.close()
-            break
+        Picks the server to connect to from the offers broadcast over UDP. The offers are collected by a listener
+        that stays open between games, so after the first game a cached offer is used right away; when several
+        servers are offering, the least loaded one is chosen.
+        """
+
+        if self.offers is None:
+            # Print message indicating listening for offer requests
+            console.log('', "Listening for offer requests...")
+            self.offers = discovery.OfferCache(self.client_port, self.parse_offer)
+
+        # Wait for the first offer if none is cached, then extract server IP address and port
+        offer = self.offers.best()
+        self.server_ip = offer.ip
+        self.server_port = offer.port
+
+    def parse_offer(self, data):
+        """
+        Validates a server offer received over UDP.
+
+        Parameters:
+        - data (bytes): The UDP payload.
+
+        Returns:
+        The TCP port, the number of players (None if the server doesn't report it) and the lobby open flag of the
+        server, or None if the offer is invalid.
+        """
+        try:
+            # Unpack received data to extract fields
+            cookie, msg_type, port, players, lobby_open = discovery.decode_offer(data)
+            cookie, msg_type = int(hex(cookie), 16), int(hex(msg_type), 16)
+        except Exception as e:
+            # Print warning message if UDP packet is not in the right format
+            console.log('', "Failed to connect to server: UDP packet wasn't in the the right format.", console.WARNING)
+            return None
+
+        # Check if MAGIC COOKIE field is correct
+        if cookie != self.magic_cookie:
+            console.log('', "Failed to connect to server: UDP packet didn't contain 0xabcddcba in MAGIC COOKIE field.",
+                        console.WARNING)
+            return None
+
+        # Check if MESSAGE TYPE field is correct
+        if msg_type != self.message_type:
+            console.log('', "Failed to connect to server: UDP packet didn't contain 0x02 in MESSAGE TYPE field.",
+                        console.WARNING)
+            return None
+        return int(port), players, lobby_open
+
+    def join_message(self):
+        """
+        Builds the first bytes sent to the server: the player name, preceded by the protocol negotiation when the
+        binary protocol is used. Also resets the frame parser for the new connection.
+
+        Returns:
+        The bytes to send right after connecting.
+        """
+        if self.binary_protocol:
+            self.frame_parser = protocol.FrameParser()
+            self.pending_frames = []
+            join_frame = protocol.encode_frame(protocol.JOIN, self.new_player_name.encode())
+            return protocol.NEGOTIATION_BYTE + join_frame
+        return (self.new_player_name + '\n').encode()
+
+    def answer_message(self, ans):
+        """
+        Encodes an answer to the last question.
+
+        Parameters:
+        - ans (str): The answer key.
+
+        Returns:
+        The bytes to send to the server.
+        """
+        if self.binary_protocol:
+            return protocol.encode_frame(protocol.ANSWER, protocol.ROUND_ID.pack(self.round_id) + ans.encode())
+        return ans.encode()
 
     def connect_to_server(self):
         """
@@ -96,23 +142,29 @@ class Client:
         True if the connection was successful, False otherwise.
         """
 
-        print(Style.CYAN + f'Received offer from {self.server_ip}, attempting to connect...' + Style.END_STYLE)
+        console.log(Style.CYAN, f'Received offer from {self.server_ip}, attempting to connect...')
         # set the tcp socket ready for connection to the server
         self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.tcp_socket.settimeout(3)
         try:
+            start = perf_counter()
             self.tcp_socket.connect((self.server_ip, self.server_port))
         except socket.error as e:
-            print(Style.WARNING + f'Failure: time out when connecting with TCP.\nException thrown: {str(e)}' + Style.END_STYLE)
+            console.log(Style.WARNING, f'Failure: time out when connecting with TCP.\nException thrown: {str(e)}',
+                        console.WARNING)
             self.tcp_socket.close()
+            if self.offers is not None:
+                self.offers.forget(self.server_ip, self.server_port)  # Wait for the server to broadcast again
             return False
+        if self.offers is not None:
+            self.offers.record_rtt(self.server_ip, self.server_port, perf_counter() - start)
 
-        print(Style.CYAN + f'Successfully connected to server {self.server_ip}\n' + Style.END_STYLE)
-        player_name_as_bytes = (self.new_player_name + '\n')
+        console.log(Style.CYAN, f'Successfully connected to server {self.server_ip}\n')
         # sends the name of the player to the server
-        self.tcp_socket.sendall(player_name_as_bytes.encode())
+        self.tcp_socket.sendall(self.join_message())
         self.tcp_socket.settimeout(None)
+        self.connected = True
         return True
 
     def get_msg_from_server(self, color_style):
@@ -126,68 +178,242 @@ class Client:
         False if the message received is not 'Expired', True otherwise.
         """
 
+        if self.binary_protocol:
+            return self.get_frame_from_server(color_style)
         # the message that the server sends to client if we don't
         # terminate the connection (meaning there is another round of questions
-        server_msg_another_round = 'Expired'
+        server_msg_another_round = protocol.EXPIRED_MSG
         try:
             server_msg = self.tcp_socket.recv(1024).decode('utf8')
-            print(color_style + server_msg + Style.END_STYLE)
+            if not server_msg:
+                console.log('', "Error receiving message from server: connection closed", console.ERROR)
+                self.connected = False
+                return False
+            console.log(color_style, server_msg)
+            self.line_answer = question_types.FREE_TEXT_HINT in server_msg
             if server_msg != server_msg_another_round:
                 return False
             return True
         except socket.error as e:
-            print("Error receiving message from server:", e)
-
-    def send_client_answer(self):
-        """
-        Gets an answer from the client via keyboard input and sends it to the server.
-        """
-        while True:
-            try:
-                ans = msvcrt.getch().decode()
-                print(f'client {self.new_player_name} answer is: {ans}')
-                self.tcp_socket.send(ans.encode())
-            except socket.error as e:
-                if isinstance(e, KeyboardInterrupt):
-                    print(Style.FAIL + "Keyboard interrupt detected." + Style.END_STYLE)
-                elif isinstance(e, ConnectionAbortedError):
-                    print(Style.FAIL + "The connection was aborted by the host machine." + Style.END_STYLE)
-                elif isinstance(e, ConnectionResetError):
-                    print(Style.FAIL + "The connection was reset by the peer." + Style.END_STYLE)
-                elif isinstance(e, OSError):
-                    print(Style.FAIL + f"An OS error occurred: {e.errno} - {e.strerror}" + Style.END_STYLE)
+            console.log('', f"Error receiving message from server: {e}", console.ERROR)
+            self.connected = False
+            return False
+
+    def get_frame_from_server(self, color_style):
+        """
+        Receives the next frame from the server and prints its message in a specified color style.
+
+        Parameters:
+        - color_style (Style): The style to apply to the printed message.
+
+        Returns:
+        True if the frame is a RESULT saying another question follows, False otherwise.
+        """
+        try:
+            while not self.pending_frames:
+                data = self.tcp_socket.recv(1024)
+                if not data:
+                    console.log('', "Error receiving message from server: connection closed", console.ERROR)
+                    self.connected = False
+                    return False
+                self.pending_frames.extend(self.frame_parser.feed(data))
+        except (socket.error, protocol.ProtocolError) as e:
+            console.log('', f"Error receiving message from server: {e}", console.ERROR)
+            self.connected = False
+            return False
+        frame_type, payload = self.pending_frames.pop(0)
+        if frame_type == protocol.RESULT:
+            status, payload = payload[0], payload[1:]
+            console.log(color_style, payload.decode('utf8'))
+            return status == protocol.RESULT_EXPIRED
+        if frame_type == protocol.QUESTION:
+            self.round_id = protocol.ROUND_ID.unpack_from(payload)[0]
+            payload = payload[protocol.ROUND_ID.size:]
+            self.line_answer = question_types.FREE_TEXT_HINT in payload.decode('utf8')
+        console.log(color_style, payload.decode('utf8'))
+        return False
+
+    def send_client_answer(self, ans):
+        """
+        Sends a key the player pressed, or a line the player typed, to the server as an answer.
+
+        Parameters:
+        - ans (str): The key or line.
+        """
+        try:
+            console.log('', f'client {self.new_player_name} answer is: {ans}')
+            self.tcp_socket.sendall(self.answer_message(ans))
+        except socket.error as e:
+            if isinstance(e, ConnectionAbortedError):
+                console.log(Style.FAIL, "The connection was aborted by the host machine.", console.ERROR)
+            elif isinstance(e, ConnectionResetError):
+                console.log(Style.FAIL, "The connection was reset by the peer.", console.ERROR)
+            elif isinstance(e, OSError):
+                console.log(Style.FAIL, f"An OS error occurred: {e.errno} - {e.strerror}", console.ERROR)
+            else:
+                console.log(Style.FAIL, f"A socket error occurred: {e}", console.ERROR)
+        except Exception as e:
+            console.log(Style.FAIL, f'Error: {e}', console.ERROR)
+
+    def wait_for_server(self, selector, keyboard):
+        """
+        Sends the player's keypresses to the server as soon as they are typed, until a message from the server is
+        ready to be read. A free-text question is answered with a line instead, sent when Enter is pressed.
+
+        Parameters:
+        - selector (selectors.BaseSelector): Selector with the server socket and, where supported, the keyboard.
+        - keyboard (KeyboardInput): The player's keyboard.
+        """
+        self.typed = ''
+        while not self.pending_frames:
+            events = selector.select(keyboard.poll_interval)
+            for key in keyboard.read_keys(selector):
+                if not self.line_answer:
+                    if not key.isspace():
+                        self.send_client_answer(key)
                 else:
-                    print(Style.FAIL + f"A socket error occurred: {e}" + Style.END_STYLE)
-            except Exception as e:
-                print(Style.FAIL + f'Error: {e}' + Style.END_STYLE)
+                    self.type_key(key)
+            if any(key.data == 'server' for key, _ in events):
+                return
+
+    def type_key(self, key):
+        """
+        Adds a key to the line typed for a free-text question, echoing it since the terminal is in cbreak mode,
+        and sends the line when Enter is pressed.
+
+        Parameters:
+        - key (str): The key.
+        """
+        console.CONSOLE.flush()  # The question is printed by the console thread; echo only after it
+        if key in '\r\n':
+            sys.stdout.write('\n')
+            if self.typed.strip():
+                self.send_client_answer(self.typed.strip())
+            self.typed = ''
+        elif key in '\b\x7f':
+            if self.typed:
+                self.typed = self.typed[:-1]
+                sys.stdout.write('\b \b')
+        elif key.isprintable():
+            self.typed += key
+            sys.stdout.write(key)
+        sys.stdout.flush()
 
     def run_client(self):
         """
         Main client function that orchestrates the process of looking for a server, connecting, and handling trivia.
+        The server socket and the keyboard are watched by one selector, so answers need no extra process or thread.
+        The connection is kept after a game, so a server that keeps its players sends the next welcome message on it;
+        the client only looks for a server again once the connection is closed.
         """
 
-        print(Style.CYAN + f'Client started successfully!' + Style.END_STYLE)
-
-        while True:
-            self.look_for_server()
-            success = self.connect_to_server()
-            if not success:
-                continue
-            replay = True
-            self.get_msg_from_server(Style.HEADER)
-            # entering the loop to play the game
-            while replay:
-                self.get_msg_from_server(Style.HEADER)  # Get welcome message and math problem
-                t1 = multiprocessing.Process(target=self.send_client_answer)
-                t1.start()
-                replay = self.get_msg_from_server(Style.BLUE)  # Get game results
-                t1.terminate() # terminating the connection
-            t1.terminate()
-
-            if self.tcp_socket is not None:
-                self.tcp_socket.close()
-
-            sleep(1)  # Small Delay
+        console.log(Style.CYAN, f'Client started successfully!')
+
+        keyboard = KeyboardInput()
+        selector = None
+        try:
+            while True:
+                if not self.connected:
+                    self.look_for_server()
+                    success = self.connect_to_server()
+                    if not success:
+                        continue
+                    selector = selectors.DefaultSelector()
+                    selector.register(self.tcp_socket, selectors.EVENT_READ, 'server')
+                    keyboard.register(selector)
+                replay = True
+                self.get_msg_from_server(Style.HEADER)  # Get the welcome message of the next game
+                # entering the loop to play the game
+                while replay and self.connected:
+                    self.get_msg_from_server(Style.HEADER)  # Get welcome message and math problem
+                    keyboard.discard()  # Keys typed before the question are not answers to it
+                    self.wait_for_server(selector, keyboard)
+                    replay = self.get_msg_from_server(Style.BLUE)  # Get game results
+
+                if not self.connected:
+                    selector.close()
+                    self.tcp_socket.close()
+        finally:
+            keyboard.close()
+
+
+class KeyboardInput:
+    """
+    Single keypresses from the terminal, read without blocking. On POSIX stdin is switched to cbreak mode (no line
+    buffering, no echo) and registered with the client's selector; on Windows, where select only works on sockets,
+    the keyboard is polled with msvcrt between short selector timeouts.
+    """
+    POLL_INTERVAL = 0.02  # Seconds between keyboard polls on Windows
+
+    def __init__(self):
+        self.fd = None  # stdin file descriptor, on POSIX
+        self.saved_attributes = None  # Terminal attributes to restore on close
+        if msvcrt is None and sys.stdin is not None:
+            self.fd = sys.stdin.fileno()
+            if os.isatty(self.fd):
+                self.saved_attributes = termios.tcgetattr(self.fd)
+                tty.setcbreak(self.fd)
+
+    @property
+    def poll_interval(self):
+        """
+        Returns:
+        The selector timeout: None when the keyboard is in the selector, POLL_INTERVAL when it has to be polled.
+        """
+        return KeyboardInput.POLL_INTERVAL if msvcrt is not None else None
+
+    def register(self, selector):
+        """
+        Adds the keyboard to a selector where the platform supports it.
+
+        Parameters:
+        - selector (selectors.BaseSelector): The selector of the client.
+        """
+        if self.fd is not None:
+            selector.register(self.fd, selectors.EVENT_READ, 'keyboard')
+
+    def read_keys(self, selector):
+        """
+        Reads the keys pressed so far without blocking.
+
+        Parameters:
+        - selector (selectors.BaseSelector): The selector of the client; stdin is removed from it at end of input.
+
+        Returns:
+        A list of the keys, empty if none was pressed.
+        """
+        if msvcrt is not None:
+            keys = []
+            while msvcrt.kbhit():
+                keys.append(msvcrt.getwch())
+            return keys
+        if self.fd is None or not select.select([self.fd], [], [], 0)[0]:
+            return []
+        data = os.read(self.fd, 64)
+        if not data:
+            # End of piped input: nothing more will be typed
+            selector.unregister(self.fd)
+            self.fd = None
+            return []
+        return list(data.decode(errors='ignore'))
+
+    def discard(self):
+        """
+        Drops the keys typed so far.
+        """
+        if msvcrt is not None:
+            while msvcrt.kbhit():
+                msvcrt.getwch()
+        elif self.saved_attributes is not None:
+            termios.tcflush(self.fd, termios.TCIFLUSH)
+
+    def close(self):
+        """
+        Restores the terminal mode.
+        """
+        if self.saved_attributes is not None:
+            termios.tcsetattr(self.fd, termios.TCSADRAIN, self.saved_attributes)
+            self.saved_attributes = None
 
 
 if __name__ == '__main__':
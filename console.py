@@ -0,0 +1,164 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import threading
+from time import time, monotonic
+from style import Style
+
+"""
+An asynchronous, batched logging pipeline. The servers and the client hand log records to a bounded queue and return
+at once; a background thread drains the queue in batches and writes each batch with a single write call. When the
+output is a terminal the records are printed in their Style colors, otherwise they are written as JSON lines
+({"ts": ..., "level": ..., "msg": ..., plus any extra fields}) without ANSI codes, ready for a log collector.
+Noisy DEBUG records (countdowns, per-answer and per-connection lines) are rate limited, sampled once the queue fills
+up and dropped when it is full, so a slow terminal never stalls a round. Other records skip the sampling but are
+dropped too once the queue is full, so logging never blocks the thread that logs; what was left out is reported in a
+single summary record.
+"""
+
+# Levels of the records
+DEBUG = 'debug'
+INFO = 'info'
+WARNING = 'warning'
+ERROR = 'error'
+
+
+class Console:
+    MAX_DEBUG_PER_SECOND = 100  # Default rate limit of DEBUG records
+    QUEUE_SIZE = 10000  # Records waiting to be written
+    HIGH_WATER = QUEUE_SIZE // 2  # Queue length above which only one in SAMPLE_EVERY DEBUG records is kept
+    SAMPLE_EVERY = 10
+    BATCH_SIZE = 512  # Records written with a single write call
+
+    def __init__(self, max_debug_per_second=None, stream=None):
+        """
+        Initializes the Console class.
+        param:
+            max_debug_per_second (int, optional): Rate limit of the written DEBUG records.
+                Defaults to MAX_DEBUG_PER_SECOND.
+            stream (file, optional): Where to write. Defaults to sys.stdout at the time of writing.
+        """
+        self.max_debug_per_second = max_debug_per_second or Console.MAX_DEBUG_PER_SECOND
+        self.stream = stream
+        self._reset()
+
+    def _reset(self):
+        """
+        Starts over with an empty queue and no writer thread, also in a forked child, where the parent's writer
+        thread does not exist.
+        """
+        self.records = queue.Queue(Console.QUEUE_SIZE)
+        self.dropped = 0  # Records left out under backpressure since the last summary
+        self.debug_seen = 0  # DEBUG records offered while sampling, to keep one in SAMPLE_EVERY
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def log(self, style, msg, level=INFO, **fields):
+        """
+        Queues a record without waiting for the output.
+        Args:
+            style (str): The Style color of the message on a terminal.
+            msg (str): The message.
+            level (str, optional): DEBUG, INFO, WARNING or ERROR. Defaults to INFO.
+            fields: Extra structured fields of the record, written to JSON lines only.
+        """
+        if self._thread is None:
+            self._start()
+        record = (time(), level, style, msg, fields)
+        if level == DEBUG and self.records.qsize() >= Console.HIGH_WATER:
+            self.debug_seen += 1
+            if self.debug_seen % Console.SAMPLE_EVERY:
+                self.dropped += 1  # Only an estimate under contention, it is reported for information
+                return
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """
+        Blocks until every queued record was written or left out.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self.records.join()
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='console', daemon=True)
+                self._thread.start()
+
+    def _format(self, record, is_tty):
+        """
+        Args:
+            record (tuple): The (ts, level, style, msg, fields) record.
+            is_tty (bool): Whether the output is a terminal.
+        Returns:
+            str: The record as a colored line on a terminal, as a JSON line otherwise.
+        """
+        ts, level, style, msg, fields = record
+        if is_tty:
+            return style + msg + Style.END_STYLE + '\n'
+        line = {'ts': round(ts, 6), 'level': level, 'msg': msg.strip('\n')}
+        line.update(fields)
+        return json.dumps(line, ensure_ascii=False, default=str) + '\n'
+
+    def _run(self):
+        window_start = monotonic()
+        debug_written = 0  # DEBUG records written in the current one second window
+        while True:
+            try:
+                batch = [self.records.get(timeout=1)]
+            except queue.Empty:
+                batch = []  # Wake up anyway to report what the last window left out
+            while len(batch) < Console.BATCH_SIZE:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+
+            now = monotonic()
+            lines = []
+            stream = self.stream or sys.stdout
+            is_tty = stream.isatty()
+            if now - window_start >= 1:
+                if self.dropped:
+                    summary = (time(), WARNING, Style.GRAY, f'... {self.dropped} log records left out', {})
+                    lines.append(self._format(summary, is_tty))
+                    self.dropped = 0
+                window_start, debug_written = now, 0
+            for record in batch:
+                if record[1] == DEBUG:
+                    if debug_written >= self.max_debug_per_second:
+                        self.dropped += 1
+                        continue
+                    debug_written += 1
+                lines.append(self._format(record, is_tty))
+            if lines:
+                try:
+                    stream.write(''.join(lines))
+                    stream.flush()
+                except (OSError, ValueError):
+                    pass  # The output went away, e.g. a closed pipe; keep draining so loggers never block
+            for _ in batch:
+                self.records.task_done()
+
+
+CONSOLE = Console()  # The process-wide console
+atexit.register(CONSOLE.flush)  # Write what is still queued when the program ends
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=CONSOLE._reset)
+
+
+def log(style, msg, level=INFO, **fields):
+    """
+    Queues a record on the process-wide console.
+    Args:
+        style (str): The Style color of the message on a terminal.
+        msg (str): The message.
+        level (str, optional): DEBUG, INFO, WARNING or ERROR. Defaults to INFO.
+        fields: Extra structured fields of the record, written to JSON lines only.
+    """
+    CONSOLE.log(style, msg, level, **fields)
@@ -0,0 +1,174 @@
+import socket
+import threading
+from struct import Struct
+from time import monotonic
+
+"""
+Server discovery for the Client. The servers broadcast an offer once a second: the original 'IbH' packet (magic
+cookie, message type, TCP port) followed by a load extension with the number of connected players and whether a lobby
+is open. An OfferCache keeps a single UDP listener open for the life of the client and caches the latest offer of
+every server for TTL seconds, so reconnecting after a game picks a server at once instead of waiting for the next
+broadcast, and when several servers answer the client joins the least loaded one. Offers without the extension, from
+older servers, are still accepted.
+"""
+
+OFFER = Struct('IbH')  # Magic cookie, message type, server TCP port (native layout, as sent by every server)
+OFFER_LOAD = Struct('!HB')  # Connected players, lobby open flag; appended to OFFER by newer servers
+MAX_PLAYERS_IN_OFFER = 0xFFFF
+
+
+def encode_offer(magic_cookie, message_type, server_port, players, lobby_open=True):
+    """
+    Packs an offer with its load extension.
+    Args:
+        magic_cookie (int): Magic cookie for identifying messages.
+        message_type (int): Type of message.
+        server_port (int): TCP port of the server.
+        players (int): Number of connected players.
+        lobby_open (bool, optional): Whether new players join a lobby right away. Defaults to True.
+    Returns:
+        bytes: The offer packet.
+    """
+    return OFFER.pack(magic_cookie, message_type, server_port) + \
+        OFFER_LOAD.pack(min(players, MAX_PLAYERS_IN_OFFER), int(lobby_open))
+
+
+def decode_offer(data):
+    """
+    Unpacks an offer, with or without its load extension.
+    Args:
+        data (bytes): The UDP payload.
+    Returns:
+        tuple: The magic cookie, message type, TCP port, number of players (None for an older server) and lobby open
+            flag.
+    Raises:
+        struct.error: If the packet is neither an old nor an extended offer.
+    """
+    if len(data) == OFFER.size:
+        return OFFER.unpack(data) + (None, True)
+    cookie, msg_type, port = OFFER.unpack_from(data)
+    players, lobby_open = OFFER_LOAD.unpack(data[OFFER.size:])
+    return cookie, msg_type, port, players, bool(lobby_open)
+
+
+class ServerOffer:
+    """
+    The latest offer of a server, with the connection latency the client measured to it.
+    """
+    __slots__ = ('ip', 'port', 'players', 'lobby_open', 'last_seen', 'rtt')
+
+    def __init__(self, ip, port, players, lobby_open):
+        self.ip = ip
+        self.port = port
+        self.players = players  # None if the server does not report its load
+        self.lobby_open = lobby_open
+        self.last_seen = monotonic()
+        self.rtt = None  # Smoothed TCP connect time in seconds, once the client connected to the server
+
+    def rank(self):
+        """
+        Returns:
+            tuple: Sort key of the offer; lower is better. Open lobbies first, then the fewest players, then the
+                lowest connect time.
+        """
+        return (not self.lobby_open,
+                self.players if self.players is not None else float('inf'),
+                self.rtt if self.rtt is not None else float('inf'))
+
+
+class OfferCache:
+    TTL = 30  # Seconds an offer stays usable after the last broadcast of its server
+    RTT_SMOOTHING = 0.25  # Weight of a new connect time in the smoothed RTT
+
+    def __init__(self, client_port, parse_offer, ttl=None):
+        """
+        Initializes the OfferCache class and starts listening for offers in the background.
+        param:
+            client_port (int): The UDP port the servers broadcast to.
+            parse_offer (function): Validates a packet and returns (port, players, lobby_open), or None to ignore it.
+            ttl (float, optional): Seconds an offer stays usable. Defaults to TTL.
+        """
+        self.parse_offer = parse_offer
+        self.ttl = ttl or OfferCache.TTL
+        self.offers = {}  # ServerOffer by (ip, port)
+        self._condition = threading.Condition()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Set socket option to allow reuse of address
+        self.sock.bind(('', client_port))
+        self._thread = threading.Thread(target=self._listen, name='discovery', daemon=True)
+        self._thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(1024)
+            except OSError:
+                return  # The cache was closed
+            parsed = self.parse_offer(data)
+            if parsed is None:
+                continue
+            port, players, lobby_open = parsed
+            with self._condition:
+                offer = self.offers.get((address[0], port))
+                if offer is None:
+                    self.offers[(address[0], port)] = ServerOffer(address[0], port, players, lobby_open)
+                else:
+                    offer.players, offer.lobby_open, offer.last_seen = players, lobby_open, monotonic()
+                self._condition.notify_all()
+
+    def live_offers(self):
+        """
+        Returns:
+            list: The offers seen within the TTL, expired ones are removed from the cache.
+        """
+        with self._condition:
+            now = monotonic()
+            for key in [key for key, offer in self.offers.items() if now - offer.last_seen > self.ttl]:
+                del self.offers[key]
+            return list(self.offers.values())
+
+    def best(self, timeout=None):
+        """
+        Picks the server to join, waiting for an offer if none is cached.
+        Args:
+            timeout (float, optional): Maximum seconds to wait for an offer. Defaults to None, wait forever.
+        Returns:
+            ServerOffer: The best ranked live offer, or None if none arrived in time.
+        """
+        end = None if timeout is None else monotonic() + timeout
+        with self._condition:
+            while True:
+                offers = self.live_offers()
+                if offers:
+                    return min(offers, key=ServerOffer.rank)
+                remaining = None if end is None else end - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def record_rtt(self, ip, port, seconds):
+        """
+        Updates the smoothed connect time of a server.
+        Args:
+            ip (str): IP address of the server.
+            port (int): TCP port of the server.
+            seconds (float): The measured connect time.
+        """
+        with self._condition:
+            offer = self.offers.get((ip, port))
+            if offer is not None:
+                offer.rtt = seconds if offer.rtt is None else \
+                    offer.rtt + OfferCache.RTT_SMOOTHING * (seconds - offer.rtt)
+
+    def forget(self, ip, port):
+        """
+        Drops the offer of a server the client failed to connect to, until it broadcasts again.
+        Args:
+            ip (str): IP address of the server.
+            port (int): TCP port of the server.
+        """
+        with self._condition:
+            self.offers.pop((ip, port), None)
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,377 @@
+import os
+import sys
+import atexit
+import argparse
+import threading
+import colorama
+from struct import Struct
+from style import Style
+from time import time_ns, perf_counter
+import arbitration
+
+"""
+An append-only binary journal of the games a server hosts, and a streaming reader that replays it offline. The
+servers append a record for every lobby (its players), question (correct answer, answer window, fairness window),
+answer (raw and processed answer, with the player's question send and answer receive timestamps) and result (the
+winner and when the round closed). Records go through a large write buffer and the file is fsynced periodically by a
+background thread, never per record, so journaling costs a struct pack and a memory copy on the hot path.
+
+replay() feeds every recorded round through a fresh AnswerArbiter driven by a virtual clock set to the recorded
+receive times, so a journal replays at many times real speed and reproduces how a disputed win was decided; a round
+whose replayed winner differs from the recorded one points at a change in the arbitration logic. Run
+`python journal.py game.journal` to replay a journal, `--game ID` to list the records of one game.
+"""
+
+FILE_MAGIC = b'TRVJ\x01'  # Starts every journal file; the last byte is the format version
+RECORD_HEADER = Struct('!BIIqI')  # Record type, game id, round id, wall clock time_ns(), payload length
+STR_LENGTH = Struct('!H')
+LOBBY = Struct('!I')  # Number of players, followed by their names
+QUESTION = Struct('!Bdq')  # Correct answer, answer window in seconds, fairness window in ns; followed by the question
+ANSWER = Struct('!Bqq')  # Processed answer, question sent ns, answer received ns; followed by the player and raw answer
+RESULT = Struct('!q')  # perf_counter_ns() at which the round closed; followed by the winner, empty if none
+# Processed answer of an answer that is not a valid answer to the question. Answer values fit in one byte below it,
+# which MultipleChoiceQuestion.MAX_CHOICES guarantees
+INVALID_ANSWER = 0xFF
+
+# Record types
+LOBBY_RECORD = 1
+QUESTION_RECORD = 2
+ANSWER_RECORD = 3
+RESULT_RECORD = 4
+
+
+def pack_str(text):
+    """
+    Args:
+        text (str): A string.
+    Returns:
+        bytes: The UTF-8 bytes of the string, truncated to 65535 bytes, preceded by their length.
+    """
+    data = text.encode('utf8', errors='replace')[:0xFFFF]
+    return STR_LENGTH.pack(len(data)) + data
+
+
+def unpack_str(payload, offset):
+    """
+    Args:
+        payload (bytes): A record payload.
+        offset (int): Where the string starts.
+    Returns:
+        tuple: The string and the offset right after it.
+    """
+    length, = STR_LENGTH.unpack_from(payload, offset)
+    offset += STR_LENGTH.size
+    return payload[offset:offset + length].decode('utf8', errors='replace'), offset + length
+
+
+class JournalWriter:
+    BUFFER_SIZE = 1 << 20  # Bytes buffered before the journal is written to the file
+    FSYNC_INTERVAL = 1  # Seconds between fsyncs; a crash loses at most this much of the journal
+
+    def __init__(self, path, fsync_interval=None):
+        """
+        Initializes the JournalWriter class and opens the journal for appending.
+        param:
+            path (str): Path of the journal file, created if it does not exist.
+            fsync_interval (float, optional): Seconds between fsyncs. Defaults to FSYNC_INTERVAL.
+        """
+        self.path = path
+        self.fsync_interval = fsync_interval or JournalWriter.FSYNC_INTERVAL
+        self.file = open(path, 'ab', buffering=JournalWriter.BUFFER_SIZE)
+        if self.file.tell() == 0:
+            self.file.write(FILE_MAGIC)
+        self.dirty = False  # Records appended since the last fsync
+        self._lock = threading.Lock()  # Answer threads of the threaded server append concurrently
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._sync_periodically, name='journal', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def append(self, record_type, game_id, round_id, payload):
+        """
+        Appends a record to the write buffer.
+        Args:
+            record_type (int): One of the record type constants.
+            game_id (int): The game the record belongs to.
+            round_id (int): The round the record belongs to, 0 for a lobby.
+            payload (bytes): The packed record.
+        """
+        header = RECORD_HEADER.pack(record_type, game_id, round_id, time_ns(), len(payload))
+        with self._lock:
+            if self.file.closed:
+                return
+            self.file.write(header + payload)
+            self.dirty = True
+
+    def lobby(self, game_id, player_names):
+        """
+        Records the players a game starts with.
+        Args:
+            game_id (int): The game.
+            player_names (list): The names of the players.
+        """
+        self.append(LOBBY_RECORD, game_id, 0,
+                    LOBBY.pack(len(player_names)) + b''.join(pack_str(name) for name in player_names))
+
+    def question(self, game_id, round_id, correct_answer, timeout, fairness_window_ns, question):
+        """
+        Records a question once it was sent to the players.
+        Args:
+            game_id (int): The game.
+            round_id (int): The round of the question.
+            correct_answer (int): The value of the correct answer, below INVALID_ANSWER.
+            timeout (float): Seconds the players have to answer.
+            fairness_window_ns (int): The fairness window of the round's arbiter.
+            question (str): The question as sent.
+        """
+        self.append(QUESTION_RECORD, game_id, round_id,
+                    QUESTION.pack(correct_answer, timeout, fairness_window_ns) + pack_str(question))
+
+    def answer(self, game_id, round_id, player_name, raw_answer, processed_answer, sent_ns, arrival_ns):
+        """
+        Records an answer before it is submitted to the round's arbiter.
+        Args:
+            game_id (int): The game.
+            round_id (int): The round the answer belongs to.
+            player_name (str): The player who answered.
+            raw_answer (str): The decoded answer as sent by the player.
+            processed_answer (int): The answer value (choice index, 0/1), None if invalid. Must be below
+                INVALID_ANSWER to fit in one byte.
+            sent_ns (int): perf_counter_ns() at which the question was sent to the player, 0 if unknown.
+            arrival_ns (int): perf_counter_ns() at which the answer was received.
+        """
+        processed = INVALID_ANSWER if processed_answer is None else processed_answer
+        self.append(ANSWER_RECORD, game_id, round_id,
+                    ANSWER.pack(processed, sent_ns or 0, arrival_ns) + pack_str(player_name) + pack_str(raw_answer))
+
+    def result(self, game_id, round_id, winner, closed_ns):
+        """
+        Records the outcome of a round, after every answer of the round was recorded.
+        Args:
+            game_id (int): The game.
+            round_id (int): The round.
+            winner (str): The name of the winner, or None if the round expired.
+            closed_ns (int): perf_counter_ns() at which the round's arbiter was closed.
+        """
+        self.append(RESULT_RECORD, game_id, round_id, RESULT.pack(closed_ns) + pack_str(winner or ''))
+
+    def sync(self):
+        """
+        Writes the buffered records to the file and fsyncs it. The fsync runs outside the lock, so appends never
+        wait for the disk.
+        """
+        with self._lock:
+            if self.file.closed or not self.dirty:
+                return
+            self.file.flush()
+            self.dirty = False
+            fd = self.file.fileno()
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass  # The journal was closed meanwhile, close() synced it
+
+    def _sync_periodically(self):
+        while not self._closed.wait(self.fsync_interval):
+            self.sync()
+
+    def close(self):
+        """
+        Syncs and closes the journal.
+        """
+        self._closed.set()
+        self.sync()
+        with self._lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+class JournalRecord:
+    __slots__ = ('record_type', 'game_id', 'round_id', 'ts_ns', 'fields')
+
+    def __init__(self, record_type, game_id, round_id, ts_ns, fields):
+        self.record_type = record_type
+        self.game_id = game_id
+        self.round_id = round_id
+        self.ts_ns = ts_ns  # Wall clock time_ns() at which the record was appended
+        self.fields = fields  # The decoded payload
+
+    def __repr__(self):
+        return f'JournalRecord({self.record_type}, game {self.game_id}, round {self.round_id}, {self.fields})'
+
+
+def decode_payload(record_type, payload):
+    """
+    Args:
+        record_type (int): One of the record type constants.
+        payload (bytes): The packed record.
+    Returns:
+        dict: The fields of the record, or None for an unknown record type.
+    """
+    if record_type == LOBBY_RECORD:
+        count, = LOBBY.unpack_from(payload)
+        names, offset = [], LOBBY.size
+        for _ in range(count):
+            name, offset = unpack_str(payload, offset)
+            names.append(name)
+        return {'players': names}
+    if record_type == QUESTION_RECORD:
+        correct_answer, timeout, fairness_window_ns = QUESTION.unpack_from(payload)
+        question, _ = unpack_str(payload, QUESTION.size)
+        return {'correct_answer': correct_answer, 'timeout': timeout, 'fairness_window_ns': fairness_window_ns,
+                'question': question}
+    if record_type == ANSWER_RECORD:
+        processed, sent_ns, arrival_ns = ANSWER.unpack_from(payload)
+        player_name, offset = unpack_str(payload, ANSWER.size)
+        raw_answer, _ = unpack_str(payload, offset)
+        return {'player': player_name, 'answer': raw_answer,
+                'processed': None if processed == INVALID_ANSWER else processed,
+                'sent_ns': sent_ns, 'arrival_ns': arrival_ns}
+    if record_type == RESULT_RECORD:
+        closed_ns, = RESULT.unpack_from(payload)
+        winner, _ = unpack_str(payload, RESULT.size)
+        return {'winner': winner or None, 'closed_ns': closed_ns}
+    return None
+
+
+def read_journal(path):
+    """
+    Streams the records of a journal without loading it in memory. A record cut short by a crash ends the stream.
+    Args:
+        path (str): Path of the journal file.
+    Yields:
+        JournalRecord: The records, in the order they were appended.
+    Raises:
+        ValueError: If the file is not a journal.
+    """
+    with open(path, 'rb', buffering=JournalWriter.BUFFER_SIZE) as journal:
+        if journal.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError(f'{path} is not a trivia journal')
+        while True:
+            header = journal.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            record_type, game_id, round_id, ts_ns, length = RECORD_HEADER.unpack(header)
+            payload = journal.read(length)
+            if len(payload) < length:
+                return
+            fields = decode_payload(record_type, payload)
+            if fields is not None:
+                yield JournalRecord(record_type, game_id, round_id, ts_ns, fields)
+
+
+class RoundReplay:
+    __slots__ = ('game_id', 'round_id', 'recorded_winner', 'replayed_winner', 'answers')
+
+    def __init__(self, game_id, round_id, recorded_winner, replayed_winner, answers):
+        self.game_id = game_id
+        self.round_id = round_id
+        self.recorded_winner = recorded_winner
+        self.replayed_winner = replayed_winner
+        self.answers = answers  # Answers fed to the arbiter
+
+    @property
+    def matches(self):
+        return self.recorded_winner == self.replayed_winner
+
+
+def replay_round(question, answers, result):
+    """
+    Decides a recorded round again with the current arbitration logic.
+    Args:
+        question (JournalRecord): The QUESTION record of the round.
+        answers (list): The ANSWER records of the round.
+        result (JournalRecord): The RESULT record of the round.
+    Returns:
+        RoundReplay: The recorded and the replayed winner.
+    """
+    now_ns = 0
+
+    def clock():
+        return now_ns
+
+    arbiter = arbitration.AnswerArbiter(question.fields['correct_answer'], question.fields['timeout'],
+                                        question.fields['fairness_window_ns'], clock=clock)
+    # Answers read after the round closed never reached the arbiter
+    fed = sorted((answer for answer in answers if answer.fields['arrival_ns'] <= result.fields['closed_ns']),
+                 key=lambda answer: answer.fields['arrival_ns'])
+    for answer in fed:
+        now_ns = answer.fields['arrival_ns']
+        if answer.fields['processed'] is not None:
+            arbiter.submit(answer.fields['player'], answer.fields['processed'], answer.fields['arrival_ns'],
+                           answer.fields['sent_ns'])
+    return RoundReplay(question.game_id, question.round_id, result.fields['winner'], arbiter.close(), len(fed))
+
+
+def replay(records):
+    """
+    Replays every round of a journal through the arbitration logic, as fast as the records can be read.
+    Args:
+        records (iterable): JournalRecord objects, e.g. from read_journal.
+    Yields:
+        RoundReplay: One per round that has both its question and its result in the journal.
+    """
+    open_rounds = {}  # (question record, answer records) of the current round of every game
+    for record in records:
+        if record.record_type == QUESTION_RECORD:
+            open_rounds[record.game_id] = (record, [])
+        elif record.record_type == ANSWER_RECORD:
+            current = open_rounds.get(record.game_id)
+            if current is not None and current[0].round_id == record.round_id:
+                current[1].append(record)
+        elif record.record_type == RESULT_RECORD:
+            current = open_rounds.pop(record.game_id, None)
+            if current is not None and current[0].round_id == record.round_id:
+                yield replay_round(current[0], current[1], record)
+
+
+def print_game(path, game_id):
+    """
+    Prints the records of one game.
+    Args:
+        path (str): Path of the journal file.
+        game_id (int): The game to print.
+    """
+    for record in read_journal(path):
+        if record.game_id != game_id:
+            continue
+        fields = record.fields
+        if record.record_type == LOBBY_RECORD:
+            print(Style.HEADER + f'Game {game_id}: {len(fields["players"])} players: '
+                                 f'{", ".join(fields["players"])}' + Style.END_STYLE)
+        elif record.record_type == QUESTION_RECORD:
+            print(Style.HEADER + f'Round {record.round_id}: {fields["question"].strip()} '
+                                 f'(answer {fields["correct_answer"]}, fairness window '
+                                 f'{fields["fairness_window_ns"] / 1000:.0f} us)' + Style.END_STYLE)
+        elif record.record_type == ANSWER_RECORD:
+            latency_ms = (fields['arrival_ns'] - fields['sent_ns']) / 1e6 if fields['sent_ns'] else float('nan')
+            print(Style.CYAN + f'  {fields["player"]}: {fields["answer"]!r} after {latency_ms:.3f}ms' + Style.END_STYLE)
+        elif record.record_type == RESULT_RECORD:
+            print(Style.BLUE + f'  Winner: {fields["winner"] or "none"}' + Style.END_STYLE)
+
+
+if __name__ == '__main__':
+    colorama.init()
+    parser = argparse.ArgumentParser(description='Replay a trivia game journal through the arbitration logic.')
+    parser.add_argument('journal', help='path of the journal file')
+    parser.add_argument('-g', '--game', type=int, default=None, help='print the records of this game instead')
+    args = parser.parse_args()
+
+    if args.game is not None:
+        print_game(args.journal, args.game)
+        sys.exit(0)
+    start = perf_counter()
+    rounds = answers = 0
+    mismatches = []
+    for replayed in replay(read_journal(args.journal)):
+        rounds += 1
+        answers += replayed.answers
+        if not replayed.matches:
+            mismatches.append(replayed)
+    elapsed = perf_counter() - start
+    for replayed in mismatches:
+        print(Style.FAIL + f'Game {replayed.game_id} round {replayed.round_id}: recorded winner '
+                           f'{replayed.recorded_winner}, replayed winner {replayed.replayed_winner}' + Style.END_STYLE)
+    print(Style.CYAN + f'Replayed {rounds} rounds and {answers} answers in {elapsed:.3f}s, '
+                       f'{len(mismatches)} mismatches' + Style.END_STYLE)
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,132 @@
+import os
+import sys
+import socket
+import signal
+import argparse
+import multiprocessing
+import colorama
+from style import Style
+import console
+from time import sleep
+from async_server import AsyncServer
+
+"""
+A launcher that shards the trivia server across CPU cores. It forks N worker processes, each running its own
+AsyncServer (event loop, lobbies and games) bound to the same TCP port with SO_REUSEPORT, so the kernel spreads new
+connections between them and the GIL no longer caps the server at one core. Only the first worker broadcasts the UDP
+offers. Every worker publishes its player count to a shared memory array that the launcher prints periodically.
+"""
+
+MAGIC_COOKIE = 0xabcddcba
+MESSAGE_TYPE = 0x02
+SERVER_PORT = 4567
+CLIENT_PORT = 13117
+SHUTDOWN_TIMEOUT = 30  # Seconds a worker has to finish its rounds and drain its players before it is killed
+
+
+def run_worker(worker_index, load_slots, wifi_interface, listen_backlog=None, metrics_port=None,
+               persistent_sessions=False, journal_path=None, leaderboard_path=None):
+    """
+    Entry point of a worker process: builds an AsyncServer sharing the TCP port and runs it forever.
+    Args:
+        worker_index (int): Index of the worker, also its slot in load_slots.
+        load_slots (multiprocessing.Array): Shared per-worker player counts.
+        wifi_interface (str): Name of the interface to advertise, or None for the default.
+        listen_backlog (int, optional): Length of the listen queue of the worker. Defaults to None, the server default.
+        metrics_port (int, optional): Port of the worker's metrics endpoint, or None to not serve it. Defaults to None.
+        persistent_sessions (bool, optional): Keep players connected between games. Defaults to False.
+        journal_path (str, optional): Journal file of the worker, or None to not keep one. Defaults to None.
+        leaderboard_path (str, optional): Leaderboard database shared by the workers, or None to not keep one.
+            Defaults to None.
+    """
+    colorama.init()
+    server = AsyncServer(magic_cookie=MAGIC_COOKIE, message_type=MESSAGE_TYPE, server_port=SERVER_PORT,
+                         client_port=CLIENT_PORT, wifi_interface=wifi_interface, reuse_port=True,
+                         send_offers=worker_index == 0, load_slots=load_slots, worker_index=worker_index,
+                         listen_backlog=listen_backlog, metrics_port=metrics_port,
+                         persistent_sessions=persistent_sessions, journal_path=journal_path,
+                         leaderboard_path=leaderboard_path)
+    server.install_signal_handlers()  # The launcher's SIGTERM shuts the worker down gracefully
+    try:
+        server.run_server()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        console.CONSOLE.flush()  # Worker processes exit without running atexit handlers
+
+
+def launch(workers, wifi_interface=None, report_interval=5, listen_backlog=None, metrics_port=None,
+           persistent_sessions=False, journal_path=None, leaderboard_path=None):
+    """
+    Forks the worker processes and prints the total load until interrupted.
+    Args:
+        workers (int): Number of worker processes to fork.
+        wifi_interface (str, optional): Name of the interface to advertise. Defaults to None.
+        report_interval (int, optional): Seconds between load reports. Defaults to 5.
+        listen_backlog (int, optional): Length of each worker's listen queue. Defaults to None, the server default.
+        metrics_port (int, optional): Metrics port of the first worker; worker i serves on metrics_port + i.
+            Defaults to None, no metrics endpoint.
+        persistent_sessions (bool, optional): Keep players connected to their worker between games.
+            Defaults to False.
+        journal_path (str, optional): Journal path prefix; worker i appends to journal_path.i, since the workers
+            number their games independently. Defaults to None, no journal.
+        leaderboard_path (str, optional): Leaderboard database shared by every worker. Defaults to None, no
+            leaderboard.
+    """
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        console.log(Style.FAIL, 'SO_REUSEPORT is not supported on this platform. Run server.py instead.', console.ERROR)
+        sys.exit(1)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)  # SIGTERM stops the launcher like Ctrl-C
+    ctx = multiprocessing.get_context('fork')
+    # One int per worker; each worker only writes its own slot, so the array needs no lock
+    load_slots = ctx.Array('i', workers, lock=False)
+    processes = [ctx.Process(target=run_worker,
+                             args=(i, load_slots, wifi_interface, listen_backlog,
+                                   None if metrics_port is None else metrics_port + i, persistent_sessions,
+                                   None if journal_path is None else f'{journal_path}.{i}', leaderboard_path),
+                             daemon=True)
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    console.log(Style.CYAN, f'Started {workers} workers on port {SERVER_PORT}', workers=workers)
+
+    try:
+        while any(process.is_alive() for process in processes):
+            sleep(report_interval)
+            counts = list(load_slots)
+            console.log(Style.GRAY, f'Players: {sum(counts)} total, per worker: {counts}', players=sum(counts),
+                        per_worker=counts)
+    except KeyboardInterrupt:
+        console.log(Style.WARNING, 'Shutting down workers...', console.WARNING)
+    finally:
+        for process in processes:
+            process.terminate()  # SIGTERM, which lets the worker finish its rounds
+        for process in processes:
+            process.join(SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+
+if __name__ == '__main__':
+    colorama.init()
+    parser = argparse.ArgumentParser(description='Run the trivia server sharded across worker processes.')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('-i', '--interface', default=None, help='network interface to advertise')
+    parser.add_argument('-b', '--backlog', type=int, default=None, help='listen backlog of every worker')
+    parser.add_argument('-m', '--metrics-port', type=int, default=None,
+                        help='metrics port of the first worker, the others use the following ports')
+    parser.add_argument('-s', '--sessions', action='store_true',
+                        help='keep players connected between games instead of making them reconnect')
+    parser.add_argument('-j', '--journal', default=None,
+                        help='journal every game to JOURNAL.<worker>, replayable with journal.py')
+    parser.add_argument('-l', '--leaderboard', default=None,
+                        help='SQLite database of the player leaderboard, shared by the workers')
+    args = parser.parse_args()
+    launch(args.workers, args.interface, listen_backlog=args.backlog, metrics_port=args.metrics_port,
+           persistent_sessions=args.sessions, journal_path=args.journal,
+           leaderboard_path=args.leaderboard)
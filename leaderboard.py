@@ -0,0 +1,339 @@
+import sqlite3
+import argparse
+import threading
+import atexit
+import colorama
+import console
+from style import Style
+
+"""
+A persistent leaderboard of wins, answers, accuracy and answer latency per player, stored in a local SQLite file.
+The servers update the leaderboard in memory as answers and winners come in, and a background thread writes the
+changes to the database in one transaction per second, so a round never waits for the disk. Rows are upserted as
+increments, which lets every worker of launcher.py share one file; a worker reloads the statistics whenever another
+one wrote the file, so every worker ranks the players by the totals of all of them.
+
+Players are ranked by wins. A Fenwick tree over the win counts answers 'how many players have more wins' in
+O(log n), which gives a player's rank and percentile, and walking the tree from the top lists the top N players
+without sorting the leaderboard. Run `python leaderboard.py leaderboard.db` to print the top players.
+"""
+
+TOP_PLAYERS = 5  # Players listed in the welcome message
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS players (
+    name TEXT PRIMARY KEY,
+    wins INTEGER NOT NULL DEFAULT 0,
+    answers INTEGER NOT NULL DEFAULT 0,
+    correct INTEGER NOT NULL DEFAULT 0,
+    latency_ns INTEGER NOT NULL DEFAULT 0
+)'''
+
+UPSERT = '''INSERT INTO players (name, wins, answers, correct, latency_ns) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (name) DO UPDATE SET wins = wins + excluded.wins, answers = answers + excluded.answers,
+    correct = correct + excluded.correct, latency_ns = latency_ns + excluded.latency_ns'''
+
+
+class RankTree:
+    """
+    A Fenwick tree counting players by number of wins, growing as the best player's win count does.
+    """
+
+    def __init__(self, size=64):
+        """
+        Initializes the RankTree class.
+        param:
+            size (int, optional): Initial number of win counts covered, a power of two. Defaults to 64.
+        """
+        self.size = size
+        self.tree = [0] * (size + 1)  # tree[i] counts the players in a range of win counts ending at i - 1
+        self.total = 0
+
+    def add(self, wins, delta):
+        """
+        Adds delta players with the given number of wins.
+        Args:
+            wins (int): The number of wins.
+            delta (int): 1 for a player who reached the count, -1 for a player who left it.
+        """
+        while wins >= self.size:
+            # The new root covers the whole old tree and every other new node an empty range
+            self.tree.extend([0] * self.size)
+            self.size *= 2
+            self.tree[self.size] = self.total
+        self.total += delta
+        i = wins + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def count_at_most(self, wins):
+        """
+        Args:
+            wins (int): A number of wins.
+        Returns:
+            int: The number of players with at most that many wins.
+        """
+        count = 0
+        i = min(wins + 1, self.size)
+        while i > 0:
+            count += self.tree[i]
+            i -= i & -i
+        return count
+
+    def rank(self, wins):
+        """
+        Args:
+            wins (int): A number of wins.
+        Returns:
+            int: 1 plus the number of players with more wins; players with the same wins share a rank.
+        """
+        return self.total - self.count_at_most(wins) + 1
+
+    def kth(self, k):
+        """
+        Args:
+            k (int): A position in the players ordered by increasing wins, from 1 to total.
+        Returns:
+            int: The number of wins of the player at that position.
+        """
+        i = 0
+        step = self.size
+        while step:
+            if i + step <= self.size and self.tree[i + step] < k:
+                i += step
+                k -= self.tree[i]
+            step //= 2
+        return i  # Index i + 1 holds the position, and index i + 1 counts i wins
+
+
+class PlayerStats:
+    __slots__ = ('name', 'wins', 'answers', 'correct', 'latency_ns')
+
+    def __init__(self, name, wins=0, answers=0, correct=0, latency_ns=0):
+        self.name = name
+        self.wins = wins
+        self.answers = answers  # Valid answers
+        self.correct = correct  # Correct answers
+        self.latency_ns = latency_ns  # Sum of the answer latencies
+
+    @property
+    def accuracy(self):
+        return self.correct / self.answers if self.answers else 0.0
+
+    @property
+    def mean_latency(self):
+        """
+        Returns:
+            float: The mean answer latency in seconds.
+        """
+        return self.latency_ns / self.answers / 1e9 if self.answers else 0.0
+
+    def describe(self):
+        return (f'{self.name} - {self.wins} win{"" if self.wins == 1 else "s"}, {self.accuracy:.0%} correct, '
+                f'{self.mean_latency:.2f}s per answer')
+
+
+class Leaderboard:
+    FLUSH_INTERVAL = 1  # Seconds between writes to the database
+
+    def __init__(self, path, flush_interval=None):
+        """
+        Initializes the Leaderboard class and loads the stored statistics.
+        param:
+            path (str): Path of the SQLite database, created if it does not exist.
+            flush_interval (float, optional): Seconds between writes to the database. Defaults to FLUSH_INTERVAL.
+        """
+        self.path = path
+        self.flush_interval = flush_interval or Leaderboard.FLUSH_INTERVAL
+        self.players = {}  # PlayerStats by name
+        self.by_wins = {}  # Names by number of wins, as insertion-ordered dicts
+        self.ranks = RankTree()
+        self.pending = {}  # [wins, answers, correct, latency_ns] not yet written, by name
+        self._lock = threading.Lock()  # Answer threads of the threaded server record concurrently
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)  # Used by one thread at a time
+        with self._db:
+            self._db.execute(SCHEMA)
+        self.data_version = None  # PRAGMA data_version when the statistics were last loaded
+        self.refresh()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._flush_periodically, name='leaderboard', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _stats(self, name):
+        stats = self.players.get(name)
+        if stats is None:
+            stats = self.players[name] = PlayerStats(name)
+            self.by_wins.setdefault(0, {})[name] = None
+            self.ranks.add(0, 1)
+        return stats
+
+    def _set_wins(self, stats, wins):
+        bucket = self.by_wins[stats.wins]
+        del bucket[stats.name]
+        if not bucket:
+            del self.by_wins[stats.wins]
+        self.ranks.add(stats.wins, -1)
+        stats.wins = wins
+        self.by_wins.setdefault(wins, {})[stats.name] = None
+        self.ranks.add(wins, 1)
+
+    def _pending(self, name):
+        pending = self.pending.get(name)
+        if pending is None:
+            pending = self.pending[name] = [0, 0, 0, 0]
+        return pending
+
+    def record_answer(self, name, correct, latency_ns):
+        """
+        Records a valid answer.
+        Args:
+            name (str): The player who answered.
+            correct (bool): Whether the answer was correct.
+            latency_ns (int): Nanoseconds between sending the question and receiving the answer.
+        """
+        with self._lock:
+            stats = self._stats(name)
+            stats.answers += 1
+            stats.correct += correct
+            stats.latency_ns += latency_ns
+            pending = self._pending(name)
+            pending[1] += 1
+            pending[2] += correct
+            pending[3] += latency_ns
+
+    def record_win(self, name):
+        """
+        Records a won game, moving the player one win up in the ranking.
+        Args:
+            name (str): The winner.
+        """
+        with self._lock:
+            stats = self._stats(name)
+            self._set_wins(stats, stats.wins + 1)
+            self._pending(name)[0] += 1
+
+    def rank(self, name):
+        """
+        Args:
+            name (str): A player name.
+        Returns:
+            tuple: The player's rank and the number of ranked players, or None if the player never played.
+        """
+        with self._lock:
+            stats = self.players.get(name)
+            if stats is None:
+                return None
+            return self.ranks.rank(stats.wins), self.ranks.total
+
+    def top(self, n=TOP_PLAYERS):
+        """
+        Args:
+            n (int, optional): Number of players. Defaults to TOP_PLAYERS.
+        Returns:
+            list: The PlayerStats of the n players with the most wins, the earliest to reach a count first on ties.
+        """
+        top = []
+        with self._lock:
+            k = self.ranks.total
+            while k > 0 and len(top) < n:
+                wins = self.ranks.kth(k)
+                names = self.by_wins[wins]
+                top.extend(self.players[name] for name in list(names)[:n - len(top)])
+                k -= len(names)
+        return top
+
+    def standings(self, n=TOP_PLAYERS):
+        """
+        Args:
+            n (int, optional): Number of players listed. Defaults to TOP_PLAYERS.
+        Returns:
+            str: The leaderboard lines of the welcome message, empty if nobody won yet.
+        """
+        top = [stats for stats in self.top(n) if stats.wins]
+        if not top:
+            return ''
+        return 'Leaderboard:\n' + '\n'.join(f'{i + 1}. {stats.describe()}' for i, stats in enumerate(top))
+
+    def winner_line(self, name):
+        """
+        Args:
+            name (str): The winner of a game, already recorded.
+        Returns:
+            str: The winner's wins, rank and percentile for the winner message.
+        """
+        with self._lock:
+            stats = self.players[name]
+            rank = self.ranks.rank(stats.wins)
+            total = self.ranks.total
+        return f'{stats.describe()}, rank {rank} of {total} (top {max(1, round(100 * rank / total))}%)'
+
+    def flush(self):
+        """
+        Writes the changes recorded since the last flush to the database in one transaction.
+        """
+        with self._lock:
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, {}
+        try:
+            with self._db:
+                self._db.executemany(UPSERT, [(name, *counts) for name, counts in pending.items()])
+        except sqlite3.Error as e:
+            console.log(Style.FAIL, f'Could not write the leaderboard: {e}', console.ERROR)
+            with self._lock:  # Retry with the next flush
+                for name, counts in pending.items():
+                    merged = self._pending(name)
+                    for i, count in enumerate(counts):
+                        merged[i] += count
+
+    def refresh(self):
+        """
+        Reloads the statistics from the database if another connection, e.g. another worker of launcher.py, wrote it
+        since they were last loaded. Changes not flushed yet are kept on top of the stored totals.
+        """
+        version = self._db.execute('PRAGMA data_version').fetchone()[0]
+        if version == self.data_version:
+            return  # Only this connection wrote the database, and the statistics in memory already count that
+        self.data_version = version
+        rows = self._db.execute('SELECT name, wins, answers, correct, latency_ns FROM players').fetchall()
+        with self._lock:
+            for name, wins, answers, correct, latency_ns in rows:
+                pending = self.pending.get(name, (0, 0, 0, 0))
+                stats = self._stats(name)
+                if stats.wins != wins + pending[0]:
+                    self._set_wins(stats, wins + pending[0])
+                stats.answers = answers + pending[1]
+                stats.correct = correct + pending[2]
+                stats.latency_ns = latency_ns + pending[3]
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+            try:
+                self.refresh()
+            except sqlite3.Error as e:
+                console.log(Style.FAIL, f'Could not read the leaderboard: {e}', console.ERROR)
+
+    def close(self):
+        """
+        Writes the pending changes and closes the database.
+        """
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._thread.join()
+        self.flush()
+        self._db.close()
+
+
+if __name__ == '__main__':
+    colorama.init()
+    parser = argparse.ArgumentParser(description='Print the top players of a leaderboard database.')
+    parser.add_argument('database', help='leaderboard database written by the servers')
+    parser.add_argument('-n', '--top', type=int, default=10, help='number of players to print')
+    args = parser.parse_args()
+    board = Leaderboard(args.database)
+    for i, stats in enumerate(board.top(args.top)):
+        print(f'{Style.BLUE}{i + 1}. {stats.describe()}{Style.END_STYLE}')
+    print(f'{len(board.players)} players')
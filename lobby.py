@@ -0,0 +1,561 @@
+import asyncio
+from style import Style
+import trivia_generator
+import arbitration
+import admission
+import protocol
+import message_cache
+import metrics
+import console
+import sessions
+import outbound
+from player import PlayerRegistry
+from time import monotonic, perf_counter_ns
+
+"""
+GameRoom and LobbyManager classes that let one AsyncServer host many independent trivia games at once. The
+LobbyManager places every new player in the currently open room; once that room closes its admission it starts
+playing on its own task and the next player opens a fresh room. Each room keeps its own players, question stream,
+timer and winner state. In session mode the players still connected when a game ends are moved into the open room
+instead of being disconnected.
+"""
+
+
+class GameRoom:
+    ANSWER_TIMEOUT = 10  # Seconds every player has to answer a question
+    BACKLOG_POLL_INTERVAL = 0.1  # Seconds between checks of how much of a player's backlog was sent
+
+    def __init__(self, room_id, server_name, messages, admission_policy, question_seed=None, server_metrics=None,
+                 session_pool=None, game_journal=None, player_leaderboard=None):
+        """
+        Initializes the GameRoom class.
+        param:
+            room_id (int): Identifier of the room, used in log messages.
+            server_name (str): Name of the server, used in the welcome message.
+            messages (message_cache.MessageCache): Cache of encoded messages, shared by the rooms.
+            admission_policy (admission.AdmissionPolicy): When the room stops accepting players.
+            question_seed (int, optional): Seed of the room's question order, to replay a game. Defaults to random.
+            server_metrics (metrics.ServerMetrics, optional): Where the room records its sends and answers.
+                Defaults to the metrics of the process-wide registry.
+            session_pool (sessions.SessionPool, optional): Where players who leave the room are detached, in session
+                mode. Defaults to None.
+            game_journal (journal.JournalWriter, optional): Where the room records its game, under its room id.
+                Defaults to None.
+            player_leaderboard (leaderboard.Leaderboard, optional): Where the room records answers and winners.
+                Defaults to None.
+        """
+        self.room_id = room_id
+        self.server_name = server_name
+        self.messages = messages
+        self.metrics = server_metrics or metrics.ServerMetrics()
+        # The room's own stream over the shared question bank, so rooms never drain each other's questions
+        self.question_source = trivia_generator.TriviaGenerator().cursor(question_seed)
+        self.players = PlayerRegistry()  # Live players of the room
+        self.session_pool = session_pool
+        self.journal = game_journal
+        self.leaderboard = player_leaderboard
+        self.admission_policy = admission_policy
+        self.first_connection_time = None  # monotonic() time of the room's first join
+        self.last_connection_time = None  # monotonic() time of the room's latest join
+        self.admitting = True  # True while new players may join the room
+        self.admission_changed = asyncio.Event()  # Set when a player joins or leaves during admission
+        self.final_answer = [-1, '']  # Winning answer and player of the current round
+        self.round_open = False  # True while answers for the current question are accepted
+        self.round_id = 0  # Sequence number of the current question
+        self.answered = set()  # Players who already answered the current question
+        self.question = None  # Question of the current round, which validates the answers
+        self.arbiter = None  # Decides the winner of the current round
+        self.sent_ns = {}  # perf_counter_ns() at which each player was sent the current question
+        self.winner_settled = None  # Set once the arbiter's fairness window after the first correct answer is over
+        self.stopping = False  # Set when the server shuts down; the game ends after the current round
+
+    @property
+    def player_count(self):
+        """
+        Returns:
+            int: The number of live players in the room.
+        """
+        return len(self.players)
+
+    @property
+    def remaining_time(self):
+        """
+        Returns:
+            float: Seconds left to answer the current question, 0 between questions.
+        """
+        return self.arbiter.remaining() if self.round_open else 0
+
+    def log(self, style, msg, level=console.INFO, **fields):
+        """
+        Queues a record tagged with the room id on the console.
+        Args:
+            style (str): The Style color of the message on a terminal.
+            msg (str): The message.
+            level (str, optional): The console level of the record. Defaults to console.INFO.
+            fields: Extra structured fields of the record.
+        """
+        console.log(style, f'[Room {self.room_id}] {msg}', level, room_id=self.room_id, **fields)
+
+    def admission_over(self):
+        """
+        Checks whether the room should stop accepting players.
+        Returns:
+            bool: True if the admission policy closes the room.
+        """
+        return self.admission_policy.lobby_closed(self.player_count, self.first_connection_time,
+                                                  self.last_connection_time)
+
+    def seconds_until_close(self):
+        """
+        Returns:
+            float: Seconds until the admission policy closes the room, or None while it lacks players.
+        """
+        return self.admission_policy.seconds_until_close(self.player_count, self.first_connection_time,
+                                                         self.last_connection_time)
+
+    def add_player(self, player):
+        """
+        Adds a player that finished its handshake to the room and starts reading its answers.
+        Args:
+            player (player.Player): The player, with the reader and writer of its connection.
+        """
+        self.players.add(player)
+        self.last_connection_time = monotonic()
+        if self.first_connection_time is None:
+            self.first_connection_time = self.last_connection_time
+        self.admission_changed.set()
+        player.reader_task = asyncio.create_task(self.read_answers(player))
+        self.log(Style.CYAN, f'{player.name} - successfully connected to the server!', console.DEBUG,
+                 player=player.name)
+
+    def build_welcome_message(self):
+        """
+        Constructs the welcome message with the server name and the names of the players in the room.
+        Returns:
+            str: The constructed welcome message.
+        """
+        welcome_msg = f'Welcome to the {self.server_name} server, where we answer trivia questions.\n'
+        welcome_msg += self.players.roster()
+        standings = self.leaderboard.standings() if self.leaderboard is not None else ''
+        if standings:
+            welcome_msg += '\n' + standings
+        welcome_msg += '\n=='
+        self.log(Style.HEADER, welcome_msg)
+        return welcome_msg
+
+    def drop_player(self, player, reason):
+        """
+        Removes a player from the room and closes its connection. A player is only dropped once.
+        Args:
+            player (player.Player): The player to drop.
+            reason (str): Why the player is dropped, for the log.
+        """
+        if not self.players.remove(player):
+            return
+        if self.session_pool is not None:
+            self.session_pool.detach(player)
+        self.log(Style.FAIL, f'{player.name} disconnected: {reason}', console.WARNING, player=player.name)
+        self.metrics.disconnects.inc()
+        player.connection.close()
+        self.admission_changed.set()
+
+    def evict(self, player, reason):
+        """
+        Drops a player whose client stopped reading its messages, discarding what is still queued for it.
+        Args:
+            player (player.Player): The player.
+            reason (str): Why the player is evicted, for the log.
+        """
+        self.metrics.evictions.inc()
+        player.connection.transport.abort()
+        self.drop_player(player, reason)
+
+    async def watch_backlog(self, player):
+        """
+        Watches the messages queued for a player until they are sent, evicting the player if its client reads none
+        of them for WRITE_DEADLINE seconds. The deadline is pushed back whenever the backlog shrinks, like the
+        threaded server's Sender does on every partial send. Rounds never wait for it.
+        Args:
+            player (player.Player): The player.
+        """
+        transport = player.connection.transport
+        queued = transport.get_write_buffer_size()
+        deadline = monotonic() + outbound.WRITE_DEADLINE
+        try:
+            while queued:
+                if transport.is_closing():
+                    error = player.reader.exception()
+                    if error is not None:
+                        self.metrics.send_errors.inc()
+                        self.drop_player(player, f'{type(error).__name__}: {error}')
+                    return  # Otherwise the reader drops the player when it sees the connection closed
+                if monotonic() >= deadline:
+                    self.evict(player, f'slow consumer, nothing read for {outbound.WRITE_DEADLINE}s')
+                    return
+                await asyncio.sleep(GameRoom.BACKLOG_POLL_INTERVAL)
+                remaining = transport.get_write_buffer_size()
+                if remaining < queued:
+                    deadline = monotonic() + outbound.WRITE_DEADLINE  # The client is reading
+                queued = remaining
+        finally:
+            if player.drain_task is asyncio.current_task():
+                player.drain_task = None
+
+    def write_all(self, frame_type, message, sent_ns=None):
+        """
+        Writes a message to every live player in a single event loop pass, reusing its cached encoding for the
+        player's protocol. Questions are tagged with the current round id. What a client cannot take right away
+        stays in its transport's buffer; a player with more than HIGH_WATER_MARK bytes queued is evicted instead.
+        Args:
+            frame_type (int): The protocol frame type of the message.
+            message (str): The message to send.
+            sent_ns (dict, optional): Filled with the perf_counter_ns() at which the message was handed to each
+                player's socket. Defaults to None.
+        Returns:
+            list: The players the message was written to.
+        """
+        encoded = self.messages.get(frame_type, message, self.round_id if frame_type == protocol.QUESTION else 0)
+        targets = []
+        for player in self.players:
+            data = encoded.for_codec(player.codec)
+            queued = player.connection.transport.get_write_buffer_size() + len(data)
+            if queued > outbound.HIGH_WATER_MARK:
+                self.evict(player, f'slow consumer, {queued} bytes queued')
+                continue
+            start_ns = perf_counter_ns()
+            player.connection.write(data)  # Sent right away unless the client's receive window is full
+            end_ns = perf_counter_ns()
+            if player.connection.transport.get_write_buffer_size() and player.drain_task is None:
+                player.drain_task = asyncio.create_task(self.watch_backlog(player))
+            targets.append(player)
+            self.metrics.send_latency.observe_ns(end_ns - start_ns)
+            if sent_ns is not None:
+                sent_ns[player] = end_ns
+                self.metrics.tracer.record('send_question', player.name, start_ns, end_ns, round_id=self.round_id,
+                                           room_id=self.room_id)
+        self.metrics.sends.inc(len(targets))
+        return targets
+
+    def broadcast(self, frame_type, message):
+        """
+        Writes a message to every live player, without waiting for the slow ones to read it.
+        Args:
+            frame_type (int): The protocol frame type of the message.
+            message (str): The message to send.
+        """
+        self.write_all(frame_type, message)
+
+    async def read_answers(self, player):
+        """
+        Reads everything a player sends for as long as it is in the room. Input that arrives while no question is
+        open, or after the player already answered the current question, is dropped.
+        Args:
+            player (player.Player): The player.
+        """
+        while player.active:
+            try:
+                data = await player.reader.read(1024)
+                arrival_ns = perf_counter_ns()  # The answer is judged by its latency from sent_ns
+            except OSError as e:
+                self.drop_player(player, f'Socket error: {e}')
+                return
+            if not data:
+                self.drop_player(player, 'connection closed')
+                return
+            try:
+                messages = player.codec.feed(data, self.round_id if self.round_open else None)
+            except protocol.ProtocolError as e:
+                self.drop_player(player, f'Protocol error: {e}')
+                return
+            if not messages or not self.round_open or player in self.answered:
+                continue
+            self.answered.add(player)
+            self.process_answer(player, messages[0].strip(), arrival_ns)
+
+    def process_answer(self, player, raw_client_answer, arrival_ns):
+        """
+        Validates a player's answer and submits it to the round's arbiter. The first correct answer starts the
+        fairness window after which the winner is settled.
+        Args:
+            player (player.Player): The player who answered.
+            raw_client_answer (str): The decoded answer sent by the player.
+            arrival_ns (int): perf_counter_ns() at which the answer was read.
+        """
+        player_name = player.name
+        sent_ns = self.sent_ns.get(player)
+        self.metrics.answers.inc()
+        if sent_ns is not None:
+            self.metrics.answer_latency.observe_ns(arrival_ns - sent_ns)
+            self.metrics.tracer.record('get_answer', player_name, sent_ns, arrival_ns, round_id=self.round_id,
+                                       room_id=self.room_id, answer=raw_client_answer)
+        self.log(Style.CYAN, f'Player: {player_name}, Answer: {raw_client_answer}', console.DEBUG,
+                 player=player_name, answer=raw_client_answer)
+        processed_answer = self.question.parse(raw_client_answer)  # One lookup in the question's accepted answers
+        if self.journal is not None:
+            self.journal.answer(self.room_id, self.round_id, player_name, raw_client_answer, processed_answer,
+                                sent_ns, arrival_ns)
+        if processed_answer is None:
+            self.metrics.invalid_answers.inc()
+            self.log(Style.FAIL, f'Player: {player_name} provided an invalid answer: {raw_client_answer}',
+                     console.DEBUG, player=player_name, answer=raw_client_answer)
+            return
+        if self.leaderboard is not None and sent_ns is not None:
+            self.leaderboard.record_answer(player_name, processed_answer == self.arbiter.correct_answer,
+                                           arrival_ns - sent_ns)
+        first_correct = self.arbiter.first_correct_ns is None
+        if self.arbiter.submit(player_name, processed_answer, arrival_ns, sent_ns) \
+                and first_correct:
+            asyncio.get_running_loop().call_later(self.arbiter.fairness_window_ns / 1e9, self.winner_settled.set)
+
+    async def play_round(self):
+        """
+        Plays a single round: broadcasts a trivia question, waits up to ANSWER_TIMEOUT seconds for the first correct
+        answer and broadcasts the game status.
+        Returns:
+            bool: A boolean indicating whether the game should be replayed.
+        """
+        self.question = self.question_source.get_question()
+        trivia_question, oracle_answer = self.question.prompt, self.question.answer
+        self.log(Style.HEADER, trivia_question, round_id=self.round_id + 1)
+
+        self.final_answer = [-1, '']
+        self.answered = set()
+        self.round_id += 1
+        self.arbiter = arbitration.AnswerArbiter(oracle_answer, GameRoom.ANSWER_TIMEOUT)
+        self.sent_ns = {}
+        self.winner_settled = asyncio.Event()
+        self.round_open = True
+        self.write_all(protocol.QUESTION, trivia_question, self.sent_ns)
+        if self.sent_ns:
+            # A player who got the question later may still win with a faster answer during the fan-out skew
+            self.arbiter.fairness_window_ns = max(self.sent_ns.values()) - min(self.sent_ns.values())
+            self.log(Style.GRAY, f'Round {self.round_id}: question fan-out to {len(self.sent_ns)} players, '
+                                 f'skew {self.arbiter.fairness_window_ns / 1000:.0f} us', console.DEBUG,
+                     round_id=self.round_id, players=len(self.sent_ns))
+        if self.journal is not None:
+            self.journal.question(self.room_id, self.round_id, oracle_answer, GameRoom.ANSWER_TIMEOUT,
+                                  self.arbiter.fairness_window_ns, trivia_question)
+
+        # Wait for the winner or timeout
+        try:
+            await asyncio.wait_for(self.winner_settled.wait(), self.arbiter.remaining())
+        except asyncio.TimeoutError:
+            pass
+        self.round_open = False
+        winner = self.arbiter.close()
+        if winner is not None:
+            self.final_answer = [oracle_answer, winner]
+        if self.journal is not None:
+            self.journal.result(self.room_id, self.round_id, winner, perf_counter_ns())
+
+        # Determine game status and notify clients
+        game_status_msg = protocol.EXPIRED_MSG
+        replay = True
+        if winner is not None:
+            game_status_msg = f"\n{winner} is correct! {winner} wins the game!\nCongratulations to the winner: {winner}\n"
+            if self.leaderboard is not None:
+                self.leaderboard.record_win(winner)  # In memory; the database is written in the background
+                game_status_msg += self.leaderboard.winner_line(winner) + '\n'
+            self.log(Style.BLUE + Style.BOLD, game_status_msg, winner=winner, round_id=self.round_id)
+            replay = False
+        else:
+            self.log(Style.WARNING, game_status_msg)
+        self.broadcast(protocol.RESULT, game_status_msg)
+        return replay
+
+    async def run_game(self):
+        """
+        Sends the welcome message and plays rounds until someone wins or every player left.
+        """
+        self.broadcast(protocol.WELCOME, self.build_welcome_message())
+        if self.journal is not None:
+            self.journal.lobby(self.room_id, [player.name for player in self.players])
+        replay = True
+        while replay and self.player_count >= 1 and not self.stopping:
+            replay = await self.play_round()
+            await asyncio.sleep(2)
+
+    async def detach_players(self):
+        """
+        Removes the players still connected from the room without closing their connections, so they can play
+        the next game, and waits until the room stopped reading from them.
+        Returns:
+            list: Every player still connected.
+        """
+        players = self.players.clear()
+        for player in players:
+            player.reader_task.cancel()
+            if player.drain_task is not None:
+                player.drain_task.cancel()  # The next room watches the player's backlog from its next write
+        # A stream allows one pending read, so the next room may only read once these readers are cancelled
+        await asyncio.gather(*(player.reader_task for player in players), return_exceptions=True)
+        return players
+
+    async def close(self):
+        """
+        Stops reading from the players of the room and closes their connections once the messages queued for them
+        are sent, aborting those whose clients do not read them within WRITE_DEADLINE seconds.
+        """
+        players = self.players.clear()
+        for player in players:
+            if self.session_pool is not None:
+                self.session_pool.detach(player)
+            player.reader_task.cancel()
+            if player.drain_task is not None:
+                player.drain_task.cancel()
+            player.connection.close()  # The transport sends its buffer before closing the socket
+        if not players:
+            return
+        closing = [asyncio.create_task(player.connection.wait_closed()) for player in players]
+        await asyncio.wait(closing, timeout=outbound.WRITE_DEADLINE)
+        for player in players:
+            if not player.connection.transport.is_closing() or player.connection.transport.get_write_buffer_size():
+                player.connection.transport.abort()
+
+
+class LobbyManager:
+    def __init__(self, server_name, admission_policy=None, server_metrics=None, persistent_sessions=False,
+                 game_journal=None, player_leaderboard=None):
+        """
+        Initializes the LobbyManager class.
+        param:
+            server_name (str): Name of the server, passed on to every room.
+            admission_policy (admission.AdmissionPolicy, optional): When rooms stop accepting players.
+                Defaults to at least 1 player and 10 seconds without a new join.
+            server_metrics (metrics.ServerMetrics, optional): Passed on to every room. Defaults to the metrics of
+                the process-wide registry.
+            persistent_sessions (bool, optional): Move the players still connected at the end of a game into the
+                open room instead of disconnecting them. Defaults to False.
+            game_journal (journal.JournalWriter, optional): Passed on to every room. Defaults to None.
+            player_leaderboard (leaderboard.Leaderboard, optional): Passed on to every room. Defaults to None.
+        """
+        self.server_name = server_name
+        self.server_metrics = server_metrics or metrics.ServerMetrics()
+        self.admission_policy = admission_policy or admission.AdmissionPolicy()
+        self.admission_metrics = admission.AdmissionMetrics(self.server_metrics)  # Room fill times and admission rate
+        self.messages = message_cache.MessageCache()  # Encoded messages shared by every room
+        self.rooms = {}  # Rooms that are admitting or playing, by room id
+        self.open_room = None  # The room new players are placed in
+        self.next_room_id = 1
+        self.persistent_sessions = persistent_sessions
+        self.journal = game_journal
+        self.leaderboard = player_leaderboard
+        self.sessions = sessions.SessionPool()  # Players attached to the server, in session mode
+        self.room_tasks = set()  # Tasks running the rooms, awaited on shutdown
+        self.stopping = False  # Set on shutdown; no player is admitted anymore
+
+    @property
+    def player_count(self):
+        """
+        Returns:
+            int: The number of active players across all rooms.
+        """
+        return sum(room.player_count for room in self.rooms.values())
+
+    @staticmethod
+    def connection_alive(player):
+        """
+        Args:
+            player (player.Player): A player.
+        Returns:
+            bool: False once the client closed the connection or the connection is closing.
+        """
+        return not player.connection.is_closing() and not player.reader.at_eof()
+
+    @property
+    def lobby_open(self):
+        """
+        Returns:
+            bool: Whether a new player joins a room right away: always, since a player who finds no room admitting
+                opens a new one, except once the server is shutting down.
+        """
+        return not self.stopping
+
+    def admit(self, player):
+        """
+        Places a player that finished its handshake, or whose game just ended in session mode, in the open room,
+        opening a new room if needed.
+        Args:
+            player (player.Player): The player, with the reader and writer of its connection.
+        Returns:
+            GameRoom: The room the player was placed in, or None if the server is shutting down.
+        """
+        if self.stopping:
+            player.connection.close()
+            return None
+        if self.open_room is None or not self.open_room.admitting:
+            self.open_room = GameRoom(self.next_room_id, self.server_name, self.messages, self.admission_policy,
+                                      server_metrics=self.server_metrics,
+                                      session_pool=self.sessions if self.persistent_sessions else None,
+                                      game_journal=self.journal, player_leaderboard=self.leaderboard)
+            self.rooms[self.next_room_id] = self.open_room
+            self.next_room_id += 1
+            task = asyncio.create_task(self.run_room(self.open_room))
+            self.room_tasks.add(task)
+            task.add_done_callback(self.room_tasks.discard)
+        room = self.open_room
+        if self.persistent_sessions:
+            previous = self.sessions.attach(player, LobbyManager.connection_alive)
+            if previous is not None and previous is not player and previous.active:
+                # The player reconnected after a drop the server did not notice yet; its room drops the stale
+                # connection
+                previous.connection.close()
+        room.add_player(player)
+        self.admission_metrics.record_join()
+        if self.admission_policy.is_full(room.player_count):
+            # Close the full room right away, so the next player already opens a new one
+            room.admitting = False
+            self.open_room = None
+        return room
+
+    async def run_room(self, room):
+        """
+        Waits for a room to close its admission, then plays its game and forgets it once it is over.
+        Args:
+            room (GameRoom): The room to run.
+        """
+        try:
+            # Sleep until the policy closes the room, waking up whenever a player joins or leaves
+            while room.admitting and room.player_count > 0 and not room.stopping:
+                until_close = room.seconds_until_close()
+                if until_close == 0:
+                    break
+                room.admission_changed.clear()
+                try:
+                    await asyncio.wait_for(room.admission_changed.wait(), until_close)
+                except asyncio.TimeoutError:
+                    pass
+            room.admitting = False
+            if room is self.open_room:
+                self.open_room = None  # The next player opens a new room
+            if room.player_count == 0 or room.stopping:
+                return  # Everybody left before the game started, or the server is shutting down
+            fill_time = self.admission_metrics.record_lobby(room.first_connection_time, monotonic(),
+                                                            room.player_count)
+            room.log(Style.HEADER, f'Starting a game with {room.player_count} players, filled in {fill_time:.1f}s, '
+                                   f'question seed {room.question_source.seed}')
+            await room.run_game()
+            if self.persistent_sessions and not self.stopping:
+                for player in await room.detach_players():
+                    self.admit(player)
+        except Exception as e:
+            room.log(Style.FAIL, f'Game aborted - Exception received: {e}', console.ERROR)
+        finally:
+            if room.stopping:
+                room.broadcast(protocol.RESULT, protocol.SHUTDOWN_MSG)
+            await room.close()  # Disconnects whoever is left in the room
+            del self.rooms[room.room_id]
+
+    async def shutdown(self):
+        """
+        Stops admitting players and lets every room finish its current round, tell its players that the server is
+        shutting down and close their connections once their messages are sent.
+        """
+        self.stopping = True
+        self.open_room = None
+        for room in self.rooms.values():
+            room.stopping = True
+            room.admission_changed.set()  # Wakes up the rooms still admitting
+        if self.room_tasks:
+            # A round, the pause after it and the last messages' drain
+            await asyncio.wait(self.room_tasks, timeout=GameRoom.ANSWER_TIMEOUT + 2 + 2 * outbound.WRITE_DEADLINE)
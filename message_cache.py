@@ -0,0 +1,74 @@
+from collections import OrderedDict
+
+"""
+A MessageCache class that encodes every server message once and hands out the same read-only buffer to every client
+that speaks the same protocol. The welcome message is encoded once per game, a question once per round and static
+status messages such as 'Expired' once per process, instead of once per client per round.
+"""
+
+
+class EncodedMessage:
+    """
+    A message together with its encodings, one memoryview per protocol codec, built the first time a client of that
+    protocol needs it.
+    """
+
+    def __init__(self, frame_type, text, round_id=0):
+        """
+        Initializes the EncodedMessage class.
+        param:
+            frame_type (int): The protocol frame type of the message.
+            text (str): The message.
+            round_id (int, optional): The round of a question. Defaults to 0.
+        """
+        self.frame_type = frame_type
+        self.text = text
+        self.round_id = round_id
+        self.buffers = {}  # Encoded message by codec name
+
+    def for_codec(self, codec):
+        """
+        Args:
+            codec (protocol.TextCodec | protocol.BinaryCodec): The codec of the receiving client.
+        Returns:
+            memoryview: The message encoded for the codec's protocol.
+        """
+        buffer = self.buffers.get(codec.name)
+        if buffer is None:
+            buffer = memoryview(codec.encode(self.frame_type, self.text, self.round_id))
+            self.buffers[codec.name] = buffer
+        return buffer
+
+
+class MessageCache:
+    MAX_MESSAGES = 256  # Least recently used messages are evicted past this size
+
+    def __init__(self, max_messages=None):
+        """
+        Initializes the MessageCache class.
+        param:
+            max_messages (int, optional): Maximum number of cached messages. Defaults to MAX_MESSAGES.
+        """
+        self.max_messages = max_messages or MessageCache.MAX_MESSAGES
+        self.messages = OrderedDict()  # EncodedMessage by (frame_type, text, round_id)
+
+    def get(self, frame_type, text, round_id=0):
+        """
+        Returns the cached message, creating it if needed.
+        Args:
+            frame_type (int): The protocol frame type of the message.
+            text (str): The message.
+            round_id (int, optional): The round of a question. Defaults to 0.
+        Returns:
+            EncodedMessage: The message, whose buffers are shared by every caller.
+        """
+        key = (frame_type, text, round_id)
+        message = self.messages.get(key)
+        if message is None:
+            message = EncodedMessage(frame_type, text, round_id)
+            self.messages[key] = message
+            if len(self.messages) > self.max_messages:
+                self.messages.popitem(last=False)
+        else:
+            self.messages.move_to_end(key)
+        return message
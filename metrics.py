@@ -0,0 +1,285 @@
+import bisect
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+An in-process metrics registry for the trivia servers: counters and latency histograms that the hot paths update
+without any I/O, an optional local HTTP endpoint that serves them in the Prometheus text format, and a sampling trace
+hook that hands a fraction of the send_question/get_answer spans to a user callback. ServerMetrics groups the metrics
+every server records, so the threaded Server, the AsyncServer and its game rooms report under the same names.
+"""
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Upper bounds of the lobby histograms: fill times in seconds and lobby sizes in players
+FILL_TIME_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120)
+LOBBY_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        """
+        Initializes the Counter class.
+        param:
+            name (str): Name of the metric.
+            help_text (str): Description of the metric.
+        """
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self):
+        """
+        Returns:
+            list: The lines of the metric in the Prometheus text format.
+        """
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter', f'{self.name} {self.value}']
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        """
+        Initializes the Histogram class.
+        param:
+            name (str): Name of the metric.
+            help_text (str): Description of the metric.
+            buckets (tuple, optional): Increasing upper bounds of the buckets. Defaults to LATENCY_BUCKETS.
+        """
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last bucket counts values above every bound
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        Records a value.
+        Args:
+            value (float): The observed value, in seconds for latencies.
+        """
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def observe_ns(self, duration_ns):
+        """
+        Records a perf_counter_ns() duration in seconds.
+        Args:
+            duration_ns (int): The duration in nanoseconds.
+        """
+        self.observe(duration_ns / 1e9)
+
+    def quantile(self, fraction):
+        """
+        Args:
+            fraction (float): The quantile as a fraction, e.g. 0.99.
+        Returns:
+            float: The upper bound of the bucket holding the quantile, or None if nothing was observed. Values above
+                the last bucket report infinity.
+        """
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        if not count:
+            return None
+        rank = fraction * count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def render(self):
+        """
+        Returns:
+            list: The lines of the metric in the Prometheus text format, with cumulative buckets.
+        """
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {count}')
+        lines.append(f'{self.name}_sum {total}')
+        lines.append(f'{self.name}_count {count}')
+        return lines
+
+    def snapshot(self):
+        return {'count': self.count, 'sum': self.sum, 'p50': self.quantile(0.5), 'p99': self.quantile(0.99)}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}  # Counter or Histogram by name, in registration order
+        self._lock = threading.Lock()
+
+    def register(self, metric_class, name, *args):
+        """
+        Returns the metric registered under a name, creating it if needed, so every server in a process shares it.
+        Args:
+            metric_class (type): Counter or Histogram.
+            name (str): Name of the metric.
+            args: Passed on to the metric class.
+        Returns:
+            Counter | Histogram: The metric.
+        Raises:
+            ValueError: If the name is already registered with another metric type.
+        """
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = metric_class(name, *args)
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f'Metric {name} is already registered as a {type(metric).__name__}')
+            return metric
+
+    def counter(self, name, help_text):
+        return self.register(Counter, name, help_text)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram, name, help_text, buckets)
+
+    def render(self):
+        """
+        Returns:
+            str: Every metric in the Prometheus text format.
+        """
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: The value of every counter and the count, sum and quantiles of every histogram, by name.
+        """
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+class Tracer:
+    """
+    A sampling trace hook. The servers report spans around sending a question and reading an answer; a sampled
+    fraction of them is handed to the hook, so tracing costs one random() call per span when enabled and nothing but
+    an attribute check when not.
+    """
+
+    def __init__(self, hook=None, sample_rate=0.01):
+        """
+        Initializes the Tracer class.
+        param:
+            hook (function, optional): Called with a dict per sampled span. Defaults to None, tracing disabled.
+            sample_rate (float, optional): Fraction of the spans handed to the hook. Defaults to 0.01.
+        """
+        self.hook = hook
+        self.sample_rate = sample_rate
+
+    def record(self, event, player_name, start_ns, end_ns, **fields):
+        """
+        Reports a span to the hook if it is sampled.
+        Args:
+            event (str): Name of the span, e.g. 'send_question' or 'get_answer'.
+            player_name (str): The player the span belongs to.
+            start_ns (int): perf_counter_ns() at which the span started.
+            end_ns (int): perf_counter_ns() at which the span ended.
+            fields: Extra attributes of the span, such as the round id.
+        """
+        if self.hook is None or random.random() >= self.sample_rate:
+            return
+        span = {'event': event, 'player': player_name, 'start_ns': start_ns, 'duration_ns': end_ns - start_ns}
+        span.update(fields)
+        try:
+            self.hook(span)
+        except Exception:
+            pass  # A broken hook must never break a round
+
+
+class ServerMetrics:
+    """
+    The metrics recorded by the trivia servers.
+    """
+
+    def __init__(self, registry=None):
+        """
+        Initializes the ServerMetrics class.
+        param:
+            registry (MetricsRegistry, optional): Where the metrics are registered. Defaults to REGISTRY.
+        """
+        registry = registry or REGISTRY
+        self.registry = registry
+        self.accepts = registry.counter('trivia_accepts_total', 'TCP connections accepted')
+        self.handshakes = registry.counter('trivia_handshakes_total', 'Players that sent their name')
+        self.handshake_failures = registry.counter('trivia_handshake_failures_total',
+                                                   'Connections that did not send a valid name in time')
+        self.handshake_latency = registry.histogram('trivia_handshake_seconds',
+                                                    'Time from the start of a handshake to the player name')
+        self.sends = registry.counter('trivia_sends_total', 'Messages handed to client sockets')
+        self.send_errors = registry.counter('trivia_send_errors_total', 'Messages that failed to send')
+        self.send_latency = registry.histogram('trivia_send_seconds', 'Time to hand a message to a client socket')
+        self.answers = registry.counter('trivia_answers_total', 'Answers read from players')
+        self.invalid_answers = registry.counter('trivia_invalid_answers_total',
+                                                'Answers that are not a valid answer to the question')
+        self.answer_latency = registry.histogram('trivia_answer_seconds',
+                                                 'Time from sending a question to reading the answer')
+        self.disconnects = registry.counter('trivia_disconnects_total', 'Players that disconnected mid-game')
+        self.evictions = registry.counter('trivia_evictions_total',
+                                          'Players evicted because their client did not read its messages')
+        # The admission rate is trivia_lobby_players_sum / trivia_lobby_fill_seconds_sum
+        self.joins = registry.counter('trivia_joins_total', 'Players admitted to a lobby')
+        self.lobby_fill_time = registry.histogram('trivia_lobby_fill_seconds',
+                                                  'Time from the first join of a lobby to its close',
+                                                  FILL_TIME_BUCKETS)
+        self.lobby_players = registry.histogram('trivia_lobby_players', 'Players a lobby closed with',
+                                                LOBBY_SIZE_BUCKETS)
+        self.tracer = Tracer()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = None  # Set on the subclass created by serve
+
+    def do_GET(self):
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are not worth a console line
+
+
+def serve(port, registry=None, host='127.0.0.1'):
+    """
+    Serves the metrics over HTTP on a daemon thread, on every path.
+    Args:
+        port (int): TCP port of the endpoint.
+        registry (MetricsRegistry, optional): The metrics to serve. Defaults to REGISTRY.
+        host (str, optional): Address to bind, local only by default. Defaults to '127.0.0.1'.
+    Returns:
+        ThreadingHTTPServer: The running HTTP server; call shutdown() to stop it.
+    """
+    handler = type('BoundMetricsHandler', (MetricsHandler,), {'registry': registry or REGISTRY})
+    http_server = ThreadingHTTPServer((host, port), handler)
+    http_server.daemon_threads = True
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    return http_server
+
+
+REGISTRY = MetricsRegistry()  # The process-wide default registry
@@ -0,0 +1,199 @@
+import socket
+import selectors
+import threading
+from collections import deque
+from time import monotonic
+
+"""
+Bounded outbound queues for the threaded server. Messages are handed to a player's non-blocking socket right away;
+whatever the client's receive window cannot take is queued for that player and sent by one sender thread as soon as
+the socket is writable, so a broadcast never waits for a client. A client that lets more than HIGH_WATER_MARK bytes
+pile up, or reads nothing for WRITE_DEADLINE seconds, is a slow consumer and is evicted instead of holding up the
+round for everyone else. The async server applies the same limits to the write buffers of its transports.
+"""
+
+HIGH_WATER_MARK = 256 * 1024  # Bytes that may be queued for one player before it is evicted as a slow consumer
+WRITE_DEADLINE = 5  # Seconds a player's client has to read queued messages before it is evicted
+DRAIN_TIMEOUT = 5  # Seconds a shutdown waits for the queued messages to be sent before closing the connections
+
+
+class OutboundQueue:
+    __slots__ = ('chunks', 'size', 'deadline')
+
+    def __init__(self, deadline):
+        """
+        Initializes the OutboundQueue class.
+        param:
+            deadline (float): monotonic() time by which the client must have read some of the queue.
+        """
+        self.chunks = deque()  # memoryviews not yet handed to the socket, the first one possibly partly sent
+        self.size = 0  # Bytes queued
+        self.deadline = deadline
+
+    def append(self, chunk):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+
+
+class Sender:
+    def __init__(self, on_evict, high_water_mark=None, write_deadline=None):
+        """
+        Initializes the Sender class and starts its thread.
+        param:
+            on_evict (function): Called with a player and the reason when the player is evicted as a slow consumer
+                or its connection fails while its queue is sent. Never called with the sender's lock held.
+            high_water_mark (int, optional): Bytes that may be queued for one player. Defaults to HIGH_WATER_MARK.
+            write_deadline (float, optional): Seconds a client has to read queued messages.
+                Defaults to WRITE_DEADLINE.
+        """
+        self.on_evict = on_evict
+        self.high_water_mark = high_water_mark or HIGH_WATER_MARK
+        self.write_deadline = write_deadline or WRITE_DEADLINE
+        self.backlog = {}  # OutboundQueue of every player with messages waiting for its client
+        self.selector = selectors.DefaultSelector()  # Waits for the sockets of the backlog to become writable
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)  # Notified whenever the backlog empties
+        self._closed = False
+        # Wakes the sender thread up when a queue is created, so its deadline is watched
+        self._wakeup_receiver, self._wakeup_sender = socket.socketpair()
+        self._wakeup_receiver.setblocking(False)
+        self._wakeup_sender.setblocking(False)
+        self.selector.register(self._wakeup_receiver, selectors.EVENT_READ, None)
+        self._thread = threading.Thread(target=self._run, name='sender', daemon=True)
+        self._thread.start()
+
+    def send(self, player, message):
+        """
+        Sends a message to a player without blocking. What the socket does not take right away is queued behind the
+        messages already waiting for the player.
+        Args:
+            player (player.Player): The player, whose connection is a non-blocking socket.
+            message (memoryview): The encoded message.
+        Returns:
+            bool: False if the player was evicted as a slow consumer instead.
+        Raises:
+            OSError: If the connection failed.
+        """
+        with self._lock:
+            queue = self.backlog.get(player)
+            if queue is None:
+                try:
+                    sent = player.connection.send(message)
+                except BlockingIOError:
+                    sent = 0
+                if sent == len(message):
+                    return True
+                queue = self.backlog[player] = OutboundQueue(monotonic() + self.write_deadline)
+                queue.append(message[sent:])
+                self.selector.register(player.connection, selectors.EVENT_WRITE, player)
+                self._wake_up()
+                return True
+            if queue.size + len(message) <= self.high_water_mark:
+                queue.append(message)
+                return True
+            self._forget(player)
+        self.on_evict(player, f'slow consumer, {queue.size + len(message)} bytes queued')
+        return False
+
+    def discard(self, player):
+        """
+        Drops whatever is queued for a player, e.g. before its connection is closed.
+        Args:
+            player (player.Player): The player.
+        """
+        with self._lock:
+            if player in self.backlog:
+                self._forget(player)
+
+    def drain(self, timeout):
+        """
+        Waits until every queued message was sent.
+        Args:
+            timeout (float): Maximum number of seconds to wait.
+        Returns:
+            int: The number of players whose messages could not all be sent in time.
+        """
+        with self._drained:
+            self._drained.wait_for(lambda: not self.backlog, timeout)
+            return len(self.backlog)
+
+    def close(self):
+        """
+        Stops the sender thread; messages still queued are dropped.
+        """
+        with self._lock:
+            self._closed = True
+            self._wake_up()
+        self._thread.join()
+        self.selector.close()
+        self._wakeup_receiver.close()
+        self._wakeup_sender.close()
+
+    def _wake_up(self):
+        try:
+            self._wakeup_sender.send(b'\0')
+        except BlockingIOError:
+            pass  # A wakeup is already pending
+
+    def _forget(self, player):
+        del self.backlog[player]
+        try:
+            self.selector.unregister(player.connection)
+        except (KeyError, ValueError):
+            pass  # The socket was already closed
+        if not self.backlog:
+            self._drained.notify_all()
+
+    def _flush(self, player):
+        """
+        Sends as much of a player's queue as the socket takes.
+        Args:
+            player (player.Player): A player in the backlog.
+        Returns:
+            str: Why the player has to be evicted, or None.
+        """
+        queue = self.backlog[player]
+        try:
+            while queue.chunks:
+                chunk = queue.chunks[0]
+                sent = player.connection.send(chunk)
+                queue.size -= sent
+                queue.deadline = monotonic() + self.write_deadline  # The client is reading
+                if sent < len(chunk):
+                    queue.chunks[0] = chunk[sent:]
+                    return None
+                queue.chunks.popleft()
+        except BlockingIOError:
+            return None
+        except OSError as e:
+            self._forget(player)
+            return f'send failed: {e}'
+        self._forget(player)  # Everything was sent
+        return None
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                deadline = min((queue.deadline for queue in self.backlog.values()), default=None)
+            events = self.selector.select(None if deadline is None else max(0, deadline - monotonic()))
+            evictions = []
+            with self._lock:
+                for key, _ in events:
+                    if key.data is None:
+                        try:
+                            self._wakeup_receiver.recv(4096)
+                        except BlockingIOError:
+                            pass
+                    elif key.data in self.backlog:
+                        reason = self._flush(key.data)
+                        if reason is not None:
+                            evictions.append((key.data, reason))
+                now = monotonic()
+                for player, queue in list(self.backlog.items()):
+                    if queue.deadline <= now:
+                        self._forget(player)
+                        evictions.append((player, f'slow consumer, nothing read for {self.write_deadline}s'))
+            for player, reason in evictions:
+                self.on_evict(player, reason)
@@ -0,0 +1,130 @@
+import threading
+
+"""
+Player and PlayerRegistry classes that hold the connected players of a lobby or game room. A Player is a compact
+__slots__ record of one connection; the registry indexes the live players by socket file descriptor and by name, so
+a player who leaves is removed in O(1) and every round iterates over the live players only. The number of players is
+the size of the registry, so it can never drift from the players actually connected. The threaded server adds and
+drops players from its handshake, answer and sender threads at once, so the registry changes under a lock.
+"""
+
+MAX_LISTED_PLAYERS = 100  # Players named in a welcome message; at 10k players the full list would not fit a frame
+
+
+class Player:
+    __slots__ = ('name', 'connection', 'address', 'codec', 'fd', 'active', 'reader', 'reader_task', 'drain_task')
+
+    def __init__(self, name, connection, address, codec, fd, reader=None):
+        """
+        Initializes the Player class.
+        param:
+            name (str): The name of the player.
+            connection (socket.socket | asyncio.StreamWriter): Where messages to the player are written.
+            address (tuple): The (ip, port) of the client.
+            codec (protocol.TextCodec | protocol.BinaryCodec): The protocol codec of the client.
+            fd (int): File descriptor of the client socket, kept since a closed socket no longer reports it.
+            reader (asyncio.StreamReader, optional): The reader side of an asyncio connection. Defaults to None.
+        """
+        self.name = name
+        self.connection = connection
+        self.address = address
+        self.codec = codec
+        self.fd = fd
+        self.active = True  # False once the player left the registry
+        self.reader = reader
+        self.reader_task = None  # Task reading the player's answers, on the async server
+        self.drain_task = None  # Task waiting for the messages queued for the player to be sent, on the async server
+
+
+class PlayerRegistry:
+    def __init__(self):
+        self.by_fd = {}  # Live players by socket file descriptor, in join order
+        self.by_name = {}  # Live players by name; a repeated name refers to the latest player who joined with it
+        self._lock = threading.Lock()
+
+    def add(self, player):
+        """
+        Adds a player to the registry.
+        Args:
+            player (Player): The player.
+        """
+        with self._lock:
+            player.active = True
+            self.by_fd[player.fd] = player
+            self.by_name[player.name] = player
+
+    def remove(self, player):
+        """
+        Removes a player from the registry and marks it inactive.
+        Args:
+            player (Player): The player.
+        Returns:
+            bool: True if the player was in the registry, False if it had already been removed, so callers count
+                every departure once.
+        """
+        with self._lock:
+            if self.by_fd.get(player.fd) is not player:
+                return False
+            del self.by_fd[player.fd]
+            if self.by_name.get(player.name) is player:
+                del self.by_name[player.name]
+            player.active = False
+            return True
+
+    def get(self, fd):
+        """
+        Args:
+            fd (int): A socket file descriptor.
+        Returns:
+            Player: The live player on the socket, or None.
+        """
+        return self.by_fd.get(fd)
+
+    def find(self, name):
+        """
+        Args:
+            name (str): A player name.
+        Returns:
+            Player: The live player with the name, or None.
+        """
+        return self.by_name.get(name)
+
+    def clear(self):
+        """
+        Removes every player from the registry.
+        Returns:
+            list: The players that were removed.
+        """
+        with self._lock:
+            players = list(self.by_fd.values())
+            for player in players:
+                player.active = False
+            self.by_fd.clear()
+            self.by_name.clear()
+        return players
+
+    def roster(self, limit=MAX_LISTED_PLAYERS):
+        """
+        Lists the players for the welcome message.
+        Args:
+            limit (int, optional): Maximum number of players named. Defaults to MAX_LISTED_PLAYERS.
+        Returns:
+            str: One 'Player i: name' line per player, with a last line counting the players left out.
+        """
+        with self._lock:
+            names = [player.name for _, player in zip(range(limit), self.by_fd.values())]
+            count = len(self.by_fd)
+        lines = [f'Player {i + 1}: {name}' for i, name in enumerate(names)]
+        if count > limit:
+            lines.append(f'... and {count - limit} more players')
+        return '\n'.join(lines)
+
+    def __len__(self):
+        return len(self.by_fd)
+
+    def __iter__(self):
+        """
+        Iterates over a snapshot of the live players in join order, so players may leave while it runs.
+        """
+        with self._lock:
+            return iter(list(self.by_fd.values()))
@@ -0,0 +1,186 @@
+from struct import Struct
+
+"""
+The binary game protocol shared by the servers and the Client. Every message is a frame made of a fixed header packed
+with struct (like the 'IbH' UDP offer) followed by a length-prefixed payload, so messages can no longer coalesce or
+split on the TCP stream. A client opts into the binary protocol by sending NEGOTIATION_BYTE as the very first byte of
+the connection; a client that starts with its player name instead is served with the old unframed text protocol.
+"""
+
+PROTOCOL_VERSION = 1
+NEGOTIATION_BYTE = b'\xb1'  # Can never start a UTF-8 player name, so it cannot be confused with a text client
+FRAME_HEADER = Struct('!BBH')  # Protocol version, frame type, payload length
+ROUND_ID = Struct('!I')  # Prefix of QUESTION and ANSWER payloads
+MAX_PAYLOAD = 0xFFFF
+
+# Frame types
+JOIN = 1  # Client -> server: player name
+WELCOME = 2  # Server -> client: welcome message
+QUESTION = 3  # Server -> client: round id followed by the trivia question
+ANSWER = 4  # Client -> server: round id of the question followed by the answer
+RESULT = 5  # Server -> client: status byte followed by the game status message
+
+# RESULT status byte
+RESULT_EXPIRED = 0  # Nobody answered correctly, another question follows
+RESULT_WINNER = 1  # Someone won or the server shuts down, the game is over
+EXPIRED_MSG = 'Expired'  # The game status message of the text protocol when another question follows
+SHUTDOWN_MSG = '\nThe server is shutting down, thanks for playing!\n'  # Game status sent before a graceful shutdown
+
+
+class ProtocolError(Exception):
+    """
+    Raised when a peer sends data that is not a valid frame.
+    """
+
+
+def encode_frame(frame_type, payload):
+    """
+    Packs a frame.
+    Args:
+        frame_type (int): One of the frame type constants.
+        payload (bytes): The frame payload.
+    Returns:
+        bytes: The frame header followed by the payload.
+    """
+    if len(payload) > MAX_PAYLOAD:
+        raise ProtocolError(f'Payload of {len(payload)} bytes does not fit in a frame')
+    return FRAME_HEADER.pack(PROTOCOL_VERSION, frame_type, len(payload)) + payload
+
+
+class FrameParser:
+    """
+    A streaming frame parser: feed it whatever recv returned and it returns every frame completed so far, keeping
+    partial frames buffered until the rest arrives.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """
+        Adds received bytes to the parser.
+        Args:
+            data (bytes): Bytes received from the socket.
+        Returns:
+            list: (frame_type, payload) tuples of the frames completed by this data.
+        Raises:
+            ProtocolError: If a frame has an unsupported protocol version.
+        """
+        self.buffer += data
+        frames = []
+        offset = 0
+        while len(self.buffer) - offset >= FRAME_HEADER.size:
+            version, frame_type, length = FRAME_HEADER.unpack_from(self.buffer, offset)
+            if version != PROTOCOL_VERSION:
+                raise ProtocolError(f'Unsupported protocol version: {version}')
+            end = offset + FRAME_HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            frames.append((frame_type, bytes(self.buffer[offset + FRAME_HEADER.size:end])))
+            offset = end
+        del self.buffer[:offset]
+        return frames
+
+
+class TextCodec:
+    """
+    The legacy unframed text protocol: messages are sent as plain UTF-8 and every recv is one message.
+    """
+    name = 'text'
+
+    def encode(self, frame_type, text, round_id=0):
+        """
+        Encodes a server message.
+        Args:
+            frame_type (int): The kind of message, ignored by the text protocol.
+            text (str): The message.
+            round_id (int, optional): The round of a question, ignored by the text protocol. Defaults to 0.
+        Returns:
+            bytes: The encoded message.
+        """
+        return text.encode()
+
+    def feed(self, data, round_id=None):
+        """
+        Decodes data received from a client. Text clients don't tag their answers with a round, so stale input
+        has to be drained before a question is sent.
+        Args:
+            data (bytes): Bytes received from the socket.
+            round_id (int, optional): The current round, ignored by the text protocol. Defaults to None.
+        Returns:
+            list: The messages (str) contained in the data.
+        """
+        return [data.decode(errors='replace')] if data else []
+
+
+class BinaryCodec:
+    """
+    The framed binary protocol.
+    """
+    name = 'binary'
+
+    def __init__(self):
+        self.parser = FrameParser()
+        self.joined = False  # Whether the client's JOIN frame was received; later JOIN frames are dropped
+
+    def encode(self, frame_type, text, round_id=0):
+        """
+        Encodes a server message as a frame. QUESTION frames are tagged with their round id, and RESULT frames get a
+        status byte telling whether the game goes on.
+        Args:
+            frame_type (int): One of WELCOME, QUESTION or RESULT.
+            text (str): The message.
+            round_id (int, optional): The round of a question. Defaults to 0.
+        Returns:
+            bytes: The encoded frame.
+        """
+        payload = text.encode()
+        if frame_type == QUESTION:
+            payload = ROUND_ID.pack(round_id) + payload
+        elif frame_type == RESULT:
+            status = RESULT_EXPIRED if text == EXPIRED_MSG else RESULT_WINNER
+            payload = bytes([status]) + payload
+        return encode_frame(frame_type, payload)
+
+    def feed(self, data, round_id=None):
+        """
+        Decodes data received from a client. Answers tagged with any round other than round_id are late answers to
+        an earlier question and are dropped, and so is every JOIN frame after the first one: once the handshake is
+        done only answers are read.
+        Args:
+            data (bytes): Bytes received from the socket.
+            round_id (int, optional): The current round, or None to drop every answer. Defaults to None.
+        Returns:
+            list: The payloads (str) of the first JOIN frame and the current ANSWER frames completed by this data.
+        Raises:
+            ProtocolError: If the client sent an invalid frame.
+        """
+        messages = []
+        for frame_type, payload in self.parser.feed(data):
+            if frame_type == ANSWER:
+                if len(payload) < ROUND_ID.size:
+                    raise ProtocolError('ANSWER frame without a round id')
+                if ROUND_ID.unpack_from(payload)[0] != round_id:
+                    continue
+                payload = payload[ROUND_ID.size:]
+            elif frame_type == JOIN:
+                if self.joined:
+                    continue
+                self.joined = True
+            else:
+                raise ProtocolError(f'Unexpected frame type from client: {frame_type}')
+            messages.append(payload.decode(errors='replace'))
+        return messages
+
+
+def negotiate(first_data):
+    """
+    Picks the codec of a new connection from the first bytes the client sent.
+    Args:
+        first_data (bytes): The first bytes received from the client.
+    Returns:
+        tuple: The codec for the connection and the received bytes that belong to it.
+    """
+    if first_data[:1] == NEGOTIATION_BYTE:
+        return BinaryCodec(), first_data[1:]
+    return TextCodec(), first_data
@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import mmap
+import hashlib
+from struct import Struct
+import question_types
+
+"""
+A QuestionBank class that serves trivia questions from an on-disk JSONL file, one question object per line: a
+true/false {"question": ..., "answer": 0|1}, or a question of another type of question_types.py, named by "type".
+ The bank and its offset index are memory-mapped, so opening a multi-million question bank is instant,
+only the questions actually drawn are decoded, and processes that open the same bank share the mapped pages instead of
+each keeping a private copy. The index lives next to the bank ('<bank>.idx'); it is built on first use, with duplicate
+questions left out, and rebuilt whenever the bank file is newer than it.
+"""
+
+INDEX_HEADER = Struct('=4sIQ')  # Magic, index version, number of questions; 16 bytes, so the offsets stay aligned
+INDEX_MAGIC = b'TQIX'
+INDEX_VERSION = 1
+OFFSET = Struct('=Q')  # Byte offset of a question's line in the bank, in native order like memoryview.cast
+
+
+class QuestionBank:
+    def __init__(self, path):
+        """
+        Initializes the QuestionBank class.
+        param:
+            path (str): Path of the JSONL bank file.
+        """
+        self.path = path
+        self.index_path = path + '.idx'
+        if not os.path.exists(self.index_path) or os.path.getmtime(self.index_path) < os.path.getmtime(path):
+            build_index(path, self.index_path)
+
+        with open(path, 'rb') as bank_file:
+            self.bank_map = mmap.mmap(bank_file.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(self.index_path, 'rb') as index_file:
+            self.index_map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = INDEX_HEADER.unpack_from(self.index_map)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f'{self.index_path} is not a question bank index, delete it to rebuild it')
+        self.offsets = memoryview(self.index_map)[INDEX_HEADER.size:INDEX_HEADER.size + count * OFFSET.size].cast('Q')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        """
+        Decodes a single question.
+        Args:
+            i (int): Index of the question.
+        Returns:
+            dict: The question record, turned into a question by question_types.build_question.
+        """
+        start = self.offsets[i]
+        end = self.bank_map.find(b'\n', start)
+        return json.loads(self.bank_map[start:end if end != -1 else len(self.bank_map)])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def build_index(path, index_path):
+    """
+    Scans a bank file and writes the offsets of its unique questions to an index file. The index is written to a
+    temporary file first, so processes that open the bank concurrently never see a partial index.
+    Args:
+        path (str): Path of the JSONL bank file.
+        index_path (str): Path of the index file to write.
+    Returns:
+        int: The number of unique questions in the bank.
+    Raises:
+        ValueError: If a line of the bank is not a valid question.
+    """
+    seen = set()  # Digests of the questions indexed so far
+    count = 0
+    tmp_path = f'{index_path}.{os.getpid()}.tmp'
+    with open(path, 'rb') as bank_file, open(tmp_path, 'wb') as index_file:
+        index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0))
+        offset = 0
+        for line_number, line in enumerate(bank_file, 1):
+            line_offset, offset = offset, offset + len(line)
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                question = question_types.build_question(record).text
+            except (ValueError, AttributeError) as e:
+                raise ValueError(f'{path}:{line_number}: invalid question: {e}')
+            digest = hashlib.blake2b(question.encode(), digest_size=16).digest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+            index_file.write(OFFSET.pack(line_offset))
+            count += 1
+        index_file.seek(0)
+        index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, count))
+    os.replace(tmp_path, index_path)
+    return count
+
+
+if __name__ == '__main__':
+    # Build or refresh the index of a bank ahead of time: python question_bank.py questions.jsonl
+    bank_path = sys.argv[1] if len(sys.argv) > 1 else 'questions.jsonl'
+    print(f'Indexed {build_index(bank_path, bank_path + ".idx")} unique questions from {bank_path}')
@@ -0,0 +1,230 @@
+import string
+from abc import ABC, abstractmethod
+
+"""
+Question types of the trivia game. Every question drawn from the bank becomes a Question of the type named by its
+"type" field (true/false when it has none), which formats the prompt sent to the players and turns a player's raw
+answer into the value the round's arbiter compares with the correct answer.
+
+Each question precomputes its accepted answers once, when it is drawn: a dict from the normalized form of every
+accepted spelling (letters, numbers, option texts, aliases) to the answer value. Validating an answer is then one
+normalization of the answer, bounded by MAX_ANSWER_LENGTH, and one dict lookup, however many players answer. New
+types are plugged in with the question_type decorator.
+"""
+
+MAX_ANSWER_LENGTH = 200  # Characters of an answer that are looked at; longer answers are cut
+FREE_TEXT_HINT = 'Type your answer and press Enter.'  # Ends free-text prompts; tells the client to read a line
+WRONG_ANSWER = 0  # Value of a free-text answer that matches none of the accepted answers
+RIGHT_ANSWER = 1  # Value of a free-text answer that matches one of them
+
+PUNCTUATION = str.maketrans(string.punctuation, ' ' * len(string.punctuation))
+ARTICLES = ('the ', 'a ', 'an ')
+
+QUESTION_TYPES = {}  # Question class by the "type" of a bank record
+
+
+def normalize(text):
+    """
+    Args:
+        text (str): An answer or accepted spelling.
+    Returns:
+        str: The text case-folded, without punctuation and with single spaces.
+    """
+    return ' '.join(text[:MAX_ANSWER_LENGTH].casefold().translate(PUNCTUATION).split())
+
+
+def question_type(cls):
+    """
+    Registers a Question class under its kind, the "type" that selects it in the bank.
+    Args:
+        cls (type): A Question subclass.
+    Returns:
+        type: The class.
+    """
+    QUESTION_TYPES[cls.kind] = cls
+    return cls
+
+
+def build_question(record):
+    """
+    Args:
+        record (dict): A question of the bank.
+    Returns:
+        Question: The question, as the type named by the record.
+    Raises:
+        ValueError: If the type is unknown or the record is not a valid question of its type.
+    """
+    kind = record.get('type', TrueFalseQuestion.kind)
+    cls = QUESTION_TYPES.get(kind)
+    if cls is None:
+        raise ValueError(f'unknown question type: {kind}')
+    try:
+        return cls.from_record(record)
+    except (KeyError, TypeError, IndexError) as e:
+        raise ValueError(f'invalid {kind} question: {e!r}')
+
+
+class Question(ABC):
+    kind = None
+
+    def __init__(self, text, answer, accepted):
+        """
+        Initializes the Question class.
+        param:
+            text (str): The question.
+            answer (int): Value of the correct answer.
+            accepted (dict): Answer value by normalized answer.
+        """
+        self.text = text
+        self.answer = answer
+        self.accepted = accepted
+        self.prompt = self.build_prompt()  # The message sent to the players
+
+    @classmethod
+    @abstractmethod
+    def from_record(cls, record):
+        """
+        Args:
+            record (dict): A question of the bank, of this type.
+        Returns:
+            Question: The question.
+        Raises:
+            KeyError, TypeError, IndexError: If the record is not a valid question of this type.
+        """
+
+    @abstractmethod
+    def build_prompt(self):
+        """
+        Returns:
+            str: The message sent to the players.
+        """
+
+    def parse(self, raw_answer):
+        """
+        Args:
+            raw_answer (str): The answer as sent by a player.
+        Returns:
+            int: The value of the answer, or None if it is not a valid answer to the question.
+        """
+        return self.accepted.get(normalize(raw_answer))
+
+    @abstractmethod
+    def sample_answer(self, correct, rng):
+        """
+        Args:
+            correct (bool): Whether to answer correctly.
+            rng (random.Random): Source of randomness for picking a wrong answer.
+        Returns:
+            str: An answer a player could send, used by the load generators.
+        """
+
+
+@question_type
+class TrueFalseQuestion(Question):
+    kind = 'true_false'
+    # Shared by every true/false question
+    ANSWERS = {'1': 1, 't': 1, 'y': 1, 'true': 1, 'yes': 1, '0': 0, 'f': 0, 'n': 0, 'false': 0, 'no': 0}
+
+    @classmethod
+    def from_record(cls, record):
+        answer = record['answer']
+        if answer not in (0, 1):
+            raise TypeError(f'answer must be 0 or 1, not {answer!r}')
+        return cls(record['question'], int(answer), TrueFalseQuestion.ANSWERS)
+
+    def build_prompt(self):
+        return f'True or false: {self.text}?\n'
+
+    def sample_answer(self, correct, rng):
+        return 't' if self.answer == correct else 'f'
+
+
+@question_type
+class MultipleChoiceQuestion(Question):
+    kind = 'multiple_choice'
+    MAX_CHOICES = 26  # One letter per choice
+
+    def __init__(self, text, answer, choices):
+        """
+        Initializes the MultipleChoiceQuestion class.
+        param:
+            text (str): The question.
+            answer (int): Index of the correct choice.
+            choices (list): The choices, listed under the letters A, B, C...
+        """
+        self.choices = choices
+        accepted = {normalize(choice): i for i, choice in enumerate(choices)}
+        for i in range(len(choices)):
+            # Letters and numbers win over a choice that happens to read like one
+            accepted[chr(ord('a') + i)] = i
+            accepted[str(i + 1)] = i
+        super().__init__(text, answer, accepted)
+
+    @classmethod
+    def from_record(cls, record):
+        choices = [str(choice) for choice in record['choices']]
+        if not 2 <= len(choices) <= MultipleChoiceQuestion.MAX_CHOICES:
+            raise TypeError(f'a question needs 2 to {MultipleChoiceQuestion.MAX_CHOICES} choices')
+        answer = record['answer']
+        if not isinstance(answer, int) or not 0 <= answer < len(choices):
+            raise IndexError(f'answer {answer!r} is not the index of a choice')
+        return cls(record['question'], answer, choices)
+
+    def build_prompt(self):
+        lines = [f'{chr(ord("A") + i)}) {choice}' for i, choice in enumerate(self.choices)]
+        return f'{self.text}\n' + '\n'.join(lines) + '\n'
+
+    def sample_answer(self, correct, rng):
+        choice = self.answer if correct else rng.choice([i for i in range(len(self.choices)) if i != self.answer])
+        return chr(ord('a') + choice)
+
+
+@question_type
+class FreeTextQuestion(Question):
+    kind = 'free_text'
+
+    def __init__(self, text, answers):
+        """
+        Initializes the FreeTextQuestion class.
+        param:
+            text (str): The question.
+            answers (list): The accepted answers, the first one being the answer shown to the players.
+        """
+        self.answers = answers
+        accepted = {}
+        for answer in answers:
+            key = FreeTextQuestion.strip_article(normalize(answer))
+            accepted[key] = RIGHT_ANSWER
+        super().__init__(text, RIGHT_ANSWER, accepted)
+
+    @staticmethod
+    def strip_article(key):
+        """
+        Args:
+            key (str): A normalized answer.
+        Returns:
+            str: The answer without a leading article, so 'The Nile' and 'Nile' match.
+        """
+        for article in ARTICLES:
+            if key.startswith(article):
+                return key[len(article):]
+        return key
+
+    @classmethod
+    def from_record(cls, record):
+        answers = [str(record['answer'])] + [str(alias) for alias in record.get('aliases', ())]
+        if not all(normalize(answer) for answer in answers):
+            raise TypeError('answers must contain letters or digits')
+        return cls(record['question'], answers)
+
+    def build_prompt(self):
+        return f'{self.text}\n{FREE_TEXT_HINT}\n'
+
+    def parse(self, raw_answer):
+        key = normalize(raw_answer)
+        if not key:
+            return None
+        return self.accepted.get(FreeTextQuestion.strip_article(key), WRONG_ANSWER)
+
+    def sample_answer(self, correct, rng):
+        return self.answers[0] if correct else 'I do not know'
@@ -1,12 +1,25 @@
 import threading
+import selectors
+import signal
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import colorama
 from style import Style
-from time import sleep
+from time import sleep, monotonic, perf_counter_ns
 from scapy.arch import get_if_addr
-from struct import pack
 import trivia_generator
+import arbitration
+import admission
+import protocol
+import message_cache
+import metrics
+import console
+import journal
+import leaderboard
+import discovery
+import sessions
+import outbound
+from player import Player, PlayerRegistry
 import socket
-from datetime import datetime, timedelta
 
 """
 A Server class for hosting a trivia game. It broadcasts UDP messages to clients, accepts TCP connections,
@@ -17,8 +30,14 @@ processing player responses, and managing gameplay.
 class Server:
     WIFI_INTERFACE = 'Wi-Fi'  # Default Wi-Fi interface name
     SERVER_NAME = "🕶 CyberQuiz-IntoTheMatrix🖥"  # Default server name
+    HANDSHAKE_TIMEOUT = 2  # Default seconds a new client has to send its player name
+    HANDSHAKE_WORKERS = 32  # Threads receiving player names, so slow joiners never stall the accept loop
+    LISTEN_BACKLOG = socket.SOMAXCONN  # Default length of the queue of connections waiting to be accepted
 
-    def __init__(self, magic_cookie, message_type, server_port, client_port, wifi_interface=None, server_name=None):
+    def __init__(self, magic_cookie, message_type, server_port, client_port, wifi_interface=None, server_name=None,
+                 reuse_port=False, admission_policy=None, listen_backlog=None, handshake_timeout=None,
+                 metrics_port=None, persistent_sessions=False, journal_path=None,
+                 leaderboard_path=None):
         """
         Initializes the Server class.
         param:
@@ -28,6 +47,21 @@ class Server:
             client_port (int): Port for client.
             wifi_interface (str, optional): Name of the Wi-Fi interface. Defaults to None.
             server_name (str, optional): Name of the server. Defaults to None.
+            reuse_port (bool, optional): Bind the TCP port with SO_REUSEPORT so several processes can share it.
+                Defaults to False.
+            admission_policy (admission.AdmissionPolicy, optional): When the lobby stops accepting players.
+                Defaults to at least 1 player and 10 seconds without a new connection.
+            listen_backlog (int, optional): Length of the listen queue. Defaults to LISTEN_BACKLOG.
+            handshake_timeout (float, optional): Seconds a new client has to send its player name.
+                Defaults to HANDSHAKE_TIMEOUT.
+            metrics_port (int, optional): Local port of the metrics scrape endpoint; None to not serve it.
+                Defaults to None.
+            persistent_sessions (bool, optional): Keep the connected players for the next game instead of
+                disconnecting them when a game ends. Defaults to False.
+            journal_path (str, optional): Where to append the binary journal of every game; None to not keep one.
+                Defaults to None.
+            leaderboard_path (str, optional): SQLite database of the player leaderboard; None to not keep one.
+                Defaults to None.
         """
         # Initialize class variables
         self.magic_cookie = magic_cookie  # Magic cookie for identifying messages
@@ -36,98 +70,248 @@ class Server:
         self.client_port = client_port  # Port for client
         self.ip_address = get_if_addr(wifi_interface or Server.WIFI_INTERFACE)  # Get IP address of Wi-Fi interface
         self.server_name = server_name or Server.SERVER_NAME  # Set server name
-        self.player_names = []  # Names of players
-        self.last_connection_time = None
-        self.player_count = 0  # Number of players (initially 0)
+        self.players = PlayerRegistry()  # Live players of the lobby
+        self.admission_policy = admission_policy or admission.AdmissionPolicy()
+        self.first_connection_time = None  # monotonic() time of the lobby's first join
+        self.last_connection_time = None  # monotonic() time of the lobby's latest join
+        self.listen_backlog = listen_backlog or Server.LISTEN_BACKLOG
+        self.handshake_timeout = handshake_timeout or Server.HANDSHAKE_TIMEOUT
+        self.handshake_pool = None  # Created on first use, the async server handshakes on its event loop instead
+        self.lobby_lock = threading.Lock()  # Guards the lobby while handshake threads add players
+        self.lobby_done = threading.Event()  # Set when the accept loop is done; offers then report the lobby closed
+        self.stopping = threading.Event()  # Set by request_shutdown; the server stops after the current round
+        self.shutdown_announced = False  # Whether the main loop logged that the server is shutting down
         self.final_answer = [-1, '']  # Client answers (initially empty)
         self.remaining_time = 10
-        self.clients = []
+        self.round_id = 0  # Sequence number of the current question
+        self.game_id = 0  # Sequence number of the current game, in the journal
+        self.journal = journal.JournalWriter(journal_path) if journal_path else None
+        self.leaderboard = leaderboard.Leaderboard(leaderboard_path) if leaderboard_path else None
+        self.persistent_sessions = persistent_sessions
+        self.sessions = sessions.SessionPool()  # Connections of the players kept between games, in session mode
+        self.message_cache = message_cache.MessageCache()  # Messages encoded once and shared by every client
+        self.sender = None  # Queues what the clients cannot take right away; created by run_server, since the
+        # async server's transports queue their own writes
+        self.questions = trivia_generator.TriviaGenerator().cursor()  # This server's stream of questions
+        self.metrics = metrics.ServerMetrics()  # Counters and latency histograms of the hot paths
+        self.admission_metrics = admission.AdmissionMetrics(self.metrics)  # Lobby fill times and admission rate
+        if metrics_port is not None:
+            metrics.serve(metrics_port)
 
         # Initialize TCP socket for server
         try:
             self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # Create TCP socket
             self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Allow reuse of socket
+            if reuse_port:
+                # Let the kernel load-balance connections between every process bound to the port
+                self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             self.tcp_socket.bind(('', self.server_port))  # Bind socket to server port
         except socket.error as e:
             # Print error message if initialization fails
-            print(Style.FAIL + 'Initialization of TCP SOCKET failed. Server initialization failed. Exiting...' + Style.END_STYLE)
+            console.log(Style.FAIL, 'Initialization of TCP SOCKET failed. Server initialization failed. Exiting...',
+                        console.ERROR, error=str(e))
             exit()
 
-    def send_udp_offers(self):
+    @property
+    def player_count(self):
+        """
+        Returns:
+            int: The number of live players.
+        """
+        return len(self.players)
+
+    def lobby_closed(self):
         """
-        Send UDP offers in broadcast while there are less than 2 clients connected.
+        Checks the admission policy.
+        Returns:
+            bool: True if the lobby should stop accepting players, always once the server is shutting down.
         """
-        # Pack the message to be sent
-        msg = pack('IbH', self.magic_cookie, self.message_type, self.server_port)
+        if self.stopping.is_set():
+            return True
+        return self.admission_policy.lobby_closed(self.player_count, self.first_connection_time,
+                                                  self.last_connection_time)
 
+    def send_udp_offers(self):
+        """
+        Send UDP offers in broadcast once a second until the server stops, also while a game is played. Every offer
+        carries the current number of players and whether the lobby is open, so clients can pick the least loaded
+        server and do not join one whose game is running while they wait in its listen backlog.
+        """
         # Print the IP address the server is listening on
-        print('Listening on IP address', self.ip_address)
+        console.log('', f'Listening on IP address {self.ip_address}')
 
         # Create a UDP socket
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as sock:
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)  # Set socket option to allow broadcast
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Set socket option to allow reuse of address
 
-            # Send UDP offers in broadcast while there are less than 1 client connected
+            # Send UDP offers in broadcast until the server stops
             while True:
-                # Check the condition before entering the inner loop
-                if self.player_count >= 1 and datetime.now() - self.last_connection_time > timedelta(seconds=10):
-                    break
-
+                lobby_open = not self.lobby_done.is_set() and not self.stopping.is_set()
                 # Send (broadcast) the message to the clients ports using UDP broadcast
+                msg = discovery.encode_offer(self.magic_cookie, self.message_type, self.server_port, self.player_count,
+                                             lobby_open)
                 sock.sendto(msg, ('<broadcast>', self.client_port))
+                if self.stopping.is_set():
+                    break  # The last offer told the clients that the lobby is closed
 
-                # Wait for one second before sending the next broadcast
-                sleep(1)
+                # Wait for one second before sending the next broadcast, unless the server stops first
+                self.stopping.wait(1)
 
     def tcp_client_connect(self):
         """
         Listen for incoming TCP connections from clients and accept them.
         Note:
-            This method continuously accepts clients until there is at least 1 player and no more players connected in the last 10 seconds.
+            This method continuously accepts clients until the admission policy closes the lobby. Player names are
+            received by the handshake pool, so the accept loop only accepts. Connections that arrive after the lobby
+            closed wait in the listen backlog for the next lobby.
         """
         # Listen for incoming connections
-        self.tcp_socket.listen()
+        self.tcp_socket.listen(self.listen_backlog)
+        if self.handshake_pool is None:
+            self.handshake_pool = ThreadPoolExecutor(Server.HANDSHAKE_WORKERS, thread_name_prefix='handshake')
+        handshakes = set()  # Handshakes still waiting for a player name
 
         # Continuously accept clients until conditions are met
         while True:
-            if self.player_count >= 1 and datetime.now() - self.last_connection_time > timedelta(seconds=10):
-                break
+            handshakes = {handshake for handshake in handshakes if not handshake.done()}
+            with self.lobby_lock:
+                if self.lobby_closed():
+                    break
+                until_close = self.admission_policy.seconds_until_close(
+                    self.player_count, self.first_connection_time, self.last_connection_time)
+                full = self.admission_policy.is_full(self.player_count + len(handshakes))
+            if full:
+                # Every free seat is taken by a pending handshake; accept again once one of them is over
+                wait(handshakes, timeout=1, return_when=FIRST_COMPLETED)
+                continue
             try:
-                # Accept incoming connection from client
-                self.tcp_socket.settimeout(10)
+                # Accept incoming connection from client, waking up in time to close the lobby
+                self.tcp_socket.settimeout(1 if until_close is None else min(1, until_close))
                 client_socket, (client_ip, client_port) = self.tcp_socket.accept()
-
-                # Add client socket and its address to the list of clients
-                is_active = True
-                self.clients.append([client_socket, is_active, (client_ip, client_port)])
-
-                # Set a timeout for receiving the player name from the client
-                try:
-                    # Receive the player name from the client
-                    player_name = str(client_socket.recv(1024), 'utf8')
-                    player_name = player_name.rstrip('\n')
-                except socket.error as e:
-                    # If client doesn't send player name in time, reject it
-                    print(Style.FAIL + 'Client:', client_ip, 'did not send player name in time.' + Style.END_STYLE)
-                    client_socket.close()
-                    self.clients.pop()  # Remove the client from the list
-                    continue
-
-                # Update player names and count
-                self.player_names.append(str(player_name))
-                self.player_count += 1
-                self.last_connection_time = datetime.now()
-
-                # Print message indicating successful connection
-                print(Style.CYAN + f'{player_name} - successfully connected to the server!' + Style.END_STYLE)
+                self.metrics.accepts.inc()
+                handshakes.add(self.handshake_pool.submit(self.handshake, client_socket, client_ip, client_port))
             except TimeoutError as te:
                 continue
             except Exception as e:
                 # Print warning message if unable to connect to client
-                print(Style.FAIL + f'Unable to connect to client - Exception received: {e}' + Style.END_STYLE)
-                return
-            sleep(0.1) #was 0.1
+                console.log(Style.FAIL, f'Unable to connect to client - Exception received: {e}', console.ERROR)
+                break
+        # Players already accepted still join this lobby; each handshake is bounded by handshake_timeout
+        wait(handshakes)
+        self.lobby_done.set()
+
+    def handshake(self, client_socket, client_ip, client_port):
+        """
+        Runs on the handshake pool: receives the player name of an accepted client and adds the player to the lobby.
+        Args:
+            client_socket (socket.socket): The accepted client socket.
+            client_ip (str): IP address of the client.
+            client_port (int): Port of the client.
+        """
+        start_ns = perf_counter_ns()
+        # The whole name must arrive before the deadline, however the client splits it
+        deadline = monotonic() + self.handshake_timeout
+        try:
+            # Receive the player name from the client, in whichever protocol it speaks
+            codec, player_name = self.receive_player_name(client_socket, deadline)
+            player_name = player_name.rstrip('\n')
+        except (socket.error, protocol.ProtocolError) as e:
+            # If client doesn't send player name in time, reject it
+            self.metrics.handshake_failures.inc()
+            console.log(Style.FAIL, f'Client: {client_ip} did not send player name in time.', console.WARNING,
+                        client_ip=client_ip)
+            client_socket.close()
+            return
+        self.metrics.handshakes.inc()
+        self.metrics.handshake_latency.observe_ns(perf_counter_ns() - start_ns)
+        client_socket.setblocking(False)  # Sends are queued by the sender and reads wait in the round's selector
+
+        with self.lobby_lock:
+            # Register the player with its socket, its address and its protocol codec
+            player = Player(str(player_name), client_socket, (client_ip, client_port), codec, client_socket.fileno())
+            previous = self.sessions.attach(player, Server.connection_alive) if self.persistent_sessions else None
+            if previous is not None and previous.active:
+                # The player reconnected after a drop the server did not notice yet; the new connection replaces it
+                self.drop_player(previous, 'reconnected')
+            self.players.add(player)
+            self.last_connection_time = monotonic()
+            if self.first_connection_time is None:
+                self.first_connection_time = self.last_connection_time
+            self.admission_metrics.record_join()
+
+        # Print message indicating successful connection
+        console.log(Style.CYAN, f'{player_name} - successfully connected to the server!', console.DEBUG,
+                    player=player_name)
+
+    @staticmethod
+    def connection_alive(player):
+        """
+        Checks, without consuming any data, whether a player's connection still works.
+        Args:
+            player (Player): The player, whose connection is a non-blocking socket.
+        Returns:
+            bool: False if the client closed the connection or the socket failed or was closed.
+        """
+        try:
+            return player.connection.recv(1, socket.MSG_PEEK) != b''
+        except BlockingIOError:
+            return True  # Open, with nothing to read
+        except OSError:
+            return False
+
+    def receive_player_name(self, client_socket, deadline):
+        """
+        Negotiates the protocol of a new client and receives its player name. A binary client starts with the
+        negotiation byte followed by a JOIN frame; any other first bytes are the player name of a text client.
+        Args:
+            client_socket (socket.socket): The accepted client socket.
+            deadline (float): monotonic() time by which the whole name must have arrived.
+        Returns:
+            tuple: The codec of the client's protocol and the player name.
+        Raises:
+            socket.error: If the client disconnects or misses the deadline before sending its name.
+            protocol.ProtocolError: If a binary client sends an invalid frame.
+        """
+        codec, data = protocol.negotiate(self.receive_before(client_socket, deadline))
+        messages = codec.feed(data)
+        while not messages:
+            # A binary JOIN frame may arrive in several pieces
+            messages = codec.feed(self.receive_before(client_socket, deadline))
+        return codec, messages[0]
+
+    def receive_before(self, client_socket, deadline):
+        """
+        Receives the next data of a client that is still handshaking.
+        Args:
+            client_socket (socket.socket): The client socket.
+            deadline (float): monotonic() time after which the handshake fails.
+        Returns:
+            bytes: The data received.
+        Raises:
+            socket.timeout: If the deadline passes first.
+            ConnectionResetError: If the client closes the connection.
+        """
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            raise socket.timeout('Handshake deadline passed')
+        client_socket.settimeout(remaining)
+        data = client_socket.recv(1024)
+        if not data:
+            raise ConnectionResetError('Connection closed before the player name was received')
+        return data
+
+    def log_admission(self):
+        """
+        Records the lobby that just closed in the admission metrics and prints its fill time and admission rate.
+        """
+        if self.first_connection_time is None:
+            return
+        fill_time = self.admission_metrics.record_lobby(self.first_connection_time, monotonic(), self.player_count)
+        summary = self.admission_metrics.summary()
+        console.log(Style.GRAY, f'Lobby filled with {self.player_count} players in {fill_time:.1f}s '
+                                f'(average {summary["avg_fill_time"]:.1f}s, {summary["admission_rate"]:.1f} joins/s)',
+                    players=self.player_count, fill_time=fill_time)
 
     def build_welcome_message(self):
         """
@@ -138,245 +322,284 @@ class Server:
             str: The constructed welcome message.
         """
         welcome_msg = f'Welcome to the {self.server_name} server, where we answer trivia questions.\n'
-        welcome_msg += '\n'.join([f'Player {i + 1}: {name}' for i, name in enumerate(self.player_names)])
+        welcome_msg += self.players.roster()
+        standings = self.leaderboard.standings() if self.leaderboard is not None else ''
+        if standings:
+            welcome_msg += '\n' + standings
         welcome_msg += '\n=='
-        print(Style.HEADER + f'{welcome_msg}' + Style.END_STYLE)
+        console.log(Style.HEADER, welcome_msg)
         return welcome_msg
 
-    def send_welcome_message(self, client, welcome_msg, player_name):
+    def send_message(self, player, message):
         """
-        This function sends a welcome message to a client socket. If sending fails due to a TimeoutError,
-        ConnectionResetError, or any other exception, appropriate actions are taken, such as updating the
-        player count or closing the client socket.
+        Sends an encoded message to a player without blocking and records the send in the metrics. What the client
+        cannot take right away is queued by the sender. A player whose connection failed is dropped, and a slow
+        consumer is evicted, so a send never holds up the other players.
         Args:
-            client : A tuple containing the client socket and a boolean indicating if the client is active.
-            welcome_msg (str): The welcome message to send to the client.
-            player_name (str): player_name
+            player (Player): The player.
+            message (memoryview): The message, already encoded for the player's protocol.
+        Returns:
+            bool: True if the message was sent or queued.
         """
-        if not client[1]:
-            # print(Style.WARNING + f'send_welcome_message-Inactive Client: {player_name}' + Style.END_STYLE)
-            return
-        client_socket = client[0]
+        if not player.active:
+            return False
+        start_ns = perf_counter_ns()
         try:
-            client_socket.sendall(welcome_msg.encode())
-        except TimeoutError as te:
-            print(Style.FAIL + f'welcome_message-TimeoutError: {te}' + Style.END_STYLE)
-            self.player_count -= 1
-            return
-        except ConnectionResetError as cre:
-            print(Style.FAIL + f'welcome_message-ConnectionResetError: {cre}' + Style.END_STYLE)
-            self.player_count -= 1
-            client[1] = False
-            client_socket.close()
-            return
-        except Exception as e:
-            print(Style.FAIL + f'welcome_message-Exception: {e}' + Style.END_STYLE)
-            self.player_count -= 1
-            return
+            if not self.sender.send(player, message):
+                return False
+        except OSError as e:
+            self.metrics.send_errors.inc()
+            self.drop_player(player, f'{type(e).__name__}: {e}')
+            return False
+        self.metrics.sends.inc()
+        self.metrics.send_latency.observe_ns(perf_counter_ns() - start_ns)
+        return True
+
+    def broadcast(self, players, message):
+        """
+        Sends a message to every live player.
+        Args:
+            players (PlayerRegistry): The players.
+            message (message_cache.EncodedMessage): The message, encoded once per protocol.
+        """
+        for player in players:
+            self.send_message(player, message.for_codec(player.codec))
 
-    def send_question(self, client, player_name, trivia_question):
+    def evict_player(self, player, reason):
         """
-        This function sends a trivia question to a client socket. If the client is inactive,
-        a warning message is printed. If sending fails due to a TimeoutError, ConnectionResetError,
-        or any other exception, appropriate actions are taken, such as updating the player count or
-        closing the client socket.
+        Called by the sender when a player's client stops reading its messages or its connection fails.
         Args:
-            client: An array containing the client socket and a boolean indicating if the client is active.
-            player_name (str): The name of the player associated with the client socket.
-            trivia_question (str): The trivia question to send to the client.
+            player (Player): The player.
+            reason (str): Why the player is evicted, for the log.
         """
-        if not client[1]:
-            # print(Style.WARNING + f'send_question-Inactive Client: {player_name}' + Style.END_STYLE)
+        self.metrics.evictions.inc()
+        self.drop_player(player, reason)
+
+    def drop_player(self, player, reason):
+        """
+        Removes a player from the lobby and closes its connection. A player is only dropped once, however many
+        threads notice that it left.
+        Args:
+            player (Player): The player to drop.
+            reason (str): Why the player is dropped, for the log.
+        """
+        if not self.players.remove(player):
             return
-        client_socket = client[0]
-        try:
-            client_socket.sendall(trivia_question.encode())
-        except TimeoutError as te:
-            print(Style.FAIL + f'send_question-send_question-TimeoutError: {te}' + Style.END_STYLE)
-        except ConnectionResetError as cre:
-            print(Style.FAIL + f'send_question-ConnectionResetError: {cre}' + Style.END_STYLE)
-            self.player_count -= 1
-            client[1] = False
-            client_socket.close()
-        except Exception as e:
-            print(Style.FAIL + f'send_question-Exception: {e}' + Style.END_STYLE)
+        if self.persistent_sessions:
+            self.sessions.detach(player)
+        console.log(Style.FAIL, f'{player.name} disconnected: {reason}', console.WARNING, player=player.name)
+        self.metrics.disconnects.inc()
+        self.sender.discard(player)
+        player.connection.close()
 
-    def send_game_status(self, client, player_name, status_msg):
+    def flush_garbage(self, player):
         """
-        This function sends a game status message to a client socket. If the client is inactive,
-        a warning message is printed. If sending fails due to a TimeoutError or ConnectionResetError,
-        appropriate actions are taken, such as closing the client socket or updating the player count.
-        Any other exceptions raised during sending are propagated up as a socket timeout exception.
+        This method discards whatever the player sent since the previous round without waiting for more data,
+        so stale keypresses are never read as an answer to the next question and draining takes no time.
         Args:
-            client (tuple): A tuple containing the client socket and a boolean indicating if the client is active.
-            player_name (str): The name of the player associated with the client socket.
-            status_msg (str): The game status message to send to the client.
-        Raises:
-            socket.timeout: If an unexpected exception occurs during sending, it is raised as a socket timeout exception.
+            player (Player): The player.
         """
-        if not client[1]:
-            # print(Style.WARNING + f'send_game_status-Inactive Client: {player_name}' + Style.END_STYLE)
+        if not player.active:
             return
-        client_socket = client[0]
+        tcp_socket = player.connection  # Non-blocking, so only what is already buffered is read
         try:
-            client_socket.sendall(status_msg.encode())
-        except TimeoutError as te:
-            print(Style.FAIL + f'send_game_status-TimeoutError: {te}' + Style.END_STYLE)
-            client_socket.close()
-        except ConnectionResetError as cre:
-            print(Style.FAIL + f'send_game_status-ConnectionResetError: {cre}' + Style.END_STYLE)
-            self.player_count -= 1
-            client[1] = False
-            client_socket.close()
+            while True:
+                garbage = tcp_socket.recv(4096)  # Attempt to receive data from the socket
+                if not garbage:  # The client closed the connection
+                    break
+                player.codec.feed(garbage)  # Keep the frame parser in sync with the stream
         except Exception as e:
-            raise socket.timeout(f"send_game_status-Exception: {e}")
+            pass  # Nothing left to read
 
-    def flush_garbage(self, client, player_name):
+    def broadcast_question(self, players, trivia_question):
         """
-        This method reads and discards any remaining data in the client socket buffer.
+        This method encodes the question once per protocol and sends it to every live player in a single pass,
+        recording when each player's copy was handed to its socket. The fan-out skew of the round is logged.
         Args:
-            client (tuple): A tuple containing the client socket and a boolean indicating if the client is active.
-            player_name
+            players (PlayerRegistry): The players of the game.
+            trivia_question (str): The trivia question to send.
+        Returns:
+            dict: The perf_counter_ns() send time of every player the question was delivered to.
         """
-        if not client[1]:
-            # print(Style.WARNING + f'flush_garbage-Inactive Client: {player_name}' + Style.END_STYLE)
-            return
-        tcp_socket = client[0]
-        tcp_socket.settimeout(0.5)  # Set a short timeout for receiving data
-        while True:
-            try:
-                garbage = tcp_socket.recv(1024)  # Attempt to receive data from the socket
-                if not garbage:  # If no data is received, break out of the loop
-                    break
-            except Exception as e:
-                break
+        encoded_question = self.message_cache.get(protocol.QUESTION, trivia_question, self.round_id)
+        sent_ns = {}
+        for player in players:
+            start_ns = perf_counter_ns()
+            if self.send_message(player, encoded_question.for_codec(player.codec)):
+                sent_ns[player] = perf_counter_ns()
+                self.metrics.tracer.record('send_question', player.name, start_ns, sent_ns[player],
+                                           round_id=self.round_id)
+        if sent_ns:
+            skew_us = (max(sent_ns.values()) - min(sent_ns.values())) / 1000
+            console.log(Style.GRAY, f'Round {self.round_id}: question fan-out to {len(sent_ns)} players, '
+                                    f'skew {skew_us:.0f} us', console.DEBUG,
+                        round_id=self.round_id, players=len(sent_ns), skew_us=skew_us)
+        return sent_ns
 
-    def play_game(self, clients):
+    def play_game(self, players):
         """
-        This method generates a trivia question, sends it to each client, receives their answers,
+        This method generates a trivia question, sends it to each player, receives their answers,
         and determines the game outcome based on the correctness of the answers.
         Args:
-            clients (list): A list of tuples containing client sockets and booleans indicating if the clients are active.
+            players (PlayerRegistry): The players of the game.
         Returns:
             bool: A boolean indicating whether the game should be replayed.
         """
-        # Generate a trivia question and its correct answer
-        question, oracle_answer = trivia_generator.TriviaGenerator().get_question()
-        trivia_question = f'True or false: {question}?\n'
-        print(Style.HEADER + f'{trivia_question}' + Style.END_STYLE)
-        mutex = threading.Lock()  # Create a mutex for thread safety
-        # Iterate over each client and handle sending questions and receiving answers
-        for client, player_name in zip(clients, self.player_names):
-            if not client[1]:
-                # print(Style.WARNING + f'play_game-Inactive Client: {player_name}' + Style.END_STYLE)
-                continue
-            try:
-                # Send the trivia question to the client
-                th_send_q = threading.Thread(target=self.send_question, args=(client, player_name, trivia_question))
-                th_send_q.start()
-                th_send_q.join()
-                self.flush_garbage(client, player_name)  # Flush any remaining data in the socket buffer
-                client[0].settimeout(10)  # Set a timeout for receiving the answer
-                # Receive the answer from the client
-                th_get_ans = threading.Thread(target=self.get_answer, args=(client, player_name, mutex, oracle_answer))
-                th_get_ans.start()
-            except Exception as e:
-                print(Style.FAIL + f"Error starting thread: {e}" + Style.END_STYLE)
-                return False
-        # Wait for answers or timeout
-        init_time = datetime.now()
+        # Draw a trivia question; its type formats the prompt and validates the answers
+        question = self.questions.get_question()
+        trivia_question, oracle_answer = question.prompt, question.answer
+        console.log(Style.HEADER, trivia_question, round_id=self.round_id + 1)
         timeout_duration = 10
-        print("Time remaining:")
-        while datetime.now() - init_time < timedelta(seconds=timeout_duration) and self.final_answer == [-1, '']:
-            self.remaining_time = timeout_duration - (datetime.now() - init_time).seconds
-            print(self.remaining_time)
-            sleep(1)
+        self.round_id += 1  # Binary clients tag their answers with it, so late answers are dropped
+        # Drop input left over from the previous round before anyone sees the new question
+        for player in players:
+            self.flush_garbage(player)
+        arbiter = arbitration.AnswerArbiter(oracle_answer, timeout_duration)  # Decides the winner of the round
+        sent_ns = self.broadcast_question(players, trivia_question)
+        # A player who got the question later may still win with a faster answer during the fan-out skew
+        arbiter.fairness_window_ns = max(sent_ns.values()) - min(sent_ns.values()) if sent_ns else 0
+        if self.journal is not None:
+            self.journal.question(self.game_id, self.round_id, oracle_answer, timeout_duration,
+                                  arbiter.fairness_window_ns, trivia_question)
+        # Receive the answers from the players the question was delivered to, on one thread for the whole round
+        try:
+            answer_thread = threading.Thread(target=self.collect_answers, args=(sent_ns, question, arbiter))
+            answer_thread.start()
+        except Exception as e:
+            console.log(Style.FAIL, f"Error starting thread: {e}", console.ERROR)
+            arbiter.close()
+            arbiter.release()
+            return False
+        # Wait for the winner or timeout; the arbiter wakes us up as soon as the winner is settled
+        while not arbiter.settled() and arbiter.remaining() > 0:
+            self.remaining_time = int(arbiter.remaining()) + 1
+            console.log('', f'Time remaining: {self.remaining_time}', console.DEBUG)
+            arbiter.wait(min(1, arbiter.remaining()))
+            if self.stopping.is_set():
+                self.announce_shutdown()
+        winner = arbiter.close()
+        closed_ns = perf_counter_ns()
         # Determine game status and notify clients
-        game_status_msg = 'Expired'
+        game_status_msg = protocol.EXPIRED_MSG
         replay = True
-        if self.final_answer[0] == oracle_answer:
-            winner = self.final_answer[1]
+        if winner is not None:
+            self.final_answer = [oracle_answer, winner]
             game_status_msg = f"\n{winner} is correct! {winner} wins the game!\nCongratulations to the winner: {winner}\n"
-            print(Style.BLUE + Style.BOLD + game_status_msg + Style.END_STYLE)
+            if self.leaderboard is not None:
+                self.leaderboard.record_win(winner)  # In memory; the database is written in the background
+                game_status_msg += self.leaderboard.winner_line(winner) + '\n'
+            console.log(Style.BLUE + Style.BOLD, game_status_msg, winner=winner, round_id=self.round_id)
             replay = False
         # Send game status message to each client
-        for client, player_name in zip(clients, self.player_names):
-            try:
-                th_send_game_s = threading.Thread(target=self.send_game_status,
-                                                  args=(client, player_name, game_status_msg))
-                th_send_game_s.start()
-                th_send_game_s.join()
-            except Exception as e:
-                print(Style.FAIL + f"Error starting thread: {e}" + Style.END_STYLE)
-                return False
+        self.broadcast(players, self.message_cache.get(protocol.RESULT, game_status_msg))
+        # The closed arbiter woke the answer thread, so it finishes right away
+        answer_thread.join()
+        arbiter.release()
+        if self.journal is not None:
+            # Only now every answer of the round is in the journal
+            self.journal.result(self.game_id, self.round_id, winner, closed_ns)
         return replay
 
-    def get_answer(self, client, player_name, mutex, correct_ans):
+    def collect_answers(self, sent_ns, question, arbiter):
         """
-        This method receives the answer from a client, processes it, and updates the final answer if it's correct.
-        It also handles invalid answers and socket errors.
+        This method waits for the answers of every player of the round with one selector and hands each of them to
+        get_answer. It returns as soon as every player answered or left, or the arbiter closed the round.
+        Unlike select(), the selector has no limit on the socket file descriptors it watches.
         Args:
-            client (tuple): A tuple containing the client socket and a boolean indicating if the client is active.
-            player_name (str): The name of the player associated with the client socket.
-            mutex (_thread.lock): A mutex for thread safety.
-            correct_ans (int): The correct answer to the trivia question.
+            sent_ns (dict): perf_counter_ns() at which the question was sent to each player.
+            question (question_types.Question): The question of the current round.
+            arbiter (arbitration.AnswerArbiter): The arbiter of the current round.
         """
-        if not client[1]:
-            # print(Style.WARNING + f'get_answer-Inactive Client: {player_name}' + Style.END_STYLE)
-            return
-        client_socket = client[0]
-        raw_client_answer = b''  # Initialize raw_client_answer before the try block
-        processed_answer = -2
+        with selectors.DefaultSelector() as selector:
+            selector.register(arbiter, selectors.EVENT_READ, None)  # Readable once the round is closed
+            waiting = 0
+            for player, player_sent_ns in sent_ns.items():
+                if player.active:
+                    selector.register(player.connection, selectors.EVENT_READ, (player, player_sent_ns))
+                    waiting += 1
+            while waiting:
+                for key, _ in selector.select(arbiter.remaining()):
+                    if key.data is None:
+                        return
+                    player, player_sent_ns = key.data
+                    if self.get_answer(player, question, arbiter, player_sent_ns):
+                        selector.unregister(key.fileobj)
+                        waiting -= 1
+                if arbiter.remaining() == 0:
+                    return
+
+    def get_answer(self, player, question, arbiter, sent_ns):
+        """
+        This method reads what a player sent, processes its answer, and submits it to the round's arbiter.
+        It also handles invalid answers and drops players that disconnected.
+        Args:
+            player (Player): The player, whose socket is readable.
+            question (question_types.Question): The question of the current round.
+            arbiter (arbitration.AnswerArbiter): The arbiter of the current round.
+            sent_ns (int): perf_counter_ns() at which the question was sent to this player.
+        Returns:
+            bool: True once the player is done with the round: it answered, or it left or was evicted. False if
+                the answer is still incomplete.
+        """
+        if not player.active:
+            return True  # Dropped by another thread, e.g. evicted by the sender; its socket is closed
         try:
-            raw_client_answer = client_socket.recv(1024).decode().strip()  # Receive and decode the answer
-            if not raw_client_answer:
-                # print("empty msg")  # debug tool
-                client_socket.settimeout(0.01)
-                return
-            print(Style.CYAN + f'Player: {player_name}, Answer: {raw_client_answer}' + Style.END_STYLE)
-            mutex.acquire()  # Acquire mutex to ensure thread safety
-            if raw_client_answer.lower() in ['1', 't', 'y']:
-                processed_answer = 1  # Treat as True
-            elif raw_client_answer.lower() in ['0', 'f', 'n']:
-                processed_answer = 0  # Treat as False
-            else:
-                raise ValueError("Invalid answer format")
-        except ValueError as ve:
-            print(
-                Style.FAIL + f'Player: {player_name} provided an invalid answer: {raw_client_answer}' + Style.END_STYLE)
-        except TimeoutError as te:
-            # print(Style.FAIL + f'Timeout error for Player: {player_name}. Error: {te}' + Style.END_STYLE)  # debug tool
-            return
+            data = player.connection.recv(1024)
+        except BlockingIOError:
+            return False  # Nothing to read after all
         except socket.error as se:
-            print(Style.FAIL + f"Socket error: {se}" + Style.END_STYLE)
-            return
+            self.drop_player(player, f'Socket error: {se}')
+            return True
+        arrival_ns = perf_counter_ns()  # The answer is judged by its latency from sent_ns
+        if not data:
+            self.drop_player(player, 'connection closed')
+            return True
+        try:
+            # A binary answer frame may arrive in several pieces, and answers to earlier rounds are dropped
+            messages = player.codec.feed(data, self.round_id)
+        except protocol.ProtocolError as pe:
+            self.drop_player(player, f'Protocol error: {pe}')
+            return True
+        if not messages:
+            return False
+        raw_client_answer = messages[0].strip()  # Decode the answer
+        self.metrics.answers.inc()
+        self.metrics.answer_latency.observe_ns(arrival_ns - sent_ns)
+        self.metrics.tracer.record('get_answer', player.name, sent_ns, arrival_ns, round_id=self.round_id,
+                                   answer=raw_client_answer)
+        console.log(Style.CYAN, f'Player: {player.name}, Answer: {raw_client_answer}', console.DEBUG,
+                    player=player.name, answer=raw_client_answer)
+        processed_answer = question.parse(raw_client_answer)  # One lookup in the question's accepted answers
+        if self.journal is not None:
+            self.journal.answer(self.game_id, self.round_id, player.name, raw_client_answer, processed_answer,
+                                sent_ns, arrival_ns)
+        if processed_answer is None:
+            self.metrics.invalid_answers.inc()
+            console.log(Style.FAIL, f'Player: {player.name} provided an invalid answer: {raw_client_answer}',
+                        console.DEBUG, player=player.name, answer=raw_client_answer)
+            return True
+        if self.leaderboard is not None:
+            self.leaderboard.record_answer(player.name, processed_answer == arbiter.correct_answer,
+                                           arrival_ns - sent_ns)
+        arbiter.submit(player.name, processed_answer, arrival_ns, sent_ns)
+        return True
 
-        if processed_answer == correct_ans and self.final_answer[0] != correct_ans:
-            self.final_answer[0] = processed_answer
-            self.final_answer[1] = player_name
-        mutex.release()  # Release mutex after processing answer
-        while self.remaining_time > 1 and (not self.final_answer[0] == processed_answer):
-            # print(f'self.remaining_time = {self.remaining_time}')
-            try:
-                client_shit = client_socket.recv(1024).decode().strip()  # Receive additional input from client
-                if not client_shit:
-                    # print("empty msg") #debug tool
-                    client_socket.settimeout(0.01)
-                    return
-            except socket.timeout as st:
-                # Handle socket timeout
-                # print(Style.FAIL + f'Socket timeout: {st}' + Style.END_STYLE)
-                self.flush_garbage(client, player_name)
-                client_socket.settimeout(0.01)
-                return
-            except socket.error as se:
-                print(Style.FAIL + f"Socket error: {se}" + Style.END_STYLE)
-                client_socket.settimeout(0.01)
-                return
-            # print(Style.GRAY + f'{player_name}: {client_shit}' + Style.END_STYLE)
-        self.flush_garbage(client, player_name)
-        client_socket.settimeout(0.01)  # Set timeout for socket
-        return
+    def start_next_lobby(self):
+        """
+        Resets the lobby after a game. In session mode the players who are still connected stay in the lobby and
+        play the next game without reconnecting; every other connection is closed.
+        """
+        if not self.persistent_sessions:
+            for player in self.players.clear():
+                player.connection.close()
+        # The admission policy gives new players the usual window to join the players carried over
+        self.first_connection_time = monotonic() if self.player_count else None
+        self.last_connection_time = self.first_connection_time
+        for _ in range(self.player_count):
+            self.admission_metrics.record_join()  # Counted like the async rooms count re-admitted players
+        if self.player_count:
+            console.log(Style.GRAY, f'{self.player_count} players stay connected for the next game',
+                        players=self.player_count)
 
     def run_server(self):
         """
@@ -385,47 +608,105 @@ class Server:
         Note:
             This method continuously runs the server, managing client connections and gameplay until interrupted.
         """
-        print(Style.HEADER + Style.BOLD + self.server_name + Style.END_STYLE)
-        print(Style.CYAN + f'Server started successfully!' + Style.END_STYLE)
-        while True:
-            # Start threads for sending UDP offers and accepting TCP client connections
-            t1 = threading.Thread(target=self.send_udp_offers)
+        console.log(Style.HEADER + Style.BOLD, self.server_name)
+        console.log(Style.CYAN, f'Server started successfully!')
+        self.sender = outbound.Sender(self.evict_player)
+        # Offers are sent for as long as the server runs, telling the clients when the lobby is closed
+        offer_thread = threading.Thread(target=self.send_udp_offers, name='offers', daemon=True)
+        offer_thread.start()
+        while not self.stopping.is_set():
+            # Start the thread accepting TCP client connections
+            self.lobby_done.clear()
             t2 = threading.Thread(target=self.tcp_client_connect)
-            t1.start()
             t2.start()
 
-            # Wait for threads to finish
-            t1.join()
+            # Wait for the lobby to close
             t2.join()
-            welcome_message = self.build_welcome_message()
-            for client, player_name in zip(self.clients, self.player_names):
-                try:
-                    th_send_welcome = threading.Thread(target=self.send_welcome_message, args=(client, welcome_message, player_name))
-                    th_send_welcome.start()
-                    th_send_welcome.join()
-                except Exception as e:
-                    print(Style.FAIL + f"send_welcome: Error starting thread: {e}" + Style.END_STYLE)
-                    continue
+            self.log_admission()
+            self.game_id += 1
+            if self.journal is not None:
+                self.journal.lobby(self.game_id, [player.name for player in self.players])
+            if self.stopping.is_set():
+                break
+            self.broadcast(self.players, self.message_cache.get(protocol.WELCOME, self.build_welcome_message()))
 
             # Play the game with connected clients
             replay = True
-            while replay and self.player_count >= 1:
-                replay = self.play_game(self.clients)
+            while replay and self.player_count >= 1 and not self.stopping.is_set():
+                replay = self.play_game(self.players)
                 self.remaining_time = 0
                 sleep(2)
+            if self.stopping.is_set():
+                break
             # Reset game-related variables
             self.final_answer = [-1, '']
-            self.player_names = []
-            self.player_count = 0
-            self.clients = []
+            self.start_next_lobby()
 
             # Delay before starting the next round
             sleep(1)
+        self.announce_shutdown()
+        offer_thread.join()
+        self.shutdown()
+
+    def request_shutdown(self):
+        """
+        Asks the server to shut down gracefully: the lobby closes, the round in progress is played to its end, and
+        the players are told and disconnected once their queued messages were sent. Safe to call from a signal
+        handler or another thread: it only sets the stopping event, and the main loop logs the shutdown once it
+        sees it.
+        """
+        self.stopping.set()
+
+    def announce_shutdown(self):
+        """
+        Logs that the server is shutting down, once. Called by the main loop when it sees the stopping event, since
+        the signal handler that sets it must not take the console's lock.
+        """
+        if not self.shutdown_announced:
+            self.shutdown_announced = True
+            console.log(Style.WARNING, 'Shutting down after the current round...', console.WARNING)
+
+    def install_signal_handlers(self):
+        """
+        Makes SIGINT (Ctrl-C) and SIGTERM shut the server down gracefully. A second Ctrl-C stops it right away.
+        Must be called from the main thread.
+        """
+        def handle(signum, frame):
+            if self.stopping.is_set() and signum == signal.SIGINT:
+                raise KeyboardInterrupt
+            self.request_shutdown()
+
+        signal.signal(signal.SIGINT, handle)
+        signal.signal(signal.SIGTERM, handle)
+
+    def shutdown(self):
+        """
+        Tells the remaining players that the server is shutting down, waits up to DRAIN_TIMEOUT seconds for their
+        queued messages to be sent, and closes every connection, the journal and the leaderboard.
+        """
+        self.tcp_socket.close()
+        self.broadcast(self.players, self.message_cache.get(protocol.RESULT, protocol.SHUTDOWN_MSG))
+        undrained = self.sender.drain(outbound.DRAIN_TIMEOUT)
+        if undrained:
+            console.log(Style.WARNING, f'{undrained} players did not read their last messages', console.WARNING,
+                        players=undrained)
+        for player in self.players.clear():
+            player.connection.close()
+        self.sender.close()
+        if self.handshake_pool is not None:
+            self.handshake_pool.shutdown(wait=False)
+        if self.journal is not None:
+            self.journal.close()
+        if self.leaderboard is not None:
+            self.leaderboard.close()
+        console.log(Style.CYAN, 'Server stopped')
 
 
 if __name__ == '__main__':
     colorama.init()  # Initialize colorama for colored output (if used)
     # Initialize the server with specified parameters
-    server = Server(magic_cookie=0xabcddcba, message_type=0x02, server_port=4567, client_port=13117)
+    server = Server(magic_cookie=0xabcddcba, message_type=0x02, server_port=4567, client_port=13117,
+                    persistent_sessions=True, leaderboard_path='leaderboard.db')
+    server.install_signal_handlers()  # Ctrl-C drains the players and shuts down after the current round
     # Run the server
     server.run_server()
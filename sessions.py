@@ -0,0 +1,55 @@
+"""
+A SessionPool class that keeps the connections of players who stay attached to a server between games. In session
+mode the servers move every connected player into the next lobby when a game ends instead of closing the connection,
+so a player pays for discovery, the TCP handshake and the name exchange only once. The pool is keyed by player (the
+client's IP address and player name), which lets a player who reconnects after a drop replace its stale connection
+instead of appearing twice. Several clients behind one address may pick the same name, so a connection is only
+replaced once it is dead; until then the new client plays as a separate player.
+"""
+
+
+class SessionPool:
+    def __init__(self):
+        self.players = {}  # Attached Player by (ip, player name)
+
+    @staticmethod
+    def key(player):
+        """
+        Args:
+            player (player.Player): A player.
+        Returns:
+            tuple: The key of the player in the pool; the client port changes on every reconnect, so it is left out.
+        """
+        return player.address[0], player.name
+
+    def attach(self, player, is_alive):
+        """
+        Attaches a player's connection to the pool, replacing the connection attached under the same key if it is
+        dead.
+        Args:
+            player (player.Player): The player.
+            is_alive (function): Tells whether the connection of an attached player still works.
+        Returns:
+            player.Player: The player this one replaces, or None if no dead connection was replaced. The pool keeps
+                a live connection with the same key and leaves the new player out.
+        """
+        key = SessionPool.key(player)
+        previous = self.players.get(key)
+        if previous is not None and previous is not player and previous.active and is_alive(previous):
+            return None  # Another client with the same address and name is still playing
+        self.players[key] = player
+        return previous
+
+    def detach(self, player):
+        """
+        Removes a player from the pool, unless another connection of the player already replaced it, so a stale
+        connection never detaches the one that replaced it.
+        Args:
+            player (player.Player): The player.
+        """
+        key = SessionPool.key(player)
+        if self.players.get(key) is player:
+            del self.players[key]
+
+    def __len__(self):
+        return len(self.players)
@@ -0,0 +1,58 @@
+import pytest
+from admission import AdmissionPolicy, AdmissionMetrics
+
+
+def test_empty_lobby_stays_open():
+    policy = AdmissionPolicy(idle_timeout=10, lobby_deadline=60)
+    assert policy.seconds_until_close(0, None, None, now=100) is None
+    assert not policy.lobby_closed(0, None, None, now=1000)
+
+
+def test_lobby_waits_for_min_players():
+    policy = AdmissionPolicy(min_players=3, idle_timeout=1, lobby_deadline=5)
+    assert policy.seconds_until_close(2, 0, 0, now=100) is None
+    assert policy.lobby_closed(3, 0, 0, now=100)
+
+
+def test_full_lobby_closes_right_away():
+    policy = AdmissionPolicy(max_players=4, idle_timeout=10, lobby_deadline=60)
+    assert not policy.is_full(3)
+    assert policy.seconds_until_close(4, 0, 0, now=0) == 0
+    assert policy.lobby_closed(5, 0, 0, now=0)
+
+
+def test_idle_timeout_counts_from_last_join():
+    policy = AdmissionPolicy(idle_timeout=10, lobby_deadline=60)
+    assert policy.seconds_until_close(2, 0, 5, now=8) == pytest.approx(7)
+    assert not policy.lobby_closed(2, 0, 5, now=14.9)
+    assert policy.lobby_closed(2, 0, 5, now=15)
+
+
+def test_deadline_closes_a_lobby_that_keeps_getting_joins():
+    policy = AdmissionPolicy(idle_timeout=10, lobby_deadline=60)
+    # A join every 5 seconds never lets the idle timeout expire
+    assert policy.seconds_until_close(12, 0, 55, now=58) == pytest.approx(2)
+    assert policy.lobby_closed(13, 0, 59, now=60)
+
+
+def test_metrics_summary():
+    metrics = AdmissionMetrics()
+    assert metrics.summary() == {'joins': 0, 'lobbies': 0, 'avg_fill_time': 0.0, 'admission_rate': 0.0}
+    for _ in range(6):
+        metrics.record_join()
+    assert metrics.record_lobby(10, 12, 2) == 2
+    assert metrics.record_lobby(20, 24, 4) == 4
+    summary = metrics.summary()
+    assert summary['joins'] == 6
+    assert summary['lobbies'] == 2
+    assert summary['avg_fill_time'] == pytest.approx(3)
+    assert summary['admission_rate'] == pytest.approx(1)
+
+
+def test_metrics_average_over_recent_lobbies_only():
+    metrics = AdmissionMetrics()
+    metrics.record_lobby(0, 100, 1)
+    for _ in range(AdmissionMetrics.HISTORY):
+        metrics.record_lobby(0, 1, 1)
+    assert metrics.summary()['lobbies'] == AdmissionMetrics.HISTORY + 1
+    assert metrics.summary()['avg_fill_time'] == pytest.approx(1)
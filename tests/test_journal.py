@@ -0,0 +1,110 @@
+import pytest
+import journal
+from journal import JournalWriter, read_journal, replay
+
+
+def write_round(writer, game_id, round_id, answers, winner, closed_ns, fairness_window_ns=1000):
+    writer.question(game_id, round_id, 1, 10.0, fairness_window_ns, f'Question {round_id}?')
+    for player, raw, processed, sent_ns, arrival_ns in answers:
+        writer.answer(game_id, round_id, player, raw, processed, sent_ns, arrival_ns)
+    writer.result(game_id, round_id, winner, closed_ns)
+
+
+# (player, raw answer, processed answer, question sent ns, answer received ns)
+DISPUTED_ROUND = [
+    ('ann', 't', 1, 0, 500),  # First correct answer, 500ns latency
+    ('bob', 'yes', 1, 300, 700),  # Slower to arrive but faster to answer, within the fairness window
+    ('dave', 'maybe', None, 0, 800),  # Invalid
+    ('carl', 't', 1, 1900, 2000),  # Fastest, but after the winner was settled
+    ('erin', 'f', 0, 0, 2500),  # Wrong
+    ('fred', 't', 1, 3900, 4000),  # Read after the round closed
+]
+
+
+def test_records_round_trip(tmp_path):
+    path = str(tmp_path / 'game.journal')
+    writer = JournalWriter(path)
+    writer.lobby(1, ['ann', 'bob'])
+    write_round(writer, 1, 1, [('ann', 'b', 1, 10, 20), ('bob', '?', None, 10, 30)], 'ann', 40)
+    writer.result(1, 2, None, 50)
+    writer.close()
+    records = list(read_journal(path))
+    assert [record.record_type for record in records] == [journal.LOBBY_RECORD, journal.QUESTION_RECORD,
+                                                          journal.ANSWER_RECORD, journal.ANSWER_RECORD,
+                                                          journal.RESULT_RECORD, journal.RESULT_RECORD]
+    assert records[0].fields == {'players': ['ann', 'bob']}
+    assert records[1].fields == {'correct_answer': 1, 'timeout': 10.0, 'fairness_window_ns': 1000,
+                                 'question': 'Question 1?'}
+    assert (records[1].game_id, records[1].round_id) == (1, 1)
+    assert records[2].fields == {'player': 'ann', 'answer': 'b', 'processed': 1, 'sent_ns': 10, 'arrival_ns': 20}
+    assert records[3].fields['processed'] is None
+    assert records[4].fields == {'winner': 'ann', 'closed_ns': 40}
+    assert records[5].fields['winner'] is None
+
+
+def test_appending_to_an_existing_journal(tmp_path):
+    path = str(tmp_path / 'game.journal')
+    for game_id in (1, 2):
+        writer = JournalWriter(path)
+        writer.lobby(game_id, ['ann'])
+        writer.close()
+    assert [record.game_id for record in read_journal(path)] == [1, 2]
+
+
+def test_truncated_record_ends_the_stream(tmp_path):
+    path = str(tmp_path / 'game.journal')
+    writer = JournalWriter(path)
+    writer.lobby(1, ['ann'])
+    writer.lobby(2, ['bob'])
+    writer.close()
+    with open(path, 'r+b') as journal_file:
+        journal_file.truncate(journal_file.seek(0, 2) - 1)
+    assert [record.game_id for record in read_journal(path)] == [1]
+
+
+def test_not_a_journal(tmp_path):
+    path = tmp_path / 'bank.jsonl'
+    path.write_bytes(b'{"question": "?"}\n')
+    with pytest.raises(ValueError):
+        list(read_journal(str(path)))
+
+
+def test_replay_decides_the_disputed_round_again(tmp_path):
+    path = str(tmp_path / 'game.journal')
+    writer = JournalWriter(path)
+    write_round(writer, 1, 1, DISPUTED_ROUND, 'bob', 3000)
+    writer.close()
+    [round_replay] = replay(read_journal(path))
+    assert (round_replay.game_id, round_replay.round_id) == (1, 1)
+    assert round_replay.replayed_winner == 'bob'
+    assert round_replay.matches
+    assert round_replay.answers == 5  # fred's answer never reached the arbiter
+
+
+def test_replay_reports_a_different_winner(tmp_path):
+    path = str(tmp_path / 'game.journal')
+    writer = JournalWriter(path)
+    write_round(writer, 1, 1, DISPUTED_ROUND, 'ann', 3000)
+    writer.close()
+    [round_replay] = replay(read_journal(path))
+    assert round_replay.recorded_winner == 'ann'
+    assert round_replay.replayed_winner == 'bob'
+    assert not round_replay.matches
+
+
+def test_replay_of_interleaved_games(tmp_path):
+    path = str(tmp_path / 'game.journal')
+    writer = JournalWriter(path)
+    writer.question(1, 1, 1, 10.0, 0, 'Q?')
+    writer.question(2, 1, 0, 10.0, 0, 'Q?')
+    writer.answer(1, 1, 'ann', 't', 1, 0, 10)
+    writer.answer(2, 1, 'bob', 'f', 0, 0, 20)
+    writer.answer(2, 1, 'ann', 'f', 0, 0, 30)
+    writer.result(2, 1, 'bob', 100)
+    writer.result(1, 1, 'ann', 100)
+    writer.question(1, 2, 1, 10.0, 0, 'Q?')  # No result, e.g. the server crashed
+    writer.close()
+    rounds = {(replayed.game_id, replayed.round_id): replayed for replayed in replay(read_journal(path))}
+    assert sorted(rounds) == [(1, 1), (2, 1)]
+    assert rounds[1, 1].replayed_winner == 'ann' and rounds[1, 1].matches
+    assert rounds[2, 1].replayed_winner == 'bob' and rounds[2, 1].answers == 2
@@ -0,0 +1,101 @@
+import random
+import pytest
+from leaderboard import RankTree, Leaderboard
+
+
+def brute_rank(wins_list, wins):
+    return 1 + sum(other > wins for other in wins_list)
+
+
+def test_rank_tree_matches_a_sorted_list():
+    rng = random.Random(1)
+    tree = RankTree(size=4)  # Small, so the tree has to grow
+    players = []
+    for _ in range(5000):
+        if players and rng.random() < 0.3:
+            i = rng.randrange(len(players))
+            tree.add(players[i], -1)
+            players[i] += rng.randint(1, 3)
+            tree.add(players[i], 1)
+        elif players and rng.random() < 0.1:
+            tree.add(players.pop(rng.randrange(len(players))), -1)
+        else:
+            players.append(rng.randint(0, 20))
+            tree.add(players[-1], 1)
+        wins = rng.randint(0, 100)
+        assert tree.rank(wins) == brute_rank(players, wins)
+        assert tree.total == len(players)
+    ordered = sorted(players)
+    assert [tree.kth(k) for k in range(1, len(ordered) + 1)] == ordered
+
+
+def test_rank_tree_ties_share_a_rank():
+    tree = RankTree()
+    for wins in (5, 5, 3, 0):
+        tree.add(wins, 1)
+    assert [tree.rank(wins) for wins in (5, 3, 0)] == [1, 3, 4]
+    assert tree.rank(100) == 1
+    assert tree.count_at_most(4) == 2
+
+
+@pytest.fixture
+def board(tmp_path):
+    leaderboard = Leaderboard(str(tmp_path / 'leaderboard.db'), flush_interval=3600)
+    yield leaderboard
+    leaderboard.close()
+
+
+def test_top_and_rank(board):
+    for name, wins in (('ann', 3), ('bob', 1), ('carl', 3), ('dave', 0)):
+        board.record_answer(name, True, 10 ** 9)
+        for _ in range(wins):
+            board.record_win(name)
+    assert [stats.name for stats in board.top(3)] == ['ann', 'carl', 'bob']
+    assert board.rank('carl') == (1, 4)
+    assert board.rank('dave') == (4, 4)
+    assert board.rank('erin') is None
+    assert board.standings().splitlines()[1:] == [f'{i + 1}. {board.players[name].describe()}'
+                                                  for i, name in enumerate(('ann', 'carl', 'bob'))]
+    assert 'rank 3 of 4' in board.winner_line('bob')
+
+
+def test_nobody_won_yet(board):
+    board.record_answer('ann', False, 10 ** 9)
+    assert board.standings() == ''
+
+
+def test_statistics_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'leaderboard.db')
+    board = Leaderboard(path, flush_interval=3600)
+    board.record_answer('ann', True, 2 * 10 ** 9)
+    board.record_answer('ann', False, 10 ** 9)
+    board.record_win('ann')
+    board.close()
+    board = Leaderboard(path, flush_interval=3600)
+    stats = board.players['ann']
+    assert (stats.wins, stats.answers, stats.correct) == (1, 2, 1)
+    assert stats.accuracy == 0.5 and stats.mean_latency == pytest.approx(1.5)
+    board.close()
+
+
+def test_workers_sharing_a_database_see_each_others_wins(tmp_path):
+    path = str(tmp_path / 'leaderboard.db')
+    first, second = Leaderboard(path, flush_interval=3600), Leaderboard(path, flush_interval=3600)
+    for _ in range(3):
+        first.record_win('ann')
+    second.record_win('bob')
+    second.record_win('ann')
+    first.flush()
+    second.flush()
+    second.record_win('bob')  # Not flushed yet, kept on top of the stored totals
+    first.refresh()
+    second.refresh()
+    assert first.players['ann'].wins == second.players['ann'].wins == 4
+    assert first.players['bob'].wins == 1
+    assert second.players['bob'].wins == 2
+    assert first.rank('bob') == (2, 2)
+    first.close()
+    second.close()
+    board = Leaderboard(path, flush_interval=3600)
+    assert (board.players['ann'].wins, board.players['bob'].wins) == (4, 2)
+    board.close()
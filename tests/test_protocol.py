@@ -0,0 +1,89 @@
+import pytest
+import protocol
+from protocol import FrameParser, BinaryCodec, TextCodec, ProtocolError
+
+
+def answer_frame(round_id, answer):
+    return protocol.encode_frame(protocol.ANSWER, protocol.ROUND_ID.pack(round_id) + answer)
+
+
+def test_parser_fed_byte_by_byte():
+    data = protocol.encode_frame(protocol.JOIN, b'ann') + answer_frame(7, b't')
+    parser = FrameParser()
+    frames = []
+    for i in range(len(data)):
+        frames.extend(parser.feed(data[i:i + 1]))
+    assert frames == [(protocol.JOIN, b'ann'), (protocol.ANSWER, protocol.ROUND_ID.pack(7) + b't')]
+    assert not parser.buffer
+
+
+def test_parser_returns_every_coalesced_frame_and_keeps_the_partial_one():
+    frames = [protocol.encode_frame(protocol.WELCOME, b'hi'), protocol.encode_frame(protocol.RESULT, b''),
+              protocol.encode_frame(protocol.QUESTION, b'x' * 300)]
+    data = b''.join(frames)
+    parser = FrameParser()
+    assert parser.feed(data[:-10]) == [(protocol.WELCOME, b'hi'), (protocol.RESULT, b'')]
+    assert parser.feed(data[-10:]) == [(protocol.QUESTION, b'x' * 300)]
+
+
+def test_parser_rejects_other_versions():
+    data = protocol.FRAME_HEADER.pack(protocol.PROTOCOL_VERSION + 1, protocol.JOIN, 0)
+    with pytest.raises(ProtocolError):
+        FrameParser().feed(data)
+
+
+def test_payload_too_large():
+    protocol.encode_frame(protocol.WELCOME, b'x' * protocol.MAX_PAYLOAD)
+    with pytest.raises(ProtocolError):
+        protocol.encode_frame(protocol.WELCOME, b'x' * (protocol.MAX_PAYLOAD + 1))
+
+
+def test_binary_encode_tags_questions_and_results():
+    codec = BinaryCodec()
+    parser = FrameParser()
+    [(frame_type, payload)] = parser.feed(codec.encode(protocol.QUESTION, 'Q?', round_id=42))
+    assert frame_type == protocol.QUESTION
+    assert protocol.ROUND_ID.unpack_from(payload)[0] == 42
+    assert payload[protocol.ROUND_ID.size:] == b'Q?'
+    [(_, payload)] = parser.feed(codec.encode(protocol.RESULT, protocol.EXPIRED_MSG))
+    assert payload[0] == protocol.RESULT_EXPIRED
+    [(_, payload)] = parser.feed(codec.encode(protocol.RESULT, 'ann wins'))
+    assert payload == bytes([protocol.RESULT_WINNER]) + b'ann wins'
+
+
+def test_binary_feed_keeps_only_answers_to_the_current_round():
+    codec = BinaryCodec()
+    assert codec.feed(protocol.encode_frame(protocol.JOIN, 'änn'.encode())) == ['änn']
+    data = answer_frame(1, b'late') + answer_frame(2, b't')
+    assert codec.feed(data, round_id=2) == ['t']
+    assert codec.feed(answer_frame(2, b'f')) == []  # No question open
+
+
+def test_binary_feed_drops_join_frames_after_the_handshake():
+    codec = BinaryCodec()
+    assert codec.feed(protocol.encode_frame(protocol.JOIN, b'ann') + protocol.encode_frame(protocol.JOIN, b'x')) \
+        == ['ann']
+    assert codec.feed(protocol.encode_frame(protocol.JOIN, b'bob') + answer_frame(3, b't'), round_id=3) == ['t']
+
+
+@pytest.mark.parametrize('data', [
+    protocol.encode_frame(protocol.ANSWER, b'\x00\x01'),  # Shorter than a round id
+    protocol.encode_frame(protocol.QUESTION, b'Q?'),  # Only the server sends questions
+])
+def test_binary_feed_rejects_invalid_frames(data):
+    with pytest.raises(ProtocolError):
+        BinaryCodec().feed(data, round_id=0)
+
+
+def test_text_codec():
+    codec = TextCodec()
+    assert codec.encode(protocol.QUESTION, 'Q?', round_id=3) == b'Q?'
+    assert codec.feed(b'ann\n') == ['ann\n']
+    assert codec.feed(b'') == []
+
+
+def test_negotiate():
+    codec, rest = protocol.negotiate(protocol.NEGOTIATION_BYTE + b'\x01')
+    assert isinstance(codec, BinaryCodec) and rest == b'\x01'
+    codec, rest = protocol.negotiate(b'ann')
+    assert isinstance(codec, TextCodec) and rest == b'ann'
@@ -0,0 +1,51 @@
+import json
+import pytest
+from question_bank import QuestionBank
+from trivia_generator import QuestionCursor
+
+
+class FakeBank(list):
+    path = 'fake.jsonl'
+
+
+def write_bank(path, count):
+    with open(path, 'w') as bank_file:
+        for i in range(count):
+            bank_file.write(json.dumps({'question': f'Question {i}', 'answer': i % 2}) + '\n')
+    return QuestionBank(str(path))
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 16, 100, 1000, 4097])
+def test_permutation_is_a_bijection(size):
+    cursor = QuestionCursor(FakeBank(range(size)), seed=size)
+    assert sorted(cursor.permute(i) for i in range(size)) == list(range(size))
+
+
+def test_seed_decides_the_order():
+    bank = FakeBank(range(1000))
+    order = [QuestionCursor(bank, seed=1).permute(i) for i in range(1000)]
+    assert [QuestionCursor(bank, seed=1).permute(i) for i in range(1000)] == order
+    assert [QuestionCursor(bank, seed=2).permute(i) for i in range(1000)] != order
+    assert order != list(range(1000))
+
+
+def test_every_question_once_per_pass(tmp_path):
+    bank = write_bank(tmp_path / 'bank.jsonl', 50)
+    cursor = QuestionCursor(bank, seed=7)
+    first_pass = [cursor.get_question().text for _ in range(50)]
+    assert sorted(first_pass) == sorted(f'Question {i}' for i in range(50))
+    second_pass = [cursor.get_question().text for _ in range(50)]
+    assert cursor.epoch == 1
+    assert sorted(second_pass) == sorted(first_pass)
+    assert second_pass != first_pass  # Every pass uses a different order
+
+
+def test_replay_with_the_same_seed(tmp_path):
+    bank = write_bank(tmp_path / 'bank.jsonl', 20)
+    first, second = QuestionCursor(bank, seed=3), QuestionCursor(bank, seed=3)
+    assert [first.get_question().text for _ in range(30)] == [second.get_question().text for _ in range(30)]
+
+
+def test_empty_bank():
+    with pytest.raises(ValueError):
+        QuestionCursor(FakeBank())
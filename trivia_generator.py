@@ -1,4 +1,9 @@
+import os
 import random
+import question_bank
+import question_types
+import console
+from style import Style
 
 
 class TriviaGenerator:
@@ -6,6 +11,7 @@ class TriviaGenerator:
    A singleton class designed to provide a consistent set of trivia questions and answers
    throughout an application's lifecycle. This class ensures that the same pool of trivia
    questions is shared across all instances, preventing duplicate questions during a session.
+   The questions are loaded from the on-disk bank at BANK_PATH.
    """
 
     _instance = None
@@ -16,53 +22,102 @@ class TriviaGenerator:
             cls._instance.initialize()
         return cls._instance
 
+    BANK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'questions.jsonl')  # Default bank file
+
     def initialize(self):
-        # Initial pool of questions and their answers
-        self.questions_and_answers = [
-            ("Cats can make over 100 different sounds, while dogs can only make about 10.", 1),
-            ("A group of flamingos is called a 'flamboyance'.", 1),
-            ("Bananas grow on trees.", 0),  # They grow on large herb plants.
-            ("Venus is the hottest planet in our solar system.", 1),
-            ("A duck's quack doesn't echo, and no one knows why.", 0),  # Myth; a duck's quack does echo.
-            ("Humans and dinosaurs coexisted at the same point in history.", 0),
-            ("You can sneeze in your sleep.", 0),
-            ("An octopus has three hearts.", 1),
-            ("The Great Wall of China is visible from space.", 0),  # Not visible to the naked eye from space.
-            ("A group of crows is called a 'murder'.", 1),
-            ("Cats can bark.", 0),
-            ("Ducks have three eyelids.", 1),
-            ("Bananas grow upside down.", 1),
-            ("A group of flamingos is called a 'flamboyance'.", 1),
-            ("Humans can't breathe and swallow at the same time.", 1),
-            ("Penguins can fly if they really try.", 0),
-            ("A snail can sleep for three years.", 1),
-            ("Venus is the hottest planet in our solar system.", 1),
-            ("Some turtles can breathe through their butts.", 1),
-            ("The moon is closer to Earth than Mars is.", 1),
-            ("A cow-bison hybrid is called a 'Beefalo'.", 1),
-            ("Sharks are immune to all known diseases.", 0),
-            ("You can sneeze in your sleep.", 0),
-            ("Octopuses have three hearts.", 1),
-            ("The Great Wall of China is visible from space.", 0),
-            ("Goldfish only have a memory of three seconds.", 0),
-            ("The Atlantic Ocean is the warmest ocean on Earth.", 0),
-            ("A group of unicorns is called a 'blessing'.", 1),
-            ("Rainbows can only form in the morning.", 0),
-            ("Chocolate can be lethal to dogs.", 1)
+        # Memory-mapped pool of unique questions and their answers, decoded only when drawn
+        self.questions_and_answers = question_bank.QuestionBank(TriviaGenerator.BANK_PATH)
+        # Process-wide cursor used by get_question
+        self.default_cursor = self.cursor()
 
-        ]
-        # Copy the initial pool to a working list that will be modified during the session
-        self.available_questions_and_answers = self.questions_and_answers.copy()
+    def cursor(self, seed=None):
+        """
+        Creates an independent question stream over the shared bank, e.g. one per game room.
+        Args:
+            seed (int, optional): Seed of the question order, to replay a game. Defaults to a random seed.
+        Returns:
+            QuestionCursor: The new cursor.
+        """
+        return QuestionCursor(self.questions_and_answers, seed)
 
     def get_question(self):
-        if not self.available_questions_and_answers:
-            # Optionally reset the question list if all have been asked, or handle this case differently
-            print("All questions have been asked, resetting the list.")
-            self.available_questions_and_answers = self.questions_and_answers.copy()
+        return self.default_cursor.get_question()
+
+    def questions_by_prompt(self):
+        """
+        Decodes the whole bank, for the load generators that need to know the answers.
+        Returns:
+            dict: Every question of the bank by the prompt the servers send for it.
+        """
+        questions = map(question_types.build_question, self.questions_and_answers)
+        return {question.prompt: question for question in questions}
+
 
-        # Randomly select a question and its answer from the available pool
-        question, answer = random.choice(self.available_questions_and_answers)
-        # Remove the selected question from the pool to avoid repetition
-        self.available_questions_and_answers.remove((question, answer))
-        return question, answer
+class QuestionCursor:
+    """
+    A stream of questions drawn from a shared, read-only bank in a seeded pseudo-random order without repetition.
+    Instead of a shuffled copy of the bank, the order is a keyed Feistel permutation of the question indices, so a
+    cursor costs O(1) memory whatever the size of the bank, needs no lock because it never modifies the bank, and
+    replays the same questions when created again with the same seed.
+    """
+    ROUNDS = 4  # Feistel rounds of the permutation
 
+    def __init__(self, bank, seed=None):
+        """
+        Initializes the QuestionCursor class.
+        param:
+            bank (question_bank.QuestionBank): The shared bank to draw questions from.
+            seed (int, optional): Seed of the question order. Defaults to a random seed.
+        Raises:
+            ValueError: If the bank holds no question, since the cursor would never find one to draw.
+        """
+        if len(bank) == 0:
+            raise ValueError(f'{bank.path} holds no questions')
+        self.bank = bank
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.position = 0  # Number of questions drawn in the current pass over the bank
+        self.epoch = 0  # Number of completed passes; every pass uses a different order
+        # The permutation works on 2 * half_bits bit numbers, the smallest even width that covers the bank
+        self.half_bits = max(1, ((len(bank) - 1).bit_length() + 1) // 2)
+        self.half_mask = (1 << self.half_bits) - 1
+        self.keys = self.round_keys()
+
+    def round_keys(self):
+        """
+        Returns:
+            list: The Feistel round keys of the current pass, derived from the seed and the epoch.
+        """
+        key_source = random.Random(f'{self.seed}:{self.epoch}')
+        return [key_source.getrandbits(32) for _ in range(QuestionCursor.ROUNDS)]
+
+    def permute(self, i):
+        """
+        Maps a position of the stream to a question index. Values that fall outside the bank are permuted again
+        (cycle walking), which keeps the mapping a permutation of the bank's indices.
+        Args:
+            i (int): Position in the current pass, smaller than the bank size.
+        Returns:
+            int: Index of the question at that position.
+        """
+        while True:
+            left, right = i >> self.half_bits, i & self.half_mask
+            for key in self.keys:
+                left, right = right, left ^ ((((right ^ key) * 0x9E3779B1) >> 7) & self.half_mask)
+            i = (left << self.half_bits) | right
+            if i < len(self.bank):
+                return i
+
+    def get_question(self):
+        """
+        Returns:
+            question_types.Question: The next question, with its answers normalized for validation.
+        """
+        if self.position >= len(self.bank):
+            # Every question was asked; start another pass in a different order
+            console.log(Style.GRAY, 'All questions have been asked, resetting the list.', epoch=self.epoch + 1)
+            self.position = 0
+            self.epoch += 1
+            self.keys = self.round_keys()
+        question_index = self.permute(self.position)
+        self.position += 1
+        return question_types.build_question(self.bank[question_index])